@@ -0,0 +1,265 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+import httpx
+import streamlit as st
+from api import client
+from api.resilience import CircuitOpenError, backoff_delay, is_failure
+from config import ASYNC_HTTP2, ASYNC_MAX_CONNECTIONS, RETRY_MAX_ATTEMPTS
+from utils.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# One event loop per process, run on a daemon thread, so the pooled
+# connection survives across Streamlit reruns and sessions
+_loop = None
+_loop_lock = threading.Lock()
+_http = None
+
+# Errors that the sync client shows with st.error; collected here because
+# Streamlit elements can only be created from the script thread
+_ui_errors = contextvars.ContextVar("ui_errors", default=None)
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="api-async-loop", daemon=True).start()
+        return _loop
+
+def _get_http():
+    """Return the shared AsyncClient, creating it on the event loop thread"""
+    global _http
+    if _http is None:
+        limits = httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS, max_keepalive_connections=ASYNC_MAX_CONNECTIONS)
+        try:
+            _http = httpx.AsyncClient(http2=ASYNC_HTTP2, limits=limits, timeout=None)
+        except ImportError:
+            # http2=True needs the optional h2 package
+            logger.warning("h2 is not installed, falling back to HTTP/1.1")
+            _http = httpx.AsyncClient(limits=limits, timeout=None)
+    return _http
+
+async def _request(endpoint, method, url, attempts=1, **kwargs):
+    """Async counterpart of client.api_request, sharing its breaker and timeouts"""
+    guard = client.get_backend_guard()
+    policy = guard.timeouts(endpoint)
+    timeout = kwargs.pop("timeout", None) or policy.timeout()
+
+    for attempt in range(attempts):
+        probe = guard.breaker.before_call()
+        try:
+            start = time.perf_counter()
+            try:
+                response = await _get_http().request(method, url, timeout=timeout, **kwargs)
+            except httpx.HTTPError as e:
+                guard.record(endpoint, time.perf_counter() - start, ok=False)
+                if attempt < attempts - 1:
+                    logger.warning(f"Request to {endpoint} failed ({str(e)}), retrying ({attempt+1}/{attempts})...")
+                    await asyncio.sleep(backoff_delay(attempt))
+                    continue
+                raise
+
+            failed = is_failure(response)
+            guard.record(endpoint, time.perf_counter() - start, ok=not failed)
+        finally:
+            # Cancellation or any other exception must not leave the breaker stuck half-open
+            guard.breaker.release_probe(probe)
+        if not failed or attempt == attempts - 1:
+            return response
+        logger.warning(f"Request to {endpoint} returned {response.status_code}, retrying ({attempt+1}/{attempts})...")
+        await asyncio.sleep(backoff_delay(attempt))
+
+def _ui_error(message):
+    errors = _ui_errors.get()
+    if errors is None:
+        logger.error(message)
+    else:
+        errors.append(message)
+
+def run_concurrently(*calls):
+    """
+    Run independent API coroutines concurrently and wait for all of them
+
+    Use this for calls that one rerun needs but that do not depend on each
+    other, so the page waits for the slowest call instead of their sum:
+
+        health, scans = run_concurrently(get_api_health(), get_scan_list())
+
+    The coroutines share one event loop, so they read and write the
+    file-backed metadata and slice caches through asyncio.to_thread, never
+    holding up the other requests in flight.
+
+    Parameters:
+    -----------
+    *calls : coroutine
+        Coroutines from this module
+
+    Returns:
+    --------
+    list
+        The results in the order the calls were given
+    """
+    async def gather():
+        errors = []
+        _ui_errors.set(errors)
+        results = await asyncio.gather(*calls)
+        return results, errors
+
+    results, errors = asyncio.run_coroutine_threadsafe(gather(), _get_loop()).result()
+    for message in errors:
+        st.error(message)
+    return results
+
+async def get_api_health():
+    """Check API health"""
+    try:
+        response = await _request("health", "GET", f"{client.API_URL}/health")
+        if response.status_code == 200:
+            return response.json()
+        else:
+            logger.error(f"API health check failed: {response.status_code} - {response.text}")
+            return {"status": "error", "model_loaded": False}
+    except Exception as e:
+        logger.error(f"Error connecting to API: {str(e)}")
+        return {"status": "error", "model_loaded": False}
+
+async def upload_scan(file):
+    """Upload a scan to the API"""
+    try:
+        files = {"file": file}
+        response = await _request("upload", "POST", f"{client.API_URL}/upload", files=files)
+
+        if response.status_code == 200:
+            scan_info = response.json()
+            await asyncio.to_thread(client.cache_metadata, [scan_info])
+            return scan_info
+        else:
+            _ui_error(f"Error uploading scan: {response.text}")
+            return None
+    except Exception as e:
+        _ui_error(f"Error uploading scan: {str(e)}")
+        return None
+
+async def get_scan_list():
+    """Get list of available scans"""
+    try:
+        response = await _request("scans", "GET", f"{client.API_URL}/scans", attempts=RETRY_MAX_ATTEMPTS)
+
+        if response.status_code == 200:
+            scans = response.json()
+            await asyncio.to_thread(client.cache_metadata, scans)
+            return scans
+        else:
+            _ui_error(f"Error getting scan list: {response.text}")
+            return []
+    except Exception as e:
+        _ui_error(f"Error getting scan list: {str(e)}")
+        return []
+
+async def get_scan_metadata(scan_id):
+    """Get metadata for a specific scan, sharing the sync client's metadata cache"""
+    cached = await asyncio.to_thread(client.get_cached_metadata, scan_id)
+    if cached is not None:
+        return cached
+
+    try:
+        response = await _request("scans", "GET", f"{client.API_URL}/scans/{scan_id}",
+                                  attempts=RETRY_MAX_ATTEMPTS)
+
+        if response.status_code == 200:
+            metadata = response.json()
+            await asyncio.to_thread(client.cache_metadata, [dict(metadata, scan_id=scan_id)])
+            return metadata
+        else:
+            logger.error(f"Error getting scan metadata: {response.text}")
+            return None
+    except Exception as e:
+        logger.error(f"Error getting scan metadata: {str(e)}")
+        return None
+
+async def get_scan_slice(scan_id, view, slice_idx, window_center, window_width):
+    """Get a specific slice from a scan, sharing the viewer's slice cache"""
+    from core.slice_source import RemoteSliceSource, get_cached_slice, cache_slice
+    key = RemoteSliceSource(scan_id).cache_key(view, slice_idx, window_center, window_width)
+    cached = await asyncio.to_thread(get_cached_slice, key)
+    if cached is not None:
+        return cached
+
+    try:
+        params = {
+            "view": view,
+            "slice_idx": slice_idx,
+            "window_center": window_center,
+            "window_width": window_width
+        }
+
+        headers = {"Accept": client.SLICE_ACCEPT.get(client.SLICE_TRANSPORT, client.SLICE_ACCEPT["json"])}
+
+        with timed("async_client.get_scan_slice.network"):
+            response = await _request("slice", "GET", f"{client.API_URL}/slice/{scan_id}",
+                                      attempts=RETRY_MAX_ATTEMPTS, params=params, headers=headers)
+            if response.status_code == 406:
+                # Server cannot produce any binary format we asked for
+                response = await _request("slice", "GET", f"{client.API_URL}/slice/{scan_id}",
+                                          attempts=RETRY_MAX_ATTEMPTS, params=params)
+
+        if response.status_code == 200:
+            with timed("async_client.get_scan_slice.decode"):
+                slice_data = client.decode_slice_payload(response.headers, response.content, params)
+            await asyncio.to_thread(cache_slice, key, slice_data)
+            return slice_data
+        else:
+            logger.error(f"Error getting scan slice: {response.text}")
+            return None
+    except Exception as e:
+        logger.error(f"Error getting scan slice: {str(e)}")
+        return None
+
+async def ask_question(scan_id, question):
+    """Ask a question about a scan"""
+    try:
+        data = {"text": question}
+        response = await _request("ask", "POST", f"{client.API_URL}/ask/{scan_id}", json=data)
+
+        if response.status_code == 200:
+            return response.json()
+        else:
+            logger.error(f"Error asking question: {response.text}")
+            return None
+    except Exception as e:
+        logger.error(f"Error asking question: {str(e)}")
+        return None
+
+async def analyze_scan(scan_id, questions):
+    """Call the API to analyze a scan with questions"""
+    try:
+        url = f"{client.API_URL}/analyze"
+        payload = {
+            "scan_id": scan_id,
+            "questions": [{"text": q} for q in questions]
+        }
+
+        logger.info(f"Sending analyze request for scan {scan_id}")
+
+        # Retried with jittered backoff; fails fast while the backend circuit is open
+        response = await _request("analyze", "POST", url, attempts=RETRY_MAX_ATTEMPTS, json=payload)
+
+        if response.status_code == 200:
+            result = response.json()
+            logger.info(f"Successfully analyzed scan {scan_id}")
+            return result
+        else:
+            logger.error(f"API Error {response.status_code}: {response.text}")
+            return None
+    except CircuitOpenError as e:
+        logger.warning(f"Skipping analyze request for scan {scan_id}: {str(e)}")
+        return None
+    except Exception as e:
+        logger.error(f"Error calling analyze API: {str(e)}")
+        import traceback
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        return None
@@ -4,16 +4,163 @@ import os
 import logging
 import time
 import json
+import threading
+from requests.structures import CaseInsensitiveDict
+from config import (
+    SLICE_TRANSPORT, SLICE_BATCH_MAX, RETRY_MAX_ATTEMPTS,
+    METADATA_REQUIRED_FIELDS
+)
+from api.resilience import BackendGuard, CircuitOpenError, backoff_delay, hedged, is_failure
+from utils.metrics import timed
+from utils.shared_cache import metadata_cache
 
 logger = logging.getLogger(__name__)
 
 # API configuration
 API_URL = os.environ.get("API_URL", "http://localhost:8000")
 
+# Accept headers per slice transport, most preferred first. JSON stays
+# acceptable at a low q so servers without binary support still answer.
+SLICE_ACCEPT = {
+    "webp": "image/webp, image/png;q=0.9, application/json;q=0.1",
+    "png": "image/png, application/json;q=0.1",
+    "uint8": "application/octet-stream;dtype=uint8, image/png;q=0.9, application/json;q=0.1",
+    "int16": "application/octet-stream;dtype=int16, image/png;q=0.9, application/json;q=0.1",
+    "json": "application/json",
+}
+
+# Servers known not to implement /slices, which get sequential requests instead
+_batch_unsupported = set()
+
+# Scan metadata shared by all sessions in the process, keyed by API URL and
+# scan ID, and mirrored entry by entry to the host-wide metadata cache, so
+# other workers and restarts start warm
+_metadata_cache = {}
+_metadata_lock = threading.Lock()
+
+def get_cached_metadata(scan_id):
+    """
+    Return cached metadata for a scan, or None
+    
+    Entries that lack any of METADATA_REQUIRED_FIELDS, e.g. a listing that
+    only carries names, count as misses so the caller fetches the full record.
+    """
+    key = (API_URL, scan_id)
+    with _metadata_lock:
+        metadata = _metadata_cache.get(key)
+    if metadata is None:
+        # Another worker may have listed or uploaded it; one small entry to read
+        metadata = metadata_cache.get(key)
+        if metadata is not None:
+            with _metadata_lock:
+                _metadata_cache[key] = metadata
+    if metadata is None or any(field not in metadata for field in METADATA_REQUIRED_FIELDS):
+        return None
+    return metadata
+
+def cache_metadata(records):
+    """
+    Merge scan metadata records into the cache and persist the entries that changed
+    
+    Parameters:
+    -----------
+    records : list of dict
+        Metadata records, each with a "scan_id"
+    """
+    changed = {}
+    with _metadata_lock:
+        for record in records:
+            if not isinstance(record, dict) or "scan_id" not in record:
+                continue
+            key = (API_URL, record["scan_id"])
+            merged = {**_metadata_cache.get(key, {}), **record}
+            if merged != _metadata_cache.get(key):
+                _metadata_cache[key] = merged
+                changed[key] = merged
+    # Each entry is written atomically on its own, so workers never drop each other's
+    for key, metadata in changed.items():
+        metadata_cache.put(key, metadata)
+
+# Circuit breaker and timeout state per backend URL
+_guards = {}
+_guards_lock = threading.Lock()
+
+def get_backend_guard():
+    """Return the resilience state for the current API_URL"""
+    with _guards_lock:
+        if API_URL not in _guards:
+            _guards[API_URL] = BackendGuard()
+        return _guards[API_URL]
+
+def api_request(endpoint, method, url, attempts=1, hedge=False, **kwargs):
+    """
+    Send a request through the shared resilience layer
+    
+    The call fails fast with CircuitOpenError while the backend's circuit is
+    open. Otherwise it uses the endpoint's adaptive timeout unless one is
+    given. Connection errors, timeouts and 5xx responses are retried with
+    jittered exponential backoff up to `attempts` times. Hedged calls send a
+    duplicate when the first attempt is slower than the endpoint's usual
+    latency; only use this for idempotent GETs.
+    
+    Parameters:
+    -----------
+    endpoint : str
+        Endpoint name used for timeouts, e.g. 'slice' or 'analyze'
+    method : str
+        The HTTP method
+    url : str
+        The full request URL
+    attempts : int
+        Maximum number of attempts
+    hedge : bool
+        Whether to hedge slow attempts
+    **kwargs
+        Passed to requests.request
+        
+    Returns:
+    --------
+    requests.Response
+        The first successful response, or the last 5xx response
+    """
+    guard = get_backend_guard()
+    policy = guard.timeouts(endpoint)
+    timeout = kwargs.pop("timeout", None) or policy.timeout()
+    
+    def call():
+        return requests.request(method, url, timeout=timeout, **kwargs)
+    
+    def may_hedge():
+        return guard.breaker.state == "closed"
+    
+    for attempt in range(attempts):
+        probe = guard.breaker.before_call()
+        try:
+            start = time.perf_counter()
+            try:
+                response = hedged(call, policy.hedge_delay(), may_hedge) if hedge and not probe else call()
+            except requests.exceptions.RequestException as e:
+                guard.record(endpoint, time.perf_counter() - start, ok=False)
+                if attempt < attempts - 1:
+                    logger.warning(f"Request to {endpoint} failed ({str(e)}), retrying ({attempt+1}/{attempts})...")
+                    time.sleep(backoff_delay(attempt))
+                    continue
+                raise
+            
+            failed = is_failure(response)
+            guard.record(endpoint, time.perf_counter() - start, ok=not failed)
+        finally:
+            # Any other exception must not leave the breaker stuck half-open
+            guard.breaker.release_probe(probe)
+        if not failed or attempt == attempts - 1:
+            return response
+        logger.warning(f"Request to {endpoint} returned {response.status_code}, retrying ({attempt+1}/{attempts})...")
+        time.sleep(backoff_delay(attempt))
+
 def get_api_health():
     """Check API health"""
     try:
-        response = requests.get(f"{API_URL}/health", timeout=5)
+        response = api_request("health", "GET", f"{API_URL}/health")
         if response.status_code == 200:
             return response.json()
         else:
@@ -27,10 +174,12 @@ def upload_scan(file):
     """Upload a scan to the API"""
     try:
         files = {"file": file}
-        response = requests.post(f"{API_URL}/upload", files=files)
+        response = api_request("upload", "POST", f"{API_URL}/upload", files=files)
         
         if response.status_code == 200:
-            return response.json()
+            scan_info = response.json()
+            cache_metadata([scan_info])
+            return scan_info
         else:
             st.error(f"Error uploading scan: {response.text}")
             return None
@@ -41,10 +190,12 @@ def upload_scan(file):
 def get_scan_list():
     """Get list of available scans"""
     try:
-        response = requests.get(f"{API_URL}/scans")
+        response = api_request("scans", "GET", f"{API_URL}/scans", attempts=RETRY_MAX_ATTEMPTS)
         
         if response.status_code == 200:
-            return response.json()
+            scans = response.json()
+            cache_metadata(scans)
+            return scans
         else:
             st.error(f"Error getting scan list: {response.text}")
             return []
@@ -53,12 +204,18 @@ def get_scan_list():
         return []
 
 def get_scan_metadata(scan_id):
-    """Get metadata for a specific scan"""
+    """Get metadata for a specific scan, from the metadata cache when possible"""
+    cached = get_cached_metadata(scan_id)
+    if cached is not None:
+        return cached
+    
     try:
-        response = requests.get(f"{API_URL}/scans/{scan_id}")
+        response = api_request("scans", "GET", f"{API_URL}/scans/{scan_id}", attempts=RETRY_MAX_ATTEMPTS)
         
         if response.status_code == 200:
-            return response.json()
+            metadata = response.json()
+            cache_metadata([dict(metadata, scan_id=scan_id)])
+            return metadata
         else:
             logger.error(f"Error getting scan metadata: {response.text}")
             return None
@@ -66,8 +223,14 @@ def get_scan_metadata(scan_id):
         logger.error(f"Error getting scan metadata: {str(e)}")
         return None
 
-def get_scan_slice(scan_id, view, slice_idx, window_center, window_width):
-    """Get a specific slice from a scan"""
+@timed("client.fetch_scan_slice")
+def fetch_scan_slice(scan_id, view, slice_idx, window_center, window_width):
+    """
+    Fetch a specific slice from the backend
+    
+    Not cached here: callers go through core.slice_source, which owns the
+    slice cache for every source.
+    """
     try:
         params = {
             "view": view,
@@ -76,10 +239,19 @@ def get_scan_slice(scan_id, view, slice_idx, window_center, window_width):
             "window_width": window_width
         }
         
-        response = requests.get(f"{API_URL}/slice/{scan_id}", params=params)
+        headers = {"Accept": SLICE_ACCEPT.get(SLICE_TRANSPORT, SLICE_ACCEPT["json"])}
+        
+        with timed("client.fetch_scan_slice.network"):
+            response = api_request("slice", "GET", f"{API_URL}/slice/{scan_id}", attempts=RETRY_MAX_ATTEMPTS,
+                                   hedge=True, params=params, headers=headers)
+            if response.status_code == 406:
+                # Server cannot produce any binary format we asked for
+                response = api_request("slice", "GET", f"{API_URL}/slice/{scan_id}", attempts=RETRY_MAX_ATTEMPTS,
+                                       hedge=True, params=params)
         
         if response.status_code == 200:
-            return response.json()
+            with timed("client.fetch_scan_slice.decode"):
+                return decode_slice_response(response, params)
         else:
             logger.error(f"Error getting scan slice: {response.text}")
             return None
@@ -87,11 +259,228 @@ def get_scan_slice(scan_id, view, slice_idx, window_center, window_width):
         logger.error(f"Error getting scan slice: {str(e)}")
         return None
 
+def decode_slice_response(response, params):
+    """
+    Decode a /slice response in any of the supported transports
+    
+    Parameters:
+    -----------
+    response : requests.Response
+        A successful /slice response
+    params : dict
+        The query parameters of the request, used as fallback metadata
+        
+    Returns:
+    --------
+    dict
+        Slice metadata with the displayable image under "image": a JSON string
+        (legacy servers), encoded PNG/WebP bytes, or a uint8 numpy array
+    """
+    return decode_slice_payload(response.headers, response.content, params)
+
+def decode_slice_payload(headers, content, params):
+    """Decode one slice from its headers and body (see decode_slice_response)"""
+    content_type = headers.get("Content-Type", "").split(";")[0].strip().lower()
+    
+    if content_type == "application/json" or not content_type:
+        return normalize_slice_json(json.loads(content), params)
+    
+    slice_data = {
+        "view": headers.get("X-Slice-View", params["view"]),
+        "slice_idx": int(headers.get("X-Slice-Idx", params["slice_idx"])),
+        "window_center": float(headers.get("X-Window-Center", params["window_center"])),
+        "window_width": float(headers.get("X-Window-Width", params["window_width"])),
+        "format": content_type,
+    }
+    
+    if content_type.startswith("image/"):
+        slice_data["image"] = content
+    elif content_type == "application/octet-stream":
+        import numpy as np
+        shape = tuple(int(n) for n in headers["X-Slice-Shape"].split(","))
+        pixels = np.frombuffer(content, dtype=np.dtype(headers.get("X-Slice-Dtype", "uint8"))).reshape(shape)
+        if pixels.dtype != np.uint8:
+            # Raw Hounsfield units: window locally so the server never has to
+            from core.slice_source import apply_window
+            slice_data["hu"] = pixels
+            pixels = apply_window(pixels, slice_data["window_center"], slice_data["window_width"])
+        slice_data["image"] = pixels
+    else:
+        raise ValueError(f"Unsupported slice content type: {content_type}")
+    
+    return slice_data
+
+def normalize_slice_json(slice_data, params):
+    """
+    Fill in the slice metadata a JSON slice lacks from the request
+    
+    Legacy servers send only image, scan_id, slice_idx and view; every
+    slice handed out by core.slice_source also carries its window and
+    format, whatever transport it came over.
+    
+    Parameters:
+    -----------
+    slice_data : dict
+        The decoded JSON slice
+    params : dict
+        The query parameters of the request
+        
+    Returns:
+    --------
+    dict
+        The same dict, completed in place
+    """
+    slice_data.setdefault("view", params["view"])
+    slice_data["slice_idx"] = int(slice_data.get("slice_idx", params["slice_idx"]))
+    slice_data["window_center"] = float(slice_data.get("window_center", params["window_center"]))
+    slice_data["window_width"] = float(slice_data.get("window_width", params["window_width"]))
+    slice_data.setdefault("format", "application/json")
+    return slice_data
+
+@timed("client.fetch_scan_slices")
+def fetch_scan_slices(scan_id, view, slice_indices, window_center, window_width):
+    """
+    Fetch several slices of one view and window from the backend
+    
+    Slices are requested from /slices/{scan_id} in batches of at most
+    SLICE_BATCH_MAX. The server answers with multipart/mixed, one part per
+    slice in the single-slice transport format, or with a JSON list. Servers
+    without /slices fall back to one fetch_scan_slice call per slice.
+    
+    Parameters:
+    -----------
+    scan_id : str
+        The scan identifier
+    view : str
+        'axial', 'sagittal' or 'coronal'
+    slice_indices : iterable of int
+        The slices to fetch, e.g. a range for cine playback
+    window_center : int
+        The window center (HU)
+    window_width : int
+        The window width (HU)
+        
+    Returns:
+    --------
+    dict
+        Slice index to slice data; slices that failed to load are omitted
+    """
+    slice_indices = list(dict.fromkeys(int(i) for i in slice_indices))
+    slices = {}
+    
+    for start in range(0, len(slice_indices), SLICE_BATCH_MAX):
+        batch = slice_indices[start:start + SLICE_BATCH_MAX]
+        fetched = None
+        if API_URL not in _batch_unsupported:
+            fetched = _fetch_slice_batch(scan_id, view, batch, window_center, window_width)
+        if fetched is None:
+            fetched = {}
+            for idx in batch:
+                slice_data = fetch_scan_slice(scan_id, view, idx, window_center, window_width)
+                if slice_data:
+                    fetched[idx] = slice_data
+        slices.update(fetched)
+    
+    return slices
+
+def _fetch_slice_batch(scan_id, view, batch, window_center, window_width):
+    """Request one batch from /slices; None means fall back to single requests"""
+    params = {
+        "view": view,
+        "slices": ",".join(str(i) for i in batch),
+        "window_center": window_center,
+        "window_width": window_width
+    }
+    accept = SLICE_ACCEPT.get(SLICE_TRANSPORT, SLICE_ACCEPT["json"])
+    headers = {"Accept": f"multipart/mixed, {accept}"}
+    
+    try:
+        with timed("client.fetch_scan_slices.network"):
+            response = api_request("slices", "GET", f"{API_URL}/slices/{scan_id}", attempts=RETRY_MAX_ATTEMPTS,
+                                   params=params, headers=headers)
+        
+        if response.status_code in (404, 405, 501):
+            logger.info(f"Server at {API_URL} has no batched slice endpoint, using single requests")
+            _batch_unsupported.add(API_URL)
+            return None
+        if response.status_code != 200:
+            logger.error(f"Error getting scan slices: {response.text}")
+            return None
+        
+        with timed("client.fetch_scan_slices.decode"):
+            return decode_slice_batch(response, view, window_center, window_width)
+    except Exception as e:
+        logger.error(f"Error getting scan slices: {str(e)}")
+        return None
+
+def decode_slice_batch(response, view, window_center, window_width):
+    """
+    Decode a /slices response into a dict of slice index to slice data
+    
+    Each multipart part carries its own Content-Type and X-Slice-* headers
+    and is decoded exactly like a single /slice response.
+    """
+    content_type = response.headers.get("Content-Type", "")
+    
+    if content_type.lower().startswith("multipart/"):
+        slices = {}
+        for headers, content in iter_multipart(content_type, response.content):
+            params = {
+                "view": view,
+                "slice_idx": headers.get("X-Slice-Idx"),
+                "window_center": window_center,
+                "window_width": window_width
+            }
+            slice_data = decode_slice_payload(headers, content, params)
+            slices[int(slice_data["slice_idx"])] = slice_data
+        return slices
+    
+    params = {"view": view, "window_center": window_center, "window_width": window_width}
+    slices = [normalize_slice_json(slice_data, params) for slice_data in response.json().get("slices", [])]
+    return {slice_data["slice_idx"]: slice_data for slice_data in slices}
+
+def iter_multipart(content_type, body):
+    """
+    Split a multipart body into (headers, content) pairs
+    
+    Parameters:
+    -----------
+    content_type : str
+        The Content-Type header including the boundary parameter
+    body : bytes
+        The response body
+        
+    Yields:
+    -------
+    tuple
+        A case-insensitive header dict and the raw bytes of each part
+    """
+    boundary = None
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "boundary":
+            boundary = value.strip('"')
+    if not boundary:
+        raise ValueError("Multipart response without a boundary")
+    
+    delimiter = b"--" + boundary.encode()
+    for chunk in body.split(delimiter)[1:]:
+        if chunk.startswith(b"--"):
+            break
+        head, _, content = chunk.removeprefix(b"\r\n").partition(b"\r\n\r\n")
+        headers = CaseInsensitiveDict()
+        for line in head.decode("latin-1").split("\r\n"):
+            name, _, value = line.partition(":")
+            if name:
+                headers[name.strip()] = value.strip()
+        yield headers, content.removesuffix(b"\r\n")
+
+@timed("client.ask_question")
 def ask_question(scan_id, question):
     """Ask a question about a scan"""
     try:
         data = {"text": question}
-        response = requests.post(f"{API_URL}/ask/{scan_id}", json=data)
+        response = api_request("ask", "POST", f"{API_URL}/ask/{scan_id}", json=data)
         
         if response.status_code == 200:
             return response.json()
@@ -102,6 +491,7 @@ def ask_question(scan_id, question):
         logger.error(f"Error asking question: {str(e)}")
         return None
 
+@timed("client.analyze_scan")
 def analyze_scan(scan_id, questions):
     """Call the API to analyze a scan with questions"""
     try:
@@ -113,20 +503,8 @@ def analyze_scan(scan_id, questions):
         
         logger.info(f"Sending analyze request for scan {scan_id}")
         
-        # Retry mechanism with timeout
-        max_retries = 3
-        timeout = 60  # Increased timeout for report generation
-        
-        for attempt in range(max_retries):
-            try:
-                response = requests.post(url, json=payload, timeout=timeout)
-                break
-            except requests.exceptions.Timeout:
-                if attempt < max_retries - 1:
-                    logger.warning(f"Request timed out, retrying ({attempt+1}/{max_retries})...")
-                    time.sleep(2)  # Wait before retrying
-                else:
-                    raise
+        # Retried with jittered backoff; fails fast while the backend circuit is open
+        response = api_request("analyze", "POST", url, attempts=RETRY_MAX_ATTEMPTS, json=payload)
         
         if response.status_code == 200:
             result = response.json()
@@ -135,6 +513,9 @@ def analyze_scan(scan_id, questions):
         else:
             logger.error(f"API Error {response.status_code}: {response.text}")
             return None
+    except CircuitOpenError as e:
+        logger.warning(f"Skipping analyze request for scan {scan_id}: {str(e)}")
+        return None
     except Exception as e:
         logger.error(f"Error calling analyze API: {str(e)}")
         import traceback
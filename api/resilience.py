@@ -0,0 +1,227 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from config import (
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS, RETRY_BASE_DELAY, RETRY_MAX_DELAY,
+    ENDPOINT_TIMEOUTS, HEDGE_MIN_DELAY, HEDGE_WORKERS
+)
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling the backend while the circuit breaker is open"""
+
+class AdaptiveTimeout:
+    """
+    Per-endpoint timeout derived from observed latency
+
+    Keeps a smoothed latency and mean deviation the way TCP estimates its
+    retransmission timeout, and uses latency + 4 * deviation clamped to the
+    endpoint's bounds. The initial value applies until a few samples exist.
+    """
+
+    MIN_SAMPLES = 5
+
+    def __init__(self, initial, minimum, maximum):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.samples = 0
+        self.smoothed = None
+        self.deviation = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.samples += 1
+            if self.smoothed is None:
+                self.smoothed = seconds
+                self.deviation = seconds / 2
+            else:
+                self.deviation = 0.75 * self.deviation + 0.25 * abs(seconds - self.smoothed)
+                self.smoothed = 0.875 * self.smoothed + 0.125 * seconds
+
+    def timeout(self):
+        """Seconds to wait for a response"""
+        with self._lock:
+            if self.samples < self.MIN_SAMPLES:
+                return self.initial
+            return min(self.maximum, max(self.minimum, self.smoothed + 4 * self.deviation))
+
+    def hedge_delay(self):
+        """Seconds to wait before sending a hedged duplicate, roughly the p95 latency"""
+        with self._lock:
+            if self.samples < self.MIN_SAMPLES:
+                return max(HEDGE_MIN_DELAY, self.initial / 4)
+            return max(HEDGE_MIN_DELAY, self.smoothed + 2 * self.deviation)
+
+class CircuitBreaker:
+    """
+    Fail fast while the backend is unhealthy
+
+    Opens after CIRCUIT_FAILURE_THRESHOLD consecutive failures. While open,
+    calls raise CircuitOpenError without touching the network. After
+    CIRCUIT_RESET_SECONDS one probe call is let through (half-open): success
+    closes the circuit, failure opens it again for another period. Callers
+    release the probe in a ``finally``, so a probe that ends in any other
+    exception does not leave the breaker half-open for good.
+    """
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError unless a call may go to the backend
+
+        Returns:
+        --------
+        bool
+            True if the call is the half-open probe, which the caller must
+            pass to release_probe once it has finished
+        """
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return False
+            if state == "half_open" and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+        raise CircuitOpenError("Backend circuit is open; failing fast")
+
+    def release_probe(self, probe):
+        """Let the next probe through if this call was one, however it ended"""
+        if probe:
+            with self._lock:
+                self.probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probe_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.probe_in_flight = False
+
+class BackendGuard:
+    """Circuit breaker plus per-endpoint adaptive timeouts for one backend"""
+
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self._timeouts = {}
+        self._lock = threading.Lock()
+
+    def timeouts(self, endpoint):
+        with self._lock:
+            if endpoint not in self._timeouts:
+                self._timeouts[endpoint] = AdaptiveTimeout(*ENDPOINT_TIMEOUTS.get(endpoint, ENDPOINT_TIMEOUTS["default"]))
+            return self._timeouts[endpoint]
+
+    def record(self, endpoint, elapsed, ok):
+        """Record the outcome of one backend call"""
+        if ok:
+            self.timeouts(endpoint).observe(elapsed)
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+def is_failure(response):
+    """Server errors count against the breaker; client errors do not"""
+    return response.status_code >= 500
+
+def backoff_delay(attempt, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2 ** attempt)]"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+_hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="api-hedge")
+# One slot per pool worker; calls that find none free run without hedging
+_hedge_slots = threading.BoundedSemaphore(HEDGE_WORKERS)
+
+def _submit_hedge(call):
+    """Run call on the hedge pool if a worker is free, else return None"""
+    if not _hedge_slots.acquire(blocking=False):
+        return None
+
+    def run():
+        try:
+            return call()
+        finally:
+            _hedge_slots.release()
+    return _hedge_pool.submit(run)
+
+def _discard(future):
+    """Close the response of an attempt that lost the race once it arrives"""
+    def close(done):
+        if not done.cancelled() and done.exception() is None:
+            close_response = getattr(done.result(), "close", None)
+            if close_response is not None:
+                close_response()
+    if not future.cancel():
+        future.add_done_callback(close)
+
+def hedged(call, delay, may_hedge=None):
+    """
+    Run an idempotent call, sending a duplicate if the first is slow
+
+    The duplicate is only sent while the hedge pool has a free worker and
+    may_hedge allows it, so hedging backs off when the backend is already
+    slow for everyone rather than doubling its load. The losing attempt's
+    response is closed when it arrives.
+
+    Parameters:
+    -----------
+    call : callable
+        Zero-argument function performing the request
+    delay : float
+        Seconds to wait for the first attempt before hedging
+    may_hedge : callable, optional
+        Zero-argument function checked before sending the duplicate, e.g.
+        whether the circuit breaker is closed
+
+    Returns:
+    --------
+    object
+        The result of whichever attempt succeeds first; if both fail, the
+        first attempt's exception is raised
+    """
+    first = _submit_hedge(call)
+    if first is None:
+        return call()
+    done, _ = wait([first], timeout=delay)
+    if done or (may_hedge is not None and not may_hedge()):
+        return first.result()
+
+    second = _submit_hedge(call)
+    if second is None:
+        return first.result()
+    pending = {first, second}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for loser in pending:
+                    _discard(loser)
+                return future.result()
+    return first.result()
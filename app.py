@@ -2,6 +2,7 @@ import streamlit as st
 from ui.sidebar import render_sidebar
 from ui.report import render_report_section
 from utils.notification import check_notifications
+from utils.session import initialize_session_state, enforce_session_budget
 import logging
 
 # Configure logging
@@ -19,13 +20,9 @@ def main():
         initial_sidebar_state="expanded"
     )
     
-    # Initialize session state
-    if 'current_scan' not in st.session_state:
-        st.session_state.current_scan = None
-    if 'reports' not in st.session_state:
-        st.session_state.reports = {}
-    if 'notifications' not in st.session_state:
-        st.session_state.notifications = []
+    # Initialize session state and keep it within its memory budget
+    initialize_session_state()
+    enforce_session_budget()
     
     # Render sidebar
     render_sidebar()
@@ -73,5 +70,75 @@ def main():
             st.code(f"API URL: {health.get('api_url', 'Unknown')}")
             st.code(f"Device: {health.get('device', 'Unknown')}")
 
+            render_performance_panel()
+
+def render_performance_panel():
+    """Show timing spans collected in this process"""
+    from utils.metrics import metrics
+
+    st.write("### Performance")
+    summary = metrics.summary()
+    if not summary:
+        st.caption("No timings recorded yet. Open a scan to collect slice and render timings.")
+        return
+
+    st.dataframe(
+        [
+            {
+                "span": name,
+                "count": stats["count"],
+                "mean (ms)": round(stats["mean_ms"], 1),
+                "p50 (ms)": round(stats["p50_ms"], 1),
+                "p95 (ms)": round(stats["p95_ms"], 1),
+                "p99 (ms)": round(stats["p99_ms"], 1),
+                "max (ms)": round(stats["max_ms"], 1),
+            }
+            for name, stats in summary.items()
+        ],
+        hide_index=True,
+        use_container_width=True
+    )
+
+    from utils.shared_cache import slice_cache, metadata_cache, report_store
+    st.dataframe(
+        [
+            {
+                "cache": cache.name,
+                "hits": stats["hits"],
+                "misses": stats["misses"],
+                "hit rate": f"{stats['hit_rate']:.0%}",
+                "evictions": stats["evictions"],
+            }
+            for cache in (slice_cache, metadata_cache, report_store)
+            for stats in [cache.stats()]
+        ],
+        hide_index=True,
+        use_container_width=True
+    )
+
+    render_session_footprint()
+
+    cols = st.columns(2)
+    with cols[0]:
+        st.download_button("Export JSON", metrics.export_json(), file_name="ctpa_metrics.json",
+                           mime="application/json", use_container_width=True)
+    with cols[1]:
+        st.download_button("Export Prometheus", metrics.export_prometheus(), file_name="ctpa_metrics.prom",
+                           mime="text/plain", use_container_width=True)
+
+def render_session_footprint():
+    """Show how much memory this session's state holds against its budget"""
+    from config import SESSION_MEMORY_BUDGET_BYTES
+    from utils.session import session_footprint
+
+    footprint = session_footprint()
+    total = sum(footprint.values())
+    st.caption(f"Session state: {total / 1024:.0f} KB of {SESSION_MEMORY_BUDGET_BYTES / 1024:.0f} KB budget")
+    st.dataframe(
+        [{"entry": name, "KB": round(size / 1024, 1)} for name, size in list(footprint.items())[:10]],
+        hide_index=True,
+        use_container_width=True
+    )
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,83 @@
+"""
+Local PE-candidate detector benchmark
+
+Builds synthetic CT volumes with and without emboli (low-attenuation clots
+inside contrast-filled vessels) and times core/local_analysis: the detector
+itself, the full run through the analysis process including downsampling and
+transfer, and a run under a tight time budget. Detection results are checked
+against the injected emboli before anything is timed. Run from the
+repository root:
+
+    python -m benchmarks.bench_analysis --slice-size 512 --num-slices 300
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.harness import run_workload, summarize, format_results, write_json, synthetic_ct_volume
+from core.local_analysis import prepare_volume, detect_pe_candidates, run_local_analysis
+
+# (x, y) of a vessel in synthetic_ct_volume's normalized plane, clot radius and z range as fractions of the volume
+EMBOLI = [((-0.3, 0.1), 0.035, (0.55, 0.6)), ((0.45, -0.2), 0.035, (0.3, 0.35))]
+
+def inject_emboli(volume, emboli=EMBOLI, clot_hu=45):
+    """Place clots of soft-tissue density inside vessels of a synthetic volume, in place"""
+    nx, ny, nz = volume.shape
+    x = np.linspace(-1, 1, nx)[:, None]
+    y = np.linspace(-1, 1, ny)[None, :]
+    for (cx, cy), radius, (z0, z1) in emboli:
+        clot = (x - cx) ** 2 + (y - cy) ** 2 < radius ** 2
+        for z in range(int(z0 * nz), max(int(z1 * nz), int(z0 * nz) + 2)):
+            volume[:, :, z][clot] = clot_hu
+    return volume
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local PE-candidate detector")
+    parser.add_argument("--slice-size", type=int, default=512, help="Slice width/height in pixels")
+    parser.add_argument("--num-slices", type=int, default=300, help="Slices along the z axis")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per workload")
+    parser.add_argument("--budget", type=float, default=0.25, help="Time budget (s) for the budgeted workload")
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    shape = (args.slice_size, args.slice_size, args.num_slices)
+    normal = synthetic_ct_volume(shape, dtype=np.float32)
+    embolic = inject_emboli(normal.copy())
+
+    # The detector must find the injected emboli, and nothing in the normal volume
+    for name, volume, expected in (("normal", normal, False), ("emboli", embolic, True)):
+        work, step = prepare_volume(volume)
+        analysis = detect_pe_candidates(work, step)
+        assert analysis.findings.pe_present is expected, (name, analysis)
+        if expected:
+            assert len(analysis.candidates) == len(EMBOLI), analysis.candidates
+        print(f"{name}: {analysis.findings} ({len(analysis.candidates)} candidates, {analysis.elapsed_s:.2f} s)")
+
+    work, step = prepare_volume(embolic)
+    results = [
+        run_workload("prepare (downsample to int16)", (lambda: prepare_volume(embolic) for _ in range(args.repeat))),
+        run_workload("detector (normal)",
+                     (lambda w=prepare_volume(normal): detect_pe_candidates(*w) for _ in range(args.repeat))),
+        run_workload("detector (emboli)", (lambda: detect_pe_candidates(work, step) for _ in range(args.repeat))),
+        # The first call starts the analysis process and is not recorded
+        run_workload("worker process end to end", (lambda: run_local_analysis(embolic) for _ in range(args.repeat)),
+                     warmup=1),
+    ]
+
+    # Under a tight budget the detector stops early and reports partial coverage
+    overruns, coverage = [], []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        analysis = detect_pe_candidates(work, step, budget_s=args.budget)
+        overruns.append(time.perf_counter() - start - args.budget)
+        coverage.append(analysis.slices_analyzed / analysis.slices_total)
+    results.append(summarize(f"budget {args.budget:g} s overrun", overruns, sum(overruns) + args.budget * args.repeat))
+    print(f"budget {args.budget:g} s: {np.mean(coverage):.0%} of slices analyzed")
+
+    print(format_results(results))
+    if args.json:
+        write_json(results, args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+App state persistence benchmark
+
+Persists one change to an app state holding an increasing number of scans,
+once by rewriting the whole JSON file and renaming it into place, and once
+through utils/app_state's journal append, and times restoring the state.
+Also has several processes append at once and checks that no change is
+lost across compactions. Run from the repository root:
+
+    python -m benchmarks.bench_app_state --scans 10 100 1000 10000
+"""
+import argparse
+import json
+import os
+import tempfile
+from multiprocessing import Process
+
+from benchmarks.harness import run_workload, format_results, write_json
+from utils.app_state import AppStateStore
+
+def scan_info(i):
+    return {"scan_id": f"scan_{i}", "filename": f"scan_{i}.nii.gz", "upload_time": "2026-01-01 12:00:00",
+            "path": f"data/ctpa_scan_data/scan_{i}.nii.gz"}
+
+def build_state(scans):
+    return {"uploaded_scans": [scan_info(i) for i in range(scans)],
+            "reports": {f"scan_{i}": f"{i:064x}" for i in range(scans)},
+            "current_scan": "scan_0"}
+
+def rewrite(path, state):
+    """Baseline: write the whole state to a temporary file and rename it"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+def append_changes(path, worker, count, compact_bytes):
+    store = AppStateStore(path, compact_bytes=compact_bytes)
+    for i in range(count):
+        store.record("report", scan_id=f"worker_{worker}_{i}", report=f"{i:064x}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark app state persistence")
+    parser.add_argument("--scans", type=int, nargs="+", default=[10, 100, 1000, 10000],
+                        help="Scans in the persisted state")
+    parser.add_argument("--iterations", type=int, default=200, help="Changes persisted per workload")
+    parser.add_argument("--workers", type=int, default=4, help="Processes appending concurrently")
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for scans in args.scans:
+            state = build_state(scans)
+            path = os.path.join(tmp_dir, f"state_{scans}.json")
+            rewrite(path, state)
+            # No compaction inside the timed appends; it is timed on its own below
+            store = AppStateStore(path, compact_bytes=float("inf"))
+            results += [
+                run_workload(f"rewrite whole file, {scans} scans (baseline)", (
+                    (lambda i=i: rewrite(path, dict(state, current_scan=f"scan_{i % scans}")))
+                    for i in range(args.iterations)
+                )),
+                run_workload(f"journal append, {scans} scans", (
+                    (lambda i=i: store.record("current", scan_id=f"scan_{i % scans}"))
+                    for i in range(args.iterations)
+                )),
+                run_workload(f"restore, {scans} scans + {args.iterations} changes", (
+                    store.load for _ in range(5)
+                )),
+                run_workload(f"compact, {scans} scans", [store.compact]),
+            ]
+            assert store.load()["current_scan"] == f"scan_{(args.iterations - 1) % scans}"
+
+        # Concurrent writers with a small journal limit, so compactions race the appends
+        path = os.path.join(tmp_dir, "concurrent.json")
+        workers = [Process(target=append_changes, args=(path, w, args.iterations, 4096))
+                   for w in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        reports = AppStateStore(path).load()["reports"]
+        assert len(reports) == args.workers * args.iterations, len(reports)
+        print(f"{args.workers} processes x {args.iterations} changes: all {len(reports)} restored")
+
+    print(format_results(results))
+    if args.json:
+        write_json(results, args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Compressed idle volume benchmark
+
+Compresses a synthetic CT volume with core/volume_cache's compress_volume
+using each slab codec, and reports the compression ratio against the
+float64 volume nibabel's get_fdata returns and against int16, how many such
+studies fit in LOCAL_VOLUMES_MAX_BYTES, and the latency of reading slices
+from the compressed volume compared with a plain array. Run from the
+repository root:
+
+    python -m benchmarks.bench_compress --slice-size 512 --num-slices 300
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.harness import run_workload, summarize, format_results, write_json, synthetic_ct_volume
+from config import LOCAL_VOLUMES_MAX_BYTES
+from core.volume_cache import compress_volume, slab_codec
+
+def access_workloads(name, volume, iterations, seed=0):
+    """Axial paging, random axial slices, sagittal and coronal planes"""
+    nx, ny, nz = volume.shape
+    rng = np.random.default_rng(seed)
+    random_z = rng.integers(0, nz, iterations)
+    return [
+        run_workload(f"{name} axial paging", (
+            (lambda i=i: np.asarray(volume[:, :, i % nz])) for i in range(iterations)
+        )),
+        run_workload(f"{name} axial random", (
+            (lambda z=z: np.asarray(volume[:, :, int(z)])) for z in random_z
+        )),
+        run_workload(f"{name} sagittal plane", (
+            (lambda i=i: np.asarray(volume[(i * 7) % nx])) for i in range(max(1, iterations // 20))
+        )),
+        run_workload(f"{name} coronal plane", (
+            (lambda i=i: np.asarray(volume[:, (i * 7) % ny])) for i in range(max(1, iterations // 20))
+        )),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark compressed in-memory volumes")
+    parser.add_argument("--slice-size", type=int, default=512, help="Slice width/height in pixels")
+    parser.add_argument("--num-slices", type=int, default=300, help="Slices along the z axis")
+    parser.add_argument("--codecs", nargs="+", default=["zstd", "lz4", "zlib"], help="Slab codecs to compare")
+    parser.add_argument("--iterations", type=int, default=200, help="Slices per axial workload")
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    volume = synthetic_ct_volume((args.slice_size, args.slice_size, args.num_slices))
+    hu = np.rint(volume).astype(np.int16)
+    budget_gb = LOCAL_VOLUMES_MAX_BYTES / 1024 ** 3
+    print(f"float64: {volume.nbytes / 1024 ** 2:.0f} MB, {int(LOCAL_VOLUMES_MAX_BYTES // volume.nbytes)} studies "
+          f"in {budget_gb:g} GB; int16: {hu.nbytes / 1024 ** 2:.0f} MB, "
+          f"{int(LOCAL_VOLUMES_MAX_BYTES // hu.nbytes)} studies")
+
+    results = access_workloads("array (baseline)", volume, args.iterations)
+    for codec in args.codecs:
+        if slab_codec(codec)[0] != codec:
+            print(f"{codec}: not installed, skipped")
+            continue
+        start = time.perf_counter()
+        compressed = compress_volume(volume, codec)
+        elapsed = time.perf_counter() - start
+        assert np.array_equal(np.asarray(compressed), hu)
+
+        size = compressed.compressed_bytes
+        print(f"{codec}: {size / 1024 ** 2:.1f} MB, {volume.nbytes / size:.1f}x float64, "
+              f"{hu.nbytes / size:.1f}x int16, {int(LOCAL_VOLUMES_MAX_BYTES // size)} studies in {budget_gb:g} GB")
+        results.append(summarize(f"{codec} compress", [elapsed], elapsed))
+        results += access_workloads(codec, compressed, args.iterations)
+        results.append(run_workload(f"{codec} restore whole volume", (compressed.decompress for _ in range(2))))
+
+    print(format_results(results))
+    if args.json:
+        write_json(results, args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+DICOM series loading benchmark
+
+Writes a synthetic CT series as one DICOM file per slice (and optionally as a
+zip archive, as PACS exports it) and compares loading it through
+core/scan_loader, which reads headers first and decodes pixel data lazily on
+a thread pool, against reading every file in full before building the volume.
+Run from the repository root:
+
+    python -m benchmarks.bench_loader --slice-size 512 --num-slices 300 --zip
+"""
+import argparse
+import os
+import tempfile
+import time
+import uuid
+import zipfile
+
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import CTImageStorage, ExplicitVRLittleEndian, generate_uid
+
+from benchmarks.harness import run_workload, summarize, format_results, write_json, synthetic_ct_volume
+from core.scan_loader import DicomSeries
+
+def write_synthetic_series(volume, out_dir, spacing=1.0):
+    """
+    Write a volume as a DICOM CT series, one file per axial slice
+
+    Files get random names so loaders cannot rely on the directory order.
+    Pixels are stored as 12-bit unsigned values with a -1024 rescale
+    intercept, as CT scanners usually do.
+
+    Parameters:
+    -----------
+    volume : numpy.ndarray
+        Hounsfield units, shaped (x, y, z)
+    out_dir : str
+        Directory for the .dcm files
+    spacing : float
+        Slice spacing in millimetres
+
+    Returns:
+    --------
+    list of str
+        The paths written
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    study_uid, series_uid = generate_uid(), generate_uid()
+    paths = []
+    for z in range(volume.shape[2]):
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = CTImageStorage
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+        ds = Dataset()
+        ds.file_meta = meta
+        ds.SOPClassUID = CTImageStorage
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.StudyInstanceUID = study_uid
+        ds.SeriesInstanceUID = series_uid
+        ds.Modality = "CT"
+        ds.PatientID = "BENCH"
+        ds.InstanceNumber = z + 1
+        ds.ImagePositionPatient = [0.0, 0.0, z * spacing]
+        ds.ImageOrientationPatient = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0]
+        ds.PixelSpacing = [0.7, 0.7]
+        ds.SliceThickness = spacing
+        ds.Rows, ds.Columns = volume.shape[1], volume.shape[0]
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.BitsAllocated, ds.BitsStored, ds.HighBit = 16, 12, 11
+        ds.PixelRepresentation = 0
+        ds.RescaleSlope, ds.RescaleIntercept = 1, -1024
+        ds.PixelData = np.clip(volume[:, :, z].T + 1024, 0, 4095).astype(np.uint16).tobytes()
+
+        path = os.path.join(out_dir, f"{uuid.uuid4().hex}.dcm")
+        ds.save_as(path, enforce_file_format=True)
+        paths.append(path)
+    return paths
+
+def load_eager(path):
+    """Baseline: read every file in full, sort, then stack into a volume"""
+    datasets = [pydicom.dcmread(os.path.join(path, name)) for name in os.listdir(path)]
+    datasets.sort(key=lambda ds: float(ds.ImagePositionPatient[2]))
+    return np.stack([ds.pixel_array.T * float(ds.RescaleSlope) + float(ds.RescaleIntercept)
+                     for ds in datasets], axis=2)
+
+def lazy_workloads(name, path, repeat):
+    """Time to the first (middle) slice and to the whole volume through DicomSeries"""
+    first, full = [], []
+    # The first load warms the page cache and is not recorded
+    for _ in range(repeat + 1):
+        start = time.perf_counter()
+        series = DicomSeries(path)
+        series.get_fdata()[:, :, series.shape[2] // 2]
+        first.append(time.perf_counter() - start)
+        series.wait()
+        full.append(time.perf_counter() - start)
+    return [
+        summarize(f"{name} first slice", first[1:], sum(first[1:])),
+        summarize(f"{name} full volume", full[1:], sum(full[1:])),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark lazy DICOM series loading")
+    parser.add_argument("--slice-size", type=int, default=512, help="Slice width/height in pixels")
+    parser.add_argument("--num-slices", type=int, default=300, help="Slices in the series")
+    parser.add_argument("--repeat", type=int, default=5, help="Loads per workload")
+    parser.add_argument("--zip", action="store_true", help="Also load the series from a zip archive")
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    volume = synthetic_ct_volume((args.slice_size, args.slice_size, args.num_slices), dtype=np.float32)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        series_dir = os.path.join(tmp_dir, "series")
+        paths = write_synthetic_series(volume, series_dir)
+
+        # The loader must reproduce the volume exactly, in slice order
+        loaded = np.asarray(DicomSeries(series_dir).get_fdata())
+        assert np.array_equal(loaded, np.clip(volume + 1024, 0, 4095).astype(np.int16) - 1024)
+
+        results = [run_workload("eager read (dir)", (lambda: load_eager(series_dir) for _ in range(args.repeat)),
+                                warmup=1)]
+        results += lazy_workloads("lazy (dir)", series_dir, args.repeat)
+
+        if args.zip:
+            zip_path = os.path.join(tmp_dir, "series.zip")
+            with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
+                for path in paths:
+                    zf.write(path, os.path.basename(path))
+            results += lazy_workloads("lazy (zip)", zip_path, args.repeat)
+
+    print(format_results(results))
+    if args.json:
+        write_json(results, args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Lung/vessel mask benchmark
+
+Computes the masks of a synthetic CT volume once through core/masks, checks
+the bit-packed planes against the unpacked masks, and compares drawing the
+overlay from the packed masks against segmenting every displayed slice
+again. Run from the repository root:
+
+    python -m benchmarks.bench_masks --slice-size 512 --num-slices 300
+"""
+import argparse
+import time
+
+import numpy as np
+from scipy import ndimage
+
+from benchmarks.harness import run_workload, summarize, format_results, write_json, synthetic_ct_volume
+from config import LUNG_HU, VESSEL_HU
+from core.masks import MASK_NAMES, compute_masks, overlay_masks
+from core.slice_source import apply_window
+
+def segment_slice(plane):
+    """Baseline: threshold and clean one slice, as a viewer without precomputed masks would"""
+    lung = ndimage.binary_opening((plane >= LUNG_HU[0]) & (plane <= LUNG_HU[1]))
+    labels, count = ndimage.label(lung)
+    if count:
+        sizes = np.bincount(labels.ravel())
+        sizes[0] = 0
+        lung = sizes[labels] >= sizes.max() * 0.1
+    vessel = (plane >= VESSEL_HU[0]) & (plane <= VESSEL_HU[1])
+    return ndimage.binary_fill_holes(lung), vessel
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark precomputed lung/vessel masks")
+    parser.add_argument("--slice-size", type=int, default=512, help="Slice width/height in pixels")
+    parser.add_argument("--num-slices", type=int, default=300, help="Slices along the z axis")
+    parser.add_argument("--iterations", type=int, default=100, help="Slices per overlay workload")
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    volume = synthetic_ct_volume((args.slice_size, args.slice_size, args.num_slices), dtype=np.float32)
+    nx, ny, nz = volume.shape
+
+    start = time.perf_counter()
+    mask_set = compute_masks(volume)
+    elapsed = time.perf_counter() - start
+    results = [summarize("compute masks (once per volume)", [elapsed], elapsed)]
+    print(f"packed masks: {mask_set.nbytes / 1024 ** 2:.1f} MB "
+          f"(boolean: {len(MASK_NAMES) * volume.size / 1024 ** 2:.1f} MB)")
+
+    # Every view must unpack to exactly the stored masks
+    for name in MASK_NAMES:
+        full = np.unpackbits(mask_set.packed[name], axis=1, count=nx * ny).reshape(nz, nx, ny)
+        full = full.transpose(1, 2, 0).astype(bool)
+        for view, idx, expected in (("axial", nz // 2, full[:, :, nz // 2]), ("sagittal", nx // 3, full[nx // 3]),
+                                    ("coronal", ny // 2, full[:, ny // 2])):
+            assert np.array_equal(mask_set.plane(name, view, idx), expected), (name, view)
+
+    windowed = [apply_window(volume[:, :, i % nz].T, -600, 1500) for i in range(args.iterations)]
+    for view, count in (("axial", nz), ("sagittal", nx), ("coronal", ny)):
+        results.append(run_workload(f"unpack {view} plane", (
+            (lambda i=i: [mask_set.plane(name, view, i % count) for name in MASK_NAMES])
+            for i in range(args.iterations)
+        ), warmup=5))
+    results += [
+        run_workload("overlay from packed masks", (
+            (lambda i=i: overlay_masks(windowed[i], mask_set, "axial", i % nz)) for i in range(args.iterations)
+        ), warmup=5),
+        run_workload("segment each slice (baseline)", (
+            (lambda i=i: segment_slice(volume[:, :, i % nz])) for i in range(args.iterations)
+        ), warmup=5),
+    ]
+
+    print(format_results(results))
+    if args.json:
+        write_json(results, args.json)
+
+if __name__ == "__main__":
+    main()
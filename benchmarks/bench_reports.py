@@ -0,0 +1,107 @@
+"""
+Report rendering benchmark for batch archival export
+
+Renders thousands of CTPA and fallback reports through core/report_generator
+and optionally writes each one to disk, as an archival export would. Also
+compares filtering the worklist through the findings index against parsing
+every stored report, and can time bulk PDF export through the process pool.
+Run from the repository root:
+
+    python -m benchmarks.bench_reports --count 5000 --out /tmp/reports
+    python -m benchmarks.bench_reports --count 1000 --pdf-count 40
+"""
+import argparse
+import os
+import tempfile
+import time
+import uuid
+from types import SimpleNamespace
+
+from benchmarks.harness import run_workload, summarize, format_results, write_json
+from core.findings import DEMO_PE_FINDINGS, NORMAL_FINDINGS, Findings, FindingsStore
+from core.pdf_export import export_reports_bulk
+from core.report_generator import generate_ctpa_report, generate_fallback_report
+
+def synthetic_studies(count):
+    """Patient details for count studies, alternating positive and negative findings"""
+    return [
+        SimpleNamespace(
+            scan_id=f"scan-{i:06d}",
+            filename=f"ctpa_{i:06d}.nii.gz",
+            patient_id=f"P{i:06d}",
+            patient_name=f"Patient {i}",
+            findings=DEMO_PE_FINDINGS if i % 3 == 0 else NORMAL_FINDINGS,
+        )
+        for i in range(count)
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark report rendering for batch export")
+    parser.add_argument("--count", type=int, default=5000, help="Reports per workload")
+    parser.add_argument("--out", help="Directory for the export workload (default: a temporary directory)")
+    parser.add_argument("--pdf-count", type=int, default=0, help="Reports in the bulk PDF export workload (0 skips it)")
+    parser.add_argument("--pdf-parallel", type=int, default=None, help="Bulk PDF export parallelism")
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    studies = synthetic_studies(args.count)
+    report_date = "January 01, 2025 at 09:00 AM"
+
+    results = [
+        run_workload("ctpa report", (
+            (lambda s=s: generate_ctpa_report(s, s.findings, report_date)) for s in studies
+        ), warmup=10),
+        run_workload("fallback report", (
+            (lambda s=s: generate_fallback_report(s.scan_id, s.filename, report_date)) for s in studies
+        ), warmup=10),
+    ]
+
+    # Worklist filtering: index lookup against re-parsing every stored report
+    reports = {s.scan_id: generate_ctpa_report(s, s.findings, report_date) for s in studies}
+    store = FindingsStore()
+    for scan_id, html in reports.items():
+        store.put(scan_id, Findings.from_report_html(html))
+    queries = max(1, args.count // 100)
+    results += [
+        run_workload("worklist filter (index)", (
+            (lambda: store.query(pe_present=True)) for _ in range(queries)
+        )),
+        run_workload("worklist filter (parse HTML)", (
+            (lambda: {scan_id for scan_id, html in reports.items() if Findings.from_report_html(html).pe_present})
+            for _ in range(queries)
+        )),
+    ]
+    assert store.query(pe_present=True) == {s.scan_id for s in studies if s.findings.pe_present}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_dir = args.out or tmp_dir
+        os.makedirs(out_dir, exist_ok=True)
+
+        def export(study):
+            html = generate_ctpa_report(study, study.findings, report_date)
+            with open(os.path.join(out_dir, f"{study.scan_id}.html"), "w", encoding="utf-8") as f:
+                f.write(html)
+
+        results.append(run_workload(f"archival export ({args.count} files)",
+                                    ((lambda s=s: export(s)) for s in studies), warmup=10))
+
+    if args.pdf_count:
+        # A unique run tag keeps the first pass from hitting PDFs cached by earlier runs
+        run_tag = uuid.uuid4().hex
+        bulk = {s.scan_id: (generate_ctpa_report(s, s.findings, f"{report_date} ({run_tag})"), [])
+                for s in studies[:args.pdf_count]}
+        parallel = {"max_parallel": args.pdf_parallel} if args.pdf_parallel else {}
+        for name in ("bulk PDF export", "bulk PDF export (cached)"):
+            start = time.perf_counter()
+            exported = export_reports_bulk(bulk, **parallel)
+            elapsed = time.perf_counter() - start
+            assert len(exported) == len(bulk)
+            # Reports finish out of order, so only the amortized time per report is meaningful
+            results.append(summarize(f"{name} ({len(bulk)})", [elapsed / len(bulk)] * len(bulk), elapsed))
+
+    print(format_results(results))
+    if args.json:
+        write_json(results, args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Session state footprint benchmark
+
+Builds the session state of a user who has opened several scans, once laid
+out as before (volumes, report HTML, unbounded chat and notifications in the
+session) and once as utils/session lays it out (handles and digests, bounded
+lists), and compares their estimated size and the sessions that fit in a
+given amount of memory. Also times reading a report back from the shared
+report store. Run from the repository root:
+
+    python -m benchmarks.bench_session --scans 5 --slice-size 512 --num-slices 300
+"""
+import argparse
+import hashlib
+import uuid
+
+import numpy as np
+
+from benchmarks.harness import run_workload, format_results, write_json, synthetic_ct_volume
+from config import SESSION_MAX_CHAT_MESSAGES, SESSION_MAX_NOTIFICATIONS, SESSION_MEMORY_BUDGET_BYTES
+from core.report_generator import generate_fallback_report
+from utils.session import session_footprint
+from utils.shared_cache import report_store
+
+def build_states(scans, shape, questions, notifications):
+    """Return (legacy, slim) session states for the same activity"""
+    volume = synthetic_ct_volume(shape, dtype=np.int16)
+    messages = [{"role": role, "content": f"Question {i} about the scan and its answer, " * 4, "time": "12:00"}
+                for i in range(questions) for role in ("user", "assistant")]
+    notices = [{"message": f"Report {i} generated successfully!", "type": "success", "time": 0.0}
+               for i in range(notifications)]
+    reports = {f"scan_{i}.nii.gz": generate_fallback_report(f"scan_{i}", f"scan_{i}.nii.gz") for i in range(scans)}
+
+    legacy = {
+        "scan_data": {scan_id: volume.copy() for scan_id in reports},
+        "reports": dict(reports),
+        "chat_history": {scan_id: list(messages) for scan_id in reports},
+        "notifications": list(notices),
+    }
+    slim = {
+        "scan_data": {scan_id: {"path": f"data/ctpa_scan_data/{scan_id}"} for scan_id in reports},
+        "reports": {scan_id: hashlib.sha256(html.encode()).hexdigest() for scan_id, html in reports.items()},
+        "chat_history": {scan_id: messages[-SESSION_MAX_CHAT_MESSAGES:] for scan_id in reports},
+        "chat_handles": {scan_id: uuid.uuid4().hex for scan_id in reports},
+        "notifications": notices[-SESSION_MAX_NOTIFICATIONS:],
+    }
+    return legacy, slim, reports
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark session state footprint")
+    parser.add_argument("--scans", type=int, default=5, help="Scans opened in the session")
+    parser.add_argument("--slice-size", type=int, default=512, help="Slice width/height in pixels")
+    parser.add_argument("--num-slices", type=int, default=300, help="Slices along the z axis")
+    parser.add_argument("--questions", type=int, default=100, help="Chat questions per scan")
+    parser.add_argument("--notifications", type=int, default=500, help="Notifications raised and never shown")
+    parser.add_argument("--pod-memory-gb", type=float, default=8, help="Memory available to sessions")
+    parser.add_argument("--iterations", type=int, default=200, help="Report reads")
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    legacy, slim, reports = build_states(args.scans, (args.slice_size, args.slice_size, args.num_slices),
+                                         args.questions, args.notifications)
+    pod_bytes = args.pod_memory_gb * 1024 ** 3
+    for name, state in (("before", legacy), ("after", slim)):
+        footprint = session_footprint(state)
+        total = sum(footprint.values())
+        entries = ", ".join(f"{key} {size / 1024:.0f} KB" for key, size in footprint.items())
+        print(f"{name}: {total / 1024 ** 2:.2f} MB per session, {int(pod_bytes // total)} sessions "
+              f"in {args.pod_memory_gb:g} GB ({entries})")
+    assert sum(session_footprint(slim).values()) <= SESSION_MEMORY_BUDGET_BYTES
+
+    for digest, html in zip(slim["reports"].values(), reports.values()):
+        report_store.put(digest, html)
+    digests = list(slim["reports"].values())
+    results = [
+        run_workload("report from session dict (before)", (
+            (lambda i=i: legacy["reports"][f"scan_{i % args.scans}.nii.gz"]) for i in range(args.iterations)
+        )),
+        run_workload("report from report store (after)", (
+            (lambda i=i: report_store.get(digests[i % args.scans])) for i in range(args.iterations)
+        ), warmup=5),
+    ]
+
+    print(format_results(results))
+    if args.json:
+        write_json(results, args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Slider drag settle-time benchmark
+
+Starts the mock backend and replays a fast drag of the Navigate Slices or
+Window Center slider the way the viewer sees it: one rerun at a time, each
+picking up the slider's latest value, as Streamlit coalesces changes that
+arrive during a run. Compares the viewer before, where each value fetched
+its slice and then reran the page a second time, with its superseding frame
+requests (SliceSource.request_slice), and reports the time from the end of the drag
+until its final frame is shown, and how many slices the backend rendered.
+Run from the repository root:
+
+    python -m benchmarks.bench_settle --latency-ms 40 --drag-values 60 --drag-ms 1000
+"""
+import argparse
+import logging
+import time
+import uuid
+from concurrent.futures import wait
+
+from api import client
+from benchmarks.harness import summarize, format_results, write_json
+from benchmarks.mock_server import MockBackend
+from config import SLICE_FRAME_WAIT_SECONDS, SLICE_FRAME_POLL_SECONDS, SLICE_PREFETCH_RADIUS
+from core import slice_source
+from core.slice_source import RemoteSliceSource
+
+def neighbours(idx):
+    return [i for offset in range(1, SLICE_PREFETCH_RADIUS + 1) for i in (idx + offset, idx - offset)]
+
+def blocking_rerun(source, page_seconds):
+    """Baseline: every rerun fetches its slice, and the slider's st.rerun() runs the page again"""
+    def rerun(target):
+        view, idx, window_center, window_width = target
+        for _ in range(2):
+            time.sleep(page_seconds)
+            source.get_slice(*target)
+            source.prefetch(view, neighbours(idx), window_center, window_width)
+        return None
+    return rerun
+
+def superseding_rerun(source, page_seconds):
+    """The viewer: request the frame and wait briefly, leaving slower frames to _await_frame"""
+    viewer = uuid.uuid4().hex
+
+    def rerun(target):
+        view, idx, window_center, window_width = target
+        time.sleep(page_seconds)
+        frame = source.request_slice(viewer, *target)
+        wait([frame], timeout=SLICE_FRAME_WAIT_SECONDS)
+        if not frame.done():
+            return frame
+        source.prefetch(view, neighbours(idx), window_center, window_width, viewer=viewer)
+        return None
+    return rerun
+
+def replay_drag(rerun, targets, drag_seconds):
+    """
+    Drive reruns through a drag whose values arrive evenly over drag_seconds
+
+    A rerun returns None once its frame is shown, or the frame it is still
+    waiting for, which is then checked every SLICE_FRAME_POLL_SECONDS as the
+    viewer's fragment does, until it lands or the next slider value arrives.
+
+    Returns:
+    --------
+    float
+        Seconds from the last value arriving until its frame is shown
+    """
+    interval = drag_seconds / (len(targets) - 1)
+    start = time.perf_counter()
+    while True:
+        current = min(int((time.perf_counter() - start) / interval), len(targets) - 1)
+        last = current == len(targets) - 1
+        frame = rerun(targets[current])
+        next_value = (current + 1) * interval
+        if frame is None:
+            if last:
+                return time.perf_counter() - start - drag_seconds
+            time.sleep(max(0.0, next_value - (time.perf_counter() - start)))
+            continue
+        while not frame.done() and (last or time.perf_counter() - start < next_value):
+            wait([frame], timeout=SLICE_FRAME_WAIT_SECONDS)
+            if not frame.done():
+                # Idle until the fragment's next run, unless a slider value arrives first
+                idle = SLICE_FRAME_POLL_SECONDS - SLICE_FRAME_WAIT_SECONDS
+                if not last:
+                    idle = min(idle, next_value - (time.perf_counter() - start))
+                time.sleep(max(0.0, idle))
+
+def drain(backend):
+    """
+    Let requests left over from a drag finish, then reset the counters and cache
+
+    Returns:
+    --------
+    int
+        Slice requests the backend served since the last drain
+    """
+    time.sleep(1.0)
+    slice_source.clear_slice_cache()
+    with backend._lock:
+        served = sum(count for endpoint, count in backend.request_counts.items() if endpoint.startswith("slice"))
+        backend.request_counts.clear()
+    return served
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark settling after a fast slider drag")
+    parser.add_argument("--latency-ms", type=float, default=40, help="Mock backend latency per request")
+    parser.add_argument("--jitter-ms", type=float, default=10, help="Random extra latency per request")
+    parser.add_argument("--slice-size", type=int, default=512, help="Slice width/height in pixels")
+    parser.add_argument("--drag-values", type=int, default=60, help="Slider values passed during the drag")
+    parser.add_argument("--drag-ms", type=float, default=1000, help="Duration of the drag")
+    parser.add_argument("--page-ms", type=float, default=20, help="Time to rerun the rest of the page")
+    parser.add_argument("--repeat", type=int, default=5, help="Drags per workload")
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    num_slices = max(300, args.drag_values + 2 * SLICE_PREFETCH_RADIUS)
+    drags = {
+        "slice drag": lambda r: [("axial", r + i, 100, 700) for i in range(args.drag_values)],
+        "window drag": lambda r: [("axial", num_slices // 2, -200 + 10 * i, 700 + r)
+                                  for i in range(args.drag_values)],
+    }
+
+    results = []
+    with MockBackend(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, slice_size=args.slice_size,
+                     num_slices=num_slices) as backend:
+        client.API_URL = backend.url
+        source = RemoteSliceSource("bench-scan")
+        source.shared = False  # Repeats must reach the backend, not the host-wide cache
+        source.dims
+        drain(backend)
+        for drag_name, targets_for in drags.items():
+            for mode, make_rerun in (("fetch every rerun (baseline)", blocking_rerun),
+                                     ("superseding frames", superseding_rerun)):
+                settle, rendered = [], []
+                for r in range(args.repeat):
+                    settle.append(replay_drag(make_rerun(source, args.page_ms / 1000), targets_for(r), args.drag_ms / 1000))
+                    rendered.append(drain(backend))
+                results.append(summarize(f"{drag_name}, {mode}", settle, sum(settle)))
+                print(f"{drag_name}, {mode}: {sum(rendered) / len(rendered):.0f} slice requests per drag "
+                      f"of {args.drag_values} values")
+
+    print(format_results(results))
+    if args.json:
+        write_json(results, args.json)
+
+if __name__ == "__main__":
+    main()
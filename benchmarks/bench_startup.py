@@ -0,0 +1,117 @@
+"""
+Cold-start benchmark
+
+Reports where import time goes when app.py is loaded, using the interpreter's
+-X importtime profiler, and measures time-to-first-render: from launching a
+fresh interpreter to the end of the first script run of app.py (driven by
+Streamlit's AppTest against the mock backend). Each sample is a new process,
+as when the orchestrator scales up a container; the OS page cache stays warm.
+Run from the repository root:
+
+    python -m benchmarks.bench_startup --repeat 5 --top 15
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from benchmarks.harness import summarize, format_results, write_json
+from benchmarks.mock_server import MockBackend
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter; prints when the first render finished
+CHILD_SCRIPT = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file("app.py", default_timeout=120)
+if sys.argv[1]:
+    at.session_state["current_scan"] = sys.argv[1]
+start = time.perf_counter()
+at.run()
+print(json.dumps({"rendered_at": time.time(), "run_s": time.perf_counter() - start,
+                  "exceptions": [str(e.value) for e in at.exception]}))
+"""
+
+def import_profile(module="app"):
+    """
+    Profile the imports of a module in a fresh interpreter
+
+    Parameters:
+    -----------
+    module : str
+        The module to import
+
+    Returns:
+    --------
+    tuple
+        (total import time in ms, list of (module, self ms, cumulative ms))
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+    total = next(cumulative for name, _, cumulative in reversed(rows) if name == module)
+    return total, rows
+
+def format_import_report(module, total, rows, top):
+    """Format import time per top-level package, largest first"""
+    by_package = defaultdict(lambda: [0.0, 0])
+    for name, self_ms, _ in rows:
+        entry = by_package[name.split(".")[0]]
+        entry[0] += self_ms
+        entry[1] += 1
+
+    header = f"{'package':<28}{'modules':>9}{'self ms':>10}{'share':>8}"
+    lines = [f"import {module}: {total:.1f} ms, {len(rows)} modules", header, "-" * len(header)]
+    for package, (self_ms, count) in sorted(by_package.items(), key=lambda item: -item[1][0])[:top]:
+        lines.append(f"{package:<28}{count:>9}{self_ms:>10.1f}{self_ms / total:>8.0%}")
+    return "\n".join(lines)
+
+def first_render(api_url, scan_id=""):
+    """Launch a fresh interpreter, render app.py once and return (time to first render, script run) in seconds"""
+    env = dict(os.environ, API_URL=api_url)
+    launched = time.time()
+    result = subprocess.run([sys.executable, "-c", CHILD_SCRIPT, scan_id], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    if report["exceptions"]:
+        raise RuntimeError(f"app.py raised during the first render: {report['exceptions']}")
+    return report["rendered_at"] - launched, report["run_s"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cold-start imports and time-to-first-render")
+    parser.add_argument("--repeat", type=int, default=5, help="Cold starts per scenario")
+    parser.add_argument("--top", type=int, default=15, help="Packages listed in the import report")
+    parser.add_argument("--module", action="append",
+                        help="Module to profile imports for (repeatable, default: app)")
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    for module in args.module or ["app"]:
+        total, rows = import_profile(module)
+        print(format_import_report(module, total, rows, args.top))
+        print()
+
+    results = []
+    with MockBackend(num_slices=64) as backend:
+        for name, scan_id in (("welcome page", ""), ("scan selected", "bench-scan")):
+            samples = [first_render(backend.url, scan_id) for _ in range(args.repeat)]
+            ttfr = [ttfr for ttfr, _ in samples]
+            run = [run for _, run in samples]
+            results.append(summarize(f"{name} first render", ttfr, sum(ttfr)))
+            results.append(summarize(f"{name} script run", run, sum(run)))
+
+    print(format_results(results))
+    if args.json:
+        write_json(results, args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Progressive volume loading benchmark
+
+Writes a synthetic CT volume as a compressed NIfTI file and a compressed
+.npz archive, then compares reading either in full before anything can be
+shown against core/scan_loader's StreamedVolume, which inflates slab by slab
+in the background: time to the first slice, to the middle slice and to the
+whole volume. Run from the repository root:
+
+    python -m benchmarks.bench_stream --slice-size 512 --num-slices 300
+"""
+import argparse
+import gzip
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+import nibabel as nib
+import numpy as np
+
+from benchmarks.harness import summarize, format_results, write_json, synthetic_ct_volume
+from core.scan_loader import NpzScan, StreamedVolume
+
+def stream_nifti_uncached(path):
+    """A StreamedVolume over a .nii.gz file, without filling the volume cache as stream_nifti does"""
+    dataobj = nib.load(path).dataobj
+
+    @contextmanager
+    def open_stream():
+        with gzip.open(path, "rb") as f:
+            f.seek(dataobj.offset)
+            yield f
+
+    return StreamedVolume(open_stream, dataobj.shape, dataobj.dtype, order=dataobj.order, description=path)
+
+def streamed_workloads(name, open_volume, repeat):
+    """Time to the first slice, the middle slice and the whole volume"""
+    first, middle, full = [], [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        volume = open_volume()
+        volume[:, :, 0]
+        first.append(time.perf_counter() - start)
+        volume[:, :, volume.shape[2] // 2]
+        middle.append(time.perf_counter() - start)
+        volume.wait()
+        full.append(time.perf_counter() - start)
+    return [
+        summarize(f"{name} first slice", first, sum(first)),
+        summarize(f"{name} middle slice", middle, sum(middle)),
+        summarize(f"{name} full volume", full, sum(full)),
+    ]
+
+def blocking_workload(name, load, repeat):
+    """Baseline: nothing can be shown until the whole volume is read"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        load()
+        times.append(time.perf_counter() - start)
+    return summarize(f"{name} blocking load", times, sum(times))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark progressive volume loading")
+    parser.add_argument("--slice-size", type=int, default=512, help="Slice width/height in pixels")
+    parser.add_argument("--num-slices", type=int, default=300, help="Slices along the z axis")
+    parser.add_argument("--repeat", type=int, default=3, help="Loads per workload")
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    volume = synthetic_ct_volume((args.slice_size, args.slice_size, args.num_slices), dtype=np.int16)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        nifti_path = os.path.join(tmp_dir, "scan.nii.gz")
+        nib.save(nib.Nifti1Image(volume, np.eye(4)), nifti_path)
+        npz_path = os.path.join(tmp_dir, "scan.npz")
+        np.savez_compressed(npz_path, volume=np.asfortranarray(volume))
+
+        # Streamed volumes must match the source voxel for voxel
+        for open_volume in (lambda: stream_nifti_uncached(nifti_path), lambda: NpzScan(npz_path).get_fdata()):
+            assert np.array_equal(np.asarray(open_volume()), volume)
+
+        results = [
+            blocking_workload("nifti", lambda: nib.load(nifti_path).get_fdata(), args.repeat),
+            *streamed_workloads("nifti", lambda: stream_nifti_uncached(nifti_path), args.repeat),
+            blocking_workload("npz", lambda: NpzScan(npz_path).get_array(), args.repeat),
+            *streamed_workloads("npz", lambda: NpzScan(npz_path).get_fdata(), args.repeat),
+        ]
+
+    print(format_results(results))
+    if args.json:
+        write_json(results, args.json)
+
+if __name__ == "__main__":
+    main()
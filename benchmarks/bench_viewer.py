@@ -0,0 +1,192 @@
+"""
+End-to-end viewer latency benchmark
+
+Starts the mock backend, points api.client at it and drives the remote and
+local slice sources of core/slice_source.py and the client functions through
+scroll, window-change, page-setup and report workloads. Run from the repository root:
+
+    python -m benchmarks.bench_viewer --latency-ms 5 --slice-size 512
+"""
+import argparse
+import io
+import itertools
+import logging
+
+import numpy as np
+from PIL import Image
+
+from api import client, async_client
+from core import slice_source
+from benchmarks.harness import run_workload, format_results, write_json, synthetic_ct_volume
+from benchmarks.mock_server import MockBackend
+from config import CINE_MAX_FRAMES
+from core.slice_source import LocalSliceSource, RemoteSliceSource, apply_window
+from utils.metrics import metrics
+
+# Window settings cycled by the window-change workloads (presets plus slider steps)
+WINDOW_SEQUENCE = [(100, 700), (-600, 1500), (40, 400), (500, 2000)] + [(c, 700) for c in range(-200, 300, 10)]
+
+def remote_workloads(backend, iterations):
+    """Workloads that go through RemoteSliceSource and api/client.py to the mock backend"""
+    scan_id = "bench-scan"
+    num_slices = backend.num_slices
+    windows = itertools.cycle(WINDOW_SEQUENCE)
+    source = RemoteSliceSource(scan_id)
+    clear = slice_source.clear_slice_cache
+
+    def page_setup():
+        clear()
+        client.get_api_health()
+        client.get_scan_list()
+        client.get_scan_metadata(scan_id)
+        source.get_slice("axial", num_slices // 2, 100, 700)
+
+    def page_setup_concurrent():
+        clear()
+        async_client.run_concurrently(
+            async_client.get_api_health(),
+            async_client.get_scan_list(),
+            async_client.get_scan_metadata(scan_id),
+            async_client.get_scan_slice(scan_id, "axial", num_slices // 2, 100, 700),
+        )
+
+    scroll = (
+        (lambda i=i: source.get_slice("axial", i % num_slices, 100, 700))
+        for i in range(iterations)
+    )
+    # Another worker scrolling the same study: in-process cache empty, shared cache warm
+    scroll_shared = (
+        (lambda i=i: (clear(),
+                      source.get_slice("axial", i % num_slices, 100, 700)))
+        for i in range(iterations)
+    )
+    # The slice cache is cleared first so repeated window settings still hit the network
+    window_change = (
+        (lambda w=next(windows): (clear(),
+                                  source.get_slice("axial", num_slices // 2, w[0], w[1])))
+        for _ in range(iterations)
+    )
+    cine_range = range(0, min(CINE_MAX_FRAMES, num_slices))
+    cine_batched = (
+        (lambda: (clear(), source.get_slices("axial", cine_range, 100, 700)))
+        for _ in range(max(1, iterations // 20))
+    )
+    cine_sequential = (
+        (lambda: (clear(),
+                  [source.get_slice("axial", i, 100, 700) for i in cine_range]))
+        for _ in range(max(1, iterations // 20))
+    )
+    report = (
+        (lambda: (client.analyze_scan(scan_id, ["Generate a comprehensive CTPA report for this scan."]),
+                  client.ask_question(scan_id, "Is there a pulmonary embolism?")))
+        for _ in range(max(1, iterations // 10))
+    )
+    upload_payload = b"\0" * (1024 * 1024)
+    upload = (
+        (lambda: client.upload_scan(("bench_upload.nii.gz", upload_payload)))
+        for _ in range(max(1, iterations // 10))
+    )
+
+    results = [
+        run_workload("remote page setup", (page_setup for _ in range(max(1, iterations // 5))), warmup=1),
+        run_workload("remote page setup (async)",
+                     (page_setup_concurrent for _ in range(max(1, iterations // 5))), warmup=1),
+        run_workload("remote scroll", scroll, warmup=5),
+    ]
+    if slice_source.SHARED_SLICE_CACHE:
+        results.append(run_workload("remote scroll (shared cache)", scroll_shared, warmup=5))
+    return results + [
+        run_workload("remote window change", window_change, warmup=5),
+        run_workload(f"cine fetch {len(cine_range)} batched", cine_batched),
+        run_workload(f"cine fetch {len(cine_range)} sequential", cine_sequential),
+        run_workload("remote report", report),
+        run_workload("remote upload (1 MB)", upload),
+    ]
+
+def local_workloads(volume, iterations):
+    """Workloads for LocalSliceSource: windowing float and int16 volumes, and rendering like st.image"""
+    nz = volume.shape[2]
+    windows = itertools.cycle(WINDOW_SEQUENCE)
+    # DICOM series and the int16 transport hand out int16 HU, windowed through a lookup table
+    volume_int16 = np.rint(volume).astype(np.int16)
+    source = LocalSliceSource("bench-local", volume_int16)
+
+    scroll = (
+        (lambda i=i: apply_window(volume[:, :, i % nz].T, 100, 700))
+        for i in range(iterations)
+    )
+    scroll_int16 = (
+        (lambda i=i: apply_window(volume_int16[:, :, i % nz].T, 100, 700))
+        for i in range(iterations)
+    )
+    window_change = (
+        (lambda w=next(windows): apply_window(volume[:, :, nz // 2].T, w[0], w[1]))
+        for _ in range(iterations)
+    )
+
+    def render(i):
+        # Mirrors display_scan_views: get the windowed slice, then encode to PNG like st.image
+        slice_data = source.get_slice("axial", i % nz, 100, 700)
+        Image.fromarray(slice_data["image"]).save(io.BytesIO(), format="PNG")
+
+    # Every slice is new, then the same stack again from the slice cache
+    render_ops = ((lambda i=i: render(i)) for i in range(max(1, iterations // 10)))
+    render_cached = ((lambda i=i: render(i)) for i in range(max(1, iterations // 10)))
+
+    slice_source.clear_slice_cache()
+    return [
+        run_workload("local scroll (window)", scroll, warmup=5),
+        run_workload("local scroll (window int16)", scroll_int16, warmup=5),
+        run_workload("local window change", window_change, warmup=5),
+        run_workload("local render (st.image)", render_ops),
+        run_workload("local render (st.image, cached)", render_cached),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark viewer hot paths against a mock backend")
+    parser.add_argument("--iterations", type=int, default=200, help="Operations per scroll/window workload")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Mock backend latency per request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Mock backend random extra latency")
+    parser.add_argument("--analyze-latency-ms", type=float, default=0.0, help="Extra latency for /analyze")
+    parser.add_argument("--slice-size", type=int, default=512, help="Slice width/height in pixels")
+    parser.add_argument("--num-slices", type=int, default=300, help="Slices along the z axis")
+    parser.add_argument("--report-kb", type=int, default=8, help="Size of the mock report HTML")
+    parser.add_argument("--transport", choices=sorted(client.SLICE_ACCEPT), default=client.SLICE_TRANSPORT,
+                        help="Slice transport requested by the client")
+    parser.add_argument("--legacy-server", action="store_true", help="Mock server only answers with JSON slices")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mock requests failing with 503")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="Fraction of mock requests with extra tail latency")
+    parser.add_argument("--tail-ms", type=float, default=0.0, help="Extra latency for the slow tail")
+    parser.add_argument("--shared-cache", action="store_true",
+                        help="Keep the host-wide shared slice cache on (off by default so remote workloads hit the network)")
+    parser.add_argument("--skip-local", action="store_true", help="Only run the remote workloads")
+    parser.add_argument("--spans", action="store_true", help="Also print the instrumented span breakdown")
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    # Client errors are expected to be rare here; keep the output readable
+    logging.basicConfig(level=logging.WARNING)
+
+    results = []
+    client.SLICE_TRANSPORT = args.transport
+    slice_source.SHARED_SLICE_CACHE = args.shared_cache
+    with MockBackend(args.latency_ms, args.jitter_ms, args.slice_size, args.num_slices,
+                     args.report_kb, args.analyze_latency_ms, args.legacy_server, args.error_rate,
+                     args.tail_rate, args.tail_ms) as backend:
+        client.API_URL = backend.url
+        results.extend(remote_workloads(backend, args.iterations))
+
+    if not args.skip_local:
+        volume = synthetic_ct_volume((args.slice_size, args.slice_size, args.num_slices))
+        results.extend(local_workloads(volume, args.iterations))
+
+    print(format_results(results))
+    if args.spans:
+        print()
+        print(format_results([dict(stats, name=name, ops=stats["count"], throughput=0.0)
+                              for name, stats in metrics.summary().items()]))
+    if args.json:
+        write_json(results, args.json)
+
+if __name__ == "__main__":
+    main()
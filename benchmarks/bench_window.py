@@ -0,0 +1,64 @@
+"""
+Auto-window benchmark
+
+Counts the per-slice HU histograms of a synthetic CT volume once through
+core/histogram and compares windows looked up from them with percentiles
+computed from the voxels on every change. Run from the repository root:
+
+    python -m benchmarks.bench_window --slice-size 512 --num-slices 300
+"""
+import argparse
+
+import numpy as np
+
+from benchmarks.harness import run_workload, format_results, write_json, synthetic_ct_volume
+from config import AUTO_WINDOW_MIN_HU, AUTO_WINDOW_PERCENTILES, HISTOGRAM_BIN_HU
+from core.histogram import compute_histogram
+
+def percentile_window(voxels):
+    """Baseline: auto window from the voxels themselves"""
+    voxels = voxels[voxels >= AUTO_WINDOW_MIN_HU]
+    low, high = np.percentile(voxels, AUTO_WINDOW_PERCENTILES)
+    return round((low + high) / 2), round(high - low)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark histogram-driven auto windows")
+    parser.add_argument("--slice-size", type=int, default=512, help="Slice width/height in pixels")
+    parser.add_argument("--num-slices", type=int, default=300, help="Slices along the z axis")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per whole-volume workload")
+    parser.add_argument("--iterations", type=int, default=100, help="Slices per per-slice workload")
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    volume = synthetic_ct_volume((args.slice_size, args.slice_size, args.num_slices), dtype=np.int16)
+    nz = volume.shape[2]
+    histogram = compute_histogram(volume)
+    print(f"histograms: {histogram.nbytes / 1024 ** 2:.1f} MB")
+
+    # Histogram windows must agree with exact percentiles to within a bin or two
+    for expected, window in ((percentile_window(volume), histogram.window()),
+                             (percentile_window(volume[:, :, nz // 2]), histogram.window("axial", nz // 2)),
+                             (percentile_window(volume[volume.shape[0] // 2]),
+                              histogram.window("sagittal", volume.shape[0] // 2))):
+        assert all(abs(a - b) <= 2 * HISTOGRAM_BIN_HU for a, b in zip(expected, window)), (expected, window)
+
+    results = [
+        run_workload("count histograms (once per volume)", (lambda: compute_histogram(volume)
+                                                             for _ in range(args.repeat))),
+        run_workload("volume percentiles (baseline)", (lambda: percentile_window(volume)
+                                                        for _ in range(args.repeat))),
+        run_workload("auto window from histogram", (lambda: histogram.window() for _ in range(args.iterations))),
+        run_workload("slice window from histogram", (
+            (lambda i=i: histogram.window("axial", i % nz)) for i in range(args.iterations)
+        )),
+        run_workload("slice percentiles (baseline)", (
+            (lambda i=i: percentile_window(volume[:, :, i % nz])) for i in range(args.iterations)
+        )),
+    ]
+
+    print(format_results(results))
+    if args.json:
+        write_json(results, args.json)
+
+if __name__ == "__main__":
+    main()
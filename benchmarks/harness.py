@@ -0,0 +1,143 @@
+"""
+Timing helpers shared by the benchmark scripts
+"""
+import json
+import math
+import time
+
+import numpy as np
+
+def percentile(sorted_values, pct):
+    """
+    Return the pct-th percentile of an already sorted list (nearest rank)
+
+    Parameters:
+    -----------
+    sorted_values : list of float
+        The samples, sorted ascending
+    pct : float
+        The percentile, between 0 and 100
+
+    Returns:
+    --------
+    float
+        The percentile value, or 0.0 for an empty list
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def summarize(name, samples, wall_time):
+    """
+    Summarize latency samples
+
+    Parameters:
+    -----------
+    name : str
+        The workload name
+    samples : list of float
+        Per-operation latencies in seconds
+    wall_time : float
+        Total elapsed time for the workload in seconds
+
+    Returns:
+    --------
+    dict
+        Latency percentiles in milliseconds and throughput in operations per second
+    """
+    ordered = sorted(samples)
+    return {
+        "name": name,
+        "ops": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000 if ordered else 0.0,
+        "p50_ms": percentile(ordered, 50) * 1000,
+        "p95_ms": percentile(ordered, 95) * 1000,
+        "p99_ms": percentile(ordered, 99) * 1000,
+        "max_ms": ordered[-1] * 1000 if ordered else 0.0,
+        "throughput": len(ordered) / wall_time if wall_time > 0 else 0.0,
+    }
+
+def run_workload(name, operations, warmup=0):
+    """
+    Time a sequence of operations
+
+    Parameters:
+    -----------
+    name : str
+        The workload name
+    operations : iterable of callable
+        Zero-argument callables, each timed as one operation
+    warmup : int
+        Number of leading operations that run but are not recorded
+
+    Returns:
+    --------
+    dict
+        The summary produced by summarize()
+    """
+    samples = []
+    start = None
+    for i, op in enumerate(operations):
+        if i == warmup:
+            start = time.perf_counter()
+        t0 = time.perf_counter()
+        op()
+        if i >= warmup:
+            samples.append(time.perf_counter() - t0)
+    wall_time = time.perf_counter() - start if start is not None else 0.0
+    return summarize(name, samples, wall_time)
+
+def format_results(results):
+    """Format workload summaries as a fixed-width table"""
+    header = f"{'workload':<28}{'ops':>7}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}{'ops/s':>10}"
+    lines = [header, "-" * len(header)]
+    for r in results:
+        lines.append(
+            f"{r['name']:<28}{r['ops']:>7}{r['mean_ms']:>10.2f}{r['p50_ms']:>10.2f}"
+            f"{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['max_ms']:>10.2f}{r['throughput']:>10.1f}"
+        )
+    lines.append("(latencies in ms)")
+    return "\n".join(lines)
+
+def write_json(results, path):
+    """Write workload summaries to a JSON file for comparison between runs"""
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+def synthetic_ct_volume(shape=(512, 512, 300), dtype=np.float64, seed=0):
+    """
+    Build a CT-like volume in Hounsfield units
+
+    Air outside an elliptical body, soft tissue inside it, two lungs and a
+    few contrast-filled vessels running along the z axis, plus noise.
+
+    Parameters:
+    -----------
+    shape : tuple
+        Volume shape as (x, y, z), matching the viewer's axis convention
+    dtype : numpy.dtype
+        Output dtype; float64 matches what nibabel's get_fdata returns
+    seed : int
+        Seed for the noise
+
+    Returns:
+    --------
+    numpy.ndarray
+        The synthetic volume
+    """
+    nx, ny, nz = shape
+    x = np.linspace(-1, 1, nx)[:, None]
+    y = np.linspace(-1, 1, ny)[None, :]
+    plane = np.full((nx, ny), -1000.0, dtype=np.float32)
+    plane[(x / 0.9) ** 2 + (y / 0.7) ** 2 < 1] = 40
+    for cx in (-0.4, 0.4):
+        plane[((x - cx) / 0.3) ** 2 + (y / 0.5) ** 2 < 1] = -850
+    for cx, cy in ((-0.3, 0.1), (0.3, 0.1), (0.0, -0.2), (-0.45, -0.2), (0.45, -0.2)):
+        plane[(x - cx) ** 2 + (y - cy) ** 2 < 0.004] = 350
+
+    rng = np.random.default_rng(seed)
+    volume = np.empty(shape, dtype=dtype)
+    for z in range(nz):
+        volume[:, :, z] = plane + rng.normal(0, 15, (nx, ny)).astype(np.float32)
+    return volume
@@ -0,0 +1,387 @@
+"""
+Local stand-in for the CTPA backend API
+
+Implements the endpoints used by api/client.py, including the batched
+/slices endpoint, with configurable latency and payload sizes, so the client
+and viewer hot paths can be benchmarked without a model server. Run it on its own with:
+
+    python -m benchmarks.mock_server --port 8000 --latency-ms 20
+"""
+import argparse
+import base64
+import json
+import random
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+# Number of distinct synthetic slice images kept in memory
+_SLICE_VARIANTS = 8
+
+def encode_png(img):
+    """
+    Encode a 2D uint8 array as a grayscale PNG
+
+    Parameters:
+    -----------
+    img : numpy.ndarray
+        The image, uint8 with shape (height, width)
+
+    Returns:
+    --------
+    bytes
+        The PNG file contents
+    """
+    height, width = img.shape
+    # Each scanline is prefixed with filter type 0 (None)
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), img]).tobytes()
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b"")
+
+def synthetic_slice(size, seed):
+    """Return a CT-like uint8 slice: a bright disc with noise on a dark background"""
+    rng = np.random.default_rng(seed)
+    y, x = np.ogrid[:size, :size]
+    r = np.hypot(x - size / 2, y - size / 2)
+    img = np.where(r < size * 0.42, 140, 10).astype(np.float32)
+    img += rng.normal(0, 18, (size, size))
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+class MockBackend:
+    """
+    Threaded HTTP server emulating the backend API
+
+    Parameters:
+    -----------
+    latency_ms : float
+        Fixed delay added to every response
+    jitter_ms : float
+        Upper bound of a uniform random delay added on top of latency_ms
+    slice_size : int
+        Width and height of the returned slice images
+    num_slices : int
+        Number of slices along each axis of the fake scan
+    report_kb : int
+        Approximate size of the report HTML returned by /analyze
+    analyze_latency_ms : float
+        Extra delay for /analyze, which is model-bound in the real backend
+    legacy : bool
+        Ignore Accept headers and always answer /slice with JSON, like older servers
+    error_rate : float
+        Fraction of requests answered with 503, to exercise retries and the circuit breaker
+    tail_rate : float
+        Fraction of requests delayed by an extra tail_ms, to exercise hedging
+    tail_ms : float
+        Extra delay for the slow tail
+    """
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, slice_size=512, num_slices=300,
+                 report_kb=8, analyze_latency_ms=0.0, legacy=False, error_rate=0.0,
+                 tail_rate=0.0, tail_ms=0.0, host="127.0.0.1", port=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.slice_size = slice_size
+        self.num_slices = num_slices
+        self.report_kb = report_kb
+        self.analyze_latency_ms = analyze_latency_ms
+        self.legacy = legacy
+        self.error_rate = error_rate
+        self.tail_rate = tail_rate
+        self.tail_ms = tail_ms
+        self.host = host
+        self.port = port
+        self.scans = {}
+        self.request_counts = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+        self.slice_pixels = [synthetic_slice(slice_size, seed) for seed in range(_SLICE_VARIANTS)]
+        self.slice_pngs = [encode_png(img) for img in self.slice_pixels]
+        # Raw Hounsfield units for the int16 transport (uint8 grey levels mapped back to HU)
+        self.slice_hu = [(img.astype(np.int16) * 8 - 1000) for img in self.slice_pixels]
+        self.add_scan("bench-scan", "bench_scan.nii.gz")
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def add_scan(self, scan_id, filename):
+        """Register a fake scan and return its metadata"""
+        self.scans[scan_id] = {
+            "scan_id": scan_id,
+            "filename": filename,
+            "upload_time": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+            "dimensions": [self.slice_size, self.slice_size, self.num_slices],
+        }
+        return self.scans[scan_id]
+
+    def count(self, endpoint):
+        with self._lock:
+            self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+
+    def delay(self, extra_ms=0.0):
+        """Sleep for the configured latency plus jitter"""
+        delay_ms = self.latency_ms + extra_ms + random.uniform(0, self.jitter_ms)
+        if random.random() < self.tail_rate:
+            delay_ms += self.tail_ms
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+    def report_html(self, scan_id):
+        """Return report HTML padded to roughly report_kb kilobytes"""
+        body = f"<h4>FINDINGS:</h4><p>Synthetic report for {scan_id}.</p>"
+        filler = "<p>No acute cardiopulmonary abnormality.</p>"
+        repeat = max(1, self.report_kb * 1024 // len(filler))
+        return f"<div class='report-container'>{body}{filler * repeat}</div>"
+
+    def start(self):
+        """Start serving on a background thread and return the base URL"""
+        handler = type("MockHandler", (_MockHandler,), {"backend": self})
+        self._server = ThreadingHTTPServer((self.host, self.port), handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+class _MockHandler(BaseHTTPRequestHandler):
+    backend = None
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without TCP_NODELAY the
+    # body waits on the client's delayed ACK, like no production server does
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def do_GET(self):
+        backend = self.backend
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        backend.count(parts[0])
+        backend.delay()
+
+        if random.random() < backend.error_rate:
+            self.send_json({"detail": "Service unavailable"}, 503)
+        elif parts == ["health"]:
+            self.send_json({"status": "healthy", "model_loaded": True, "api_url": backend.url, "device": "cpu"})
+        elif parts == ["scans"]:
+            self.send_json(list(backend.scans.values()))
+        elif len(parts) == 2 and parts[0] == "scans":
+            if parts[1] in backend.scans:
+                self.send_json(backend.scans[parts[1]])
+            else:
+                self.send_json({"detail": "Scan not found"}, 404)
+        elif len(parts) == 2 and parts[0] == "slice":
+            self.handle_slice(parts[1], parse_qs(url.query))
+        elif len(parts) == 2 and parts[0] == "slices":
+            self.handle_slices(parts[1], parse_qs(url.query))
+        else:
+            self.send_json({"detail": "Not found"}, 404)
+
+    def do_POST(self):
+        backend = self.backend
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        backend.count(parts[0])
+        body = self.read_body()
+
+        if random.random() < backend.error_rate:
+            backend.delay()
+            self.send_json({"detail": "Service unavailable"}, 503)
+        elif parts == ["analyze"]:
+            backend.delay(backend.analyze_latency_ms)
+            scan_id = json.loads(body or b"{}").get("scan_id")
+            self.send_json({"scan_id": scan_id, "report_html": backend.report_html(scan_id)})
+        elif len(parts) == 2 and parts[0] == "ask":
+            backend.delay()
+            question = json.loads(body or b"{}").get("text", "")
+            self.send_json({"scan_id": parts[1], "question": question,
+                            "answer": "No filling defect is seen in the visualized pulmonary arteries."})
+        elif parts == ["upload"]:
+            backend.delay()
+            scan_id = f"scan-{len(backend.scans) + 1}"
+            self.send_json(backend.add_scan(scan_id, f"{scan_id}.nii.gz"))
+        else:
+            self.send_json({"detail": "Not found"}, 404)
+
+    def send_binary(self, body, content_type, extra_headers):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in extra_headers.items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def slice_payload(self, scan_id, view, slice_idx, query, media_type, dtype):
+        """Return (content_type, headers, body) for one slice in the negotiated format"""
+        backend = self.backend
+        variant = slice_idx % _SLICE_VARIANTS
+        if media_type == "application/json":
+            png = backend.slice_pngs[variant]
+            body = json.dumps({
+                "scan_id": scan_id,
+                "view": view,
+                "slice_idx": slice_idx,
+                "image": "data:image/png;base64," + base64.b64encode(png).decode(),
+            }).encode()
+            return "application/json", {}, body
+
+        headers = {
+            "X-Slice-View": view,
+            "X-Slice-Idx": slice_idx,
+            "X-Window-Center": query.get("window_center", ["0"])[0],
+            "X-Window-Width": query.get("window_width", ["1"])[0],
+        }
+        if media_type == "image/png":
+            return media_type, headers, backend.slice_pngs[variant]
+        pixels = backend.slice_hu[variant] if dtype == "int16" else backend.slice_pixels[variant]
+        headers["X-Slice-Shape"] = ",".join(str(n) for n in pixels.shape)
+        headers["X-Slice-Dtype"] = pixels.dtype.str
+        return media_type, headers, pixels.tobytes()
+
+    def handle_slice(self, scan_id, query):
+        backend = self.backend
+        if scan_id not in backend.scans:
+            self.send_json({"detail": "Scan not found"}, 404)
+            return
+        slice_idx = int(query.get("slice_idx", ["0"])[0])
+        view = query.get("view", ["axial"])[0]
+        accept = "application/json" if backend.legacy else self.headers.get("Accept", "*/*")
+        media_type, dtype = negotiate_slice_format(accept)
+
+        if media_type is None:
+            self.send_json({"detail": "Not acceptable"}, 406)
+            return
+        content_type, headers, body = self.slice_payload(scan_id, view, slice_idx, query, media_type, dtype)
+        self.send_binary(body, content_type, headers)
+
+    def handle_slices(self, scan_id, query):
+        """Batched slices as multipart/mixed, or a JSON list if multipart is not accepted"""
+        backend = self.backend
+        if backend.legacy:
+            self.send_json({"detail": "Not found"}, 404)
+            return
+        if scan_id not in backend.scans:
+            self.send_json({"detail": "Scan not found"}, 404)
+            return
+        indices = [int(i) for i in query.get("slices", [""])[0].split(",") if i]
+        view = query.get("view", ["axial"])[0]
+        accept = self.headers.get("Accept", "*/*")
+        media_type, dtype = negotiate_slice_format(accept)
+
+        if "multipart/mixed" not in accept:
+            # JSON list of legacy slice objects
+            slices = [json.loads(self.slice_payload(scan_id, view, idx, query, "application/json", None)[2])
+                      for idx in indices]
+            self.send_json({"slices": slices})
+            return
+        if media_type is None:
+            self.send_json({"detail": "Not acceptable"}, 406)
+            return
+
+        boundary = f"slice-boundary-{random.getrandbits(64):016x}"
+        parts = []
+        for idx in indices:
+            content_type, headers, body = self.slice_payload(scan_id, view, idx, query, media_type, dtype)
+            head = f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+            head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+            parts.append(head.encode() + b"\r\n" + body + b"\r\n")
+        parts.append(f"--{boundary}--\r\n".encode())
+        self.send_binary(b"".join(parts), f"multipart/mixed; boundary={boundary}", {})
+
+def negotiate_slice_format(accept):
+    """
+    Pick the slice format for an Accept header
+
+    Supports image/png, application/octet-stream (dtype=uint8 or int16) and
+    application/json; WebP is not produced by the mock.
+
+    Returns:
+    --------
+    tuple
+        (media_type, dtype) or (None, None) if nothing acceptable is supported
+    """
+    candidates = []
+    for position, entry in enumerate(accept.split(",")):
+        media_type, *params = [part.strip() for part in entry.split(";")]
+        options = dict(p.split("=", 1) for p in params if "=" in p)
+        q = float(options.pop("q", 1))
+        if q > 0:
+            candidates.append((-q, position, media_type.lower(), options))
+
+    for _, _, media_type, options in sorted(candidates):
+        if media_type in ("*/*", "application/*", "application/json"):
+            return "application/json", None
+        if media_type in ("image/png", "image/*"):
+            return "image/png", None
+        if media_type == "application/octet-stream":
+            dtype = options.get("dtype", "uint8")
+            if dtype in ("uint8", "int16"):
+                return media_type, dtype
+    return None, None
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the mock CTPA backend")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--slice-size", type=int, default=512)
+    parser.add_argument("--num-slices", type=int, default=300)
+    parser.add_argument("--report-kb", type=int, default=8)
+    parser.add_argument("--analyze-latency-ms", type=float, default=0.0)
+    parser.add_argument("--legacy", action="store_true", help="Only serve JSON-wrapped slices")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--tail-rate", type=float, default=0.0)
+    parser.add_argument("--tail-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    backend = MockBackend(args.latency_ms, args.jitter_ms, args.slice_size, args.num_slices,
+                          args.report_kb, args.analyze_latency_ms, args.legacy, args.error_rate,
+                          args.tail_rate, args.tail_ms, args.host, args.port)
+    print(f"Mock backend listening on {backend.start()}")
+    try:
+        backend._thread.join()
+    except KeyboardInterrupt:
+        backend.stop()
+
+if __name__ == "__main__":
+    main()
@@ -8,12 +8,160 @@ APP_LAYOUT = "wide"
 INITIAL_SIDEBAR_STATE = "expanded"
 
 # Default window settings
-DEFAULT_WINDOW_WIDTH = 400  # Default pulmonary window
+DEFAULT_WINDOW_WIDTH = 1500  # Default pulmonary window
 DEFAULT_WINDOW_CENTER = -600  # Default pulmonary window
 
+# Window presets as (center, width) in HU, in button order
+WINDOW_PRESETS = {
+    "PE Protocol": (100, 700),
+    "Pulmonary": (-600, 1500),
+    "Mediastinal": (40, 400),
+    "Bone": (500, 2000),
+}
+
 # Data directory
 DATA_DIR = "data/ctpa_scan_data"
 
+# NPZ settings
+NPZ_VOLUME_KEY = os.environ.get("NPZ_VOLUME_KEY", "")  # Empty means auto-detect
+NPZ_VOLUME_KEYS = ("volume", "scan", "data", "image", "arr_0")  # Tried in order
+NPZ_STREAM_CHUNK_BYTES = 16 * 1024 * 1024  # Read size for compressed members
+
+# Compressed NIfTI and .npz volumes are inflated progressively in the background
+STREAM_SLAB_SLICES = 8  # Slices published at a time
+STREAM_WORKERS = 2  # Volumes inflated concurrently
+
+# Decompressed volume cache
+CACHE_DIR = os.environ.get("CACHE_DIR", "data/cache")
+VOLUME_CACHE_DIR = os.path.join(CACHE_DIR, "volumes")
+VOLUME_CACHE_MAX_BYTES = int(os.environ.get("VOLUME_CACHE_MAX_BYTES", 8 * 1024 ** 3))
+SCAN_HASH_MEMO_ENTRIES = 1024  # Content hashes remembered by (path, size, mtime)
+
+# Idle in-memory volumes are kept as int16, compressed one slab of axial slices at a time
+VOLUME_IDLE_SECONDS = int(os.environ.get("VOLUME_IDLE_SECONDS", 300))  # Untouched this long, held volumes are compressed
+COMPRESSED_VOLUME_CODEC = os.environ.get("COMPRESSED_VOLUME_CODEC", "zstd")  # "zstd", "lz4" or "zlib"
+COMPRESSED_SLAB_SLICES = 8
+COMPRESSED_SLAB_CACHE = 2  # Decompressed slabs kept per volume
+
+# DICOM series
+DICOM_DECODE_WORKERS = int(os.environ.get("DICOM_DECODE_WORKERS", 4))  # Slice decode threads
+
+# Slice cache shared across sessions and Streamlit workers on this host
+SHARED_CACHE_DIR = os.path.join(CACHE_DIR, "shared")
+SHARED_CACHE_MAX_BYTES = int(os.environ.get("SHARED_CACHE_MAX_BYTES", 1024 ** 3))  # Per cache
+SHARED_SLICE_CACHE = os.environ.get("SHARED_SLICE_CACHE", "1") != "0"
+
+# Report HTML by content hash: every report is kept on disk, only the in-memory copies are evicted
+REPORT_STORE_DIR = os.environ.get("REPORT_STORE_DIR", "data/reports")
+REPORT_STORE_MEMORY_BYTES = int(os.environ.get("REPORT_STORE_MEMORY_BYTES", 32 * 1024 ** 2))
+
+# Full chat histories, one append-only file per session and scan; sessions keep only the latest messages
+CHAT_STORE_DIR = os.environ.get("CHAT_STORE_DIR", "data/chats")
+
+# App state (uploaded scans, report digests, current scan) survives restarts
+# as a snapshot plus an append-only journal of changes since it was written
+APP_STATE_PATH = os.environ.get("APP_STATE_PATH", "app_state.json")
+APP_STATE_JOURNAL_PATH = f"{APP_STATE_PATH}.journal"
+APP_STATE_COMPACT_BYTES = 256 * 1024  # Journal size that triggers folding it into the snapshot
+
+# Session state holds handles; heavy payloads live in the shared caches above
+SESSION_MEMORY_BUDGET_BYTES = int(os.environ.get("SESSION_MEMORY_BUDGET_BYTES", 8 * 1024 ** 2))
+SESSION_MAX_NOTIFICATIONS = 20  # Oldest pending notifications are dropped
+SESSION_MAX_CHAT_MESSAGES = 50  # Per scan kept in the session; the chat store has them all
+LOCAL_VOLUMES_MAX_BYTES = int(os.environ.get("LOCAL_VOLUMES_MAX_BYTES", 2 * 1024 ** 3))  # In-memory volumes per process
+
+# Slice transport: "webp", "png", "uint8" or "int16" ask for a binary body,
+# "json" keeps the legacy JSON-wrapped image. Servers that only speak JSON
+# are detected from the response content type.
+SLICE_TRANSPORT = os.environ.get("SLICE_TRANSPORT", "png")
+SLICE_CACHE_SIZE = 512  # Decoded slices kept per process
+SLICE_BATCH_MAX = 64  # Slices per batched request
+SLICE_PREFETCH_RADIUS = 3  # Neighbouring slices warmed on each side of the one shown
+SLICE_PREFETCH_WORKERS = 2
+SLICE_FRAME_WORKERS = 8  # Threads fetching the slice each viewer shows next
+SLICE_FRAME_IN_FLIGHT = 3  # Per viewer; newer requests queue behind these, replacing each other
+SLICE_FRAME_WAIT_SECONDS = 0.05  # Longest a rerun blocks on its frame; slower ones are awaited between reruns
+SLICE_FRAME_POLL_SECONDS = 0.25  # How often a page still waiting for its frame checks on it
+SLICE_FRAME_VIEWERS = 256  # Viewers whose latest request is tracked per process
+
+# Scan metadata is immutable after upload, so it is cached per process and in the shared cache
+METADATA_CACHE_MAX_BYTES = int(os.environ.get("METADATA_CACHE_MAX_BYTES", 64 * 1024 ** 2))
+METADATA_REQUIRED_FIELDS = ("filename", "dimensions")  # Entries missing these are refetched
+
+# Backend resilience
+CIRCUIT_FAILURE_THRESHOLD = 5  # Consecutive failures before failing fast
+CIRCUIT_RESET_SECONDS = 30  # Time the circuit stays open before a probe
+RETRY_MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.5  # Seconds, doubled per attempt with full jitter
+RETRY_MAX_DELAY = 8.0
+HEDGE_MIN_DELAY = 0.05  # Never hedge a /slice request sooner than this
+HEDGE_WORKERS = 8
+ENDPOINT_TIMEOUTS = {  # (initial, minimum, maximum) seconds
+    "health": (5, 1, 5),
+    "upload": (120, 30, 300),
+    "scans": (10, 2, 30),
+    "slice": (10, 1, 15),
+    "slices": (30, 3, 60),
+    "ask": (30, 5, 60),
+    "analyze": (60, 20, 120),
+    "default": (30, 2, 60),
+}
+
+# Async client
+ASYNC_HTTP2 = True  # Negotiated over TLS only; plain http stays on HTTP/1.1
+ASYNC_MAX_CONNECTIONS = 20
+
+# Cine and montage
+CINE_DEFAULT_FPS = 10
+CINE_MAX_FRAMES = 64
+MONTAGE_LAYOUTS = {"2 x 2": (2, 2), "3 x 3": (3, 3), "4 x 4": (4, 4), "3 x 5": (3, 5)}
+
+# Key images
+KEY_IMAGE_THUMBNAIL_SIZE = 320  # Longest side in pixels
+KEY_IMAGE_THUMBNAIL_QUALITY = 80  # WebP quality
+KEY_IMAGE_CACHE_MAX_BYTES = 256 * 1024 ** 2
+
+# PDF export
+PDF_EXPORT_WORKERS = int(os.environ.get("PDF_EXPORT_WORKERS", 2))  # Render processes
+PDF_PAGE_SIZE = (8.27, 11.69)  # A4, inches
+PDF_MARGIN_INCHES = 0.75
+PDF_KEY_SLICES = 2  # Key slice images embedded per report
+
+# Tissue ranges (HU) shared by the masks and the local analysis
+LUNG_HU = (-950, -600)  # Aerated lung parenchyma
+VESSEL_HU = (150, 600)  # Contrast-filled vessel lumen
+BONE_HU = 700  # Cortical bone and above
+
+# Lung/vessel masks, bit-packed and cached on disk by volume hash
+MASK_CACHE_DIR = os.path.join(CACHE_DIR, "masks")
+MASK_CACHE_SIZE = 4  # Mask sets kept open per process
+MASK_WORKERS = 1  # Background mask computations
+MASK_SLAB = 16  # Axial slices thresholded at a time
+MASK_MIN_VESSEL_VOXELS = 50  # Smaller vessel components are dropped as noise
+MASK_OVERLAY_ALPHA = 0.35
+MASK_OVERLAY_COLORS = {"lung": (64, 160, 255), "vessel": (255, 64, 64)}
+
+# HU histograms, one pass per volume, driving the auto window
+HISTOGRAM_RANGE = (-1024, 3072)  # HU covered; values outside land in the end bins
+HISTOGRAM_BIN_HU = 4
+HISTOGRAM_SLAB = 16  # Axial slices counted at a time
+HISTOGRAM_WORKERS = 1
+AUTO_WINDOW_PERCENTILES = (1, 99)
+AUTO_WINDOW_MIN_HU = -950  # Air around the patient and padding are left out of the percentiles
+
+# Local CPU analysis, used when the AI backend is unavailable
+LOCAL_ANALYSIS_ENABLED = os.environ.get("LOCAL_ANALYSIS", "1") != "0"
+LOCAL_ANALYSIS_BUDGET_S = float(os.environ.get("LOCAL_ANALYSIS_BUDGET_S", 20))  # Per scan, in the worker
+LOCAL_ANALYSIS_WORKERS = 1  # Analysis processes
+LOCAL_ANALYSIS_MAX_SIDE = 256  # In-plane size the volume is downsampled to
+LOCAL_ANALYSIS_SLAB = 16  # Axial slices processed between budget checks
+LOCAL_ANALYSIS_CLOT_HU = (-20, 100)  # Thrombus inside the lumen
+LOCAL_ANALYSIS_MIN_VOXELS = 12  # Smallest candidate, at the analysis resolution
+
+# Performance metrics
+METRICS_BUFFER_SIZE = 1024  # Recent samples kept per span for percentiles
+METRICS_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
 def set_page_config():
     """Set Streamlit page configuration"""
     st.set_page_config(
@@ -23,6 +171,7 @@ def set_page_config():
         initial_sidebar_state=INITIAL_SIDEBAR_STATE
     )
 
-# Create data directory if it doesn't exist
-if not os.path.exists(DATA_DIR):
-    os.makedirs(DATA_DIR, exist_ok=True)
\ No newline at end of file
+# Create data directories if they don't exist
+for directory in (DATA_DIR, VOLUME_CACHE_DIR, MASK_CACHE_DIR, REPORT_STORE_DIR, CHAT_STORE_DIR):
+    if not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
\ No newline at end of file
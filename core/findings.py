@@ -0,0 +1,201 @@
+import re
+import threading
+from dataclasses import dataclass, asdict
+
+# Clot burden grades, from least to most proximal involvement
+CLOT_BURDEN_LEVELS = ("subsegmental", "segmental", "lobar", "central", "saddle")
+
+# Findings sources; only the backend's are definitive
+FINDINGS_SOURCE_BACKEND = "backend"
+FINDINGS_SOURCE_LOCAL = "local"
+
+@dataclass(frozen=True)
+class Findings:
+    """
+    Structured PE findings for one study
+
+    Attributes:
+    -----------
+    pe_present : bool or None
+        Whether a pulmonary embolism was found; None when the study has not
+        been assessed (e.g. the fallback report)
+    location : str or None
+        Most proximal vessel involved, e.g. 'right lower lobe pulmonary artery'
+    rv_strain : bool or None
+        Whether there is CT evidence of right heart strain; None when it was
+        not assessed
+    clot_burden : str or None
+        One of CLOT_BURDEN_LEVELS
+    source : str
+        What assessed the study: 'backend' for the AI analysis, or 'local'
+        for the preliminary CPU heuristic of core.local_analysis
+    """
+    pe_present: bool = None
+    location: str = None
+    rv_strain: bool = None
+    clot_burden: str = None
+    source: str = FINDINGS_SOURCE_BACKEND
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build findings from a dict, ignoring unknown keys"""
+        return cls(**{key: data[key] for key in cls.__dataclass_fields__ if key in data})
+
+    @classmethod
+    def from_report_html(cls, report_html):
+        """
+        Extract findings from a report that only exists as HTML
+
+        Used once when the backend returns a report without structured
+        findings, so later queries never have to parse it again. The text is
+        split into clauses and negation is resolved within each one, so "no
+        filling defect on the left" does not cancel an embolus described on
+        the right. A positive clause wins over negations that name a side or
+        lobe; one that contradicts a negation of PE as a whole, like a report
+        stating neither, is left unassessed rather than guessed.
+
+        Parameters:
+        -----------
+        report_html : str
+            The report HTML
+
+        Returns:
+        --------
+        Findings
+            The findings; pe_present is None when the report is ambiguous or
+            states neither, and rv_strain when it does not mention strain
+        """
+        text = re.sub(r"<(style|script)\b.*?</\1>", "", report_html or "", flags=re.S | re.I)
+        text = re.sub(r"<[^>]+>", "\n", text).lower()
+        clauses = [re.sub(r"\s+", " ", clause).strip() for clause in _CLAUSE_BREAK.split(text)]
+
+        positive, negated_global, negated_local = [], False, False
+        for clause in clauses:
+            match = _PE_TERM.search(clause)
+            if match is None or _HEDGE.search(clause):
+                continue
+            if _negated(clause, match):
+                if _LATERAL.search(clause):
+                    negated_local = True
+                else:
+                    negated_global = True
+            else:
+                positive.append(clause)
+
+        if positive and negated_global:
+            return cls()
+        if not positive:
+            return cls(pe_present=False) if negated_global or negated_local else cls()
+
+        location = None
+        for clause in positive:
+            match = re.search(r"\bin the ((?:[a-z]+ ){0,5}pulmonary arter(?:y|ies))", clause)
+            if match:
+                location = match.group(1)
+                break
+
+        rv_strain = None
+        for clause in clauses:
+            match = _STRAIN_TERM.search(clause)
+            if match is not None and not _HEDGE.search(clause):
+                rv_strain = rv_strain or not _negated(clause, match)
+
+        # Burden is often a clause of its own, e.g. "Segmental clot burden"
+        burden_text = " ".join(positive + [clause for clause in clauses if "burden" in clause
+                                           and not _negated(clause, re.search("burden", clause))])
+        clot_burden = next((level for level in reversed(CLOT_BURDEN_LEVELS)
+                            if re.search(rf"\b{level}\b", burden_text)), None)
+
+        return cls(pe_present=True, location=location, rv_strain=rv_strain, clot_burden=clot_burden)
+
+# Sentence ends, list items and contrastive conjunctions end a negation's scope
+_CLAUSE_BREAK = re.compile(r"[.;:!?\n]+\s|[.;:!?]*\n|,? (?:but|however|although|whereas|while) ")
+_PE_TERM = re.compile(r"filling defects?|embol(?:us|i|ism|ic)|\bpe\b")
+_STRAIN_TERM = re.compile(r"(?:right heart|right ventricular|rv) (?:strain|dysfunction)")
+_NEGATION_BEFORE = re.compile(r"\b(?:no|not|without|negative for|free of|absence of|nor)\b")
+_NEGATION_AFTER = re.compile(r"\b(?:ruled out|excluded|absent|not (?:seen|identified|present|demonstrated))\b")
+# Indications, recommendations and inconclusive statements are not findings
+_HEDGE = re.compile(r"suspect|suspicion|evaluate for|assess(?:ment)? for|rule out|to exclude|concern for"
+                    r"|history of|indication|inconclusive|indeterminate|non-?diagnostic|cannot be"
+                    r"|not (?:been )?assessed|\?")
+_LATERAL = re.compile(r"\b(?:left|right|upper|middle|lower|lobe|lingula\w*)\b")
+
+def _negated(clause, match):
+    """Whether the term matched in a clause is negated within that clause"""
+    return bool(_NEGATION_BEFORE.search(clause, 0, match.start()) or _NEGATION_AFTER.search(clause, match.end()))
+
+# Findings of the demonstration report in core.report_generator
+DEMO_PE_FINDINGS = Findings(pe_present=True, location="right lower lobe pulmonary artery", rv_strain=False)
+NORMAL_FINDINGS = Findings(pe_present=False)
+
+class FindingsStore:
+    """
+    Findings per scan with an inverted index on every field
+
+    Queries such as "all PE-positive studies with RV strain" are set
+    intersections over the index, never a scan over the reports.
+    """
+
+    def __init__(self):
+        self._findings = {}
+        self._index = {field: {} for field in Findings.__dataclass_fields__}
+        self._lock = threading.Lock()
+
+    def put(self, scan_id, findings):
+        """Store or replace the findings for a scan"""
+        with self._lock:
+            previous = self._findings.get(scan_id)
+            if previous is not None:
+                for field, value in previous.to_dict().items():
+                    self._index[field][value].discard(scan_id)
+            self._findings[scan_id] = findings
+            for field, value in findings.to_dict().items():
+                self._index[field].setdefault(value, set()).add(scan_id)
+
+    def get(self, scan_id):
+        """Return the findings for a scan, or None if it has not been reported"""
+        with self._lock:
+            return self._findings.get(scan_id)
+
+    def remove(self, scan_id):
+        with self._lock:
+            findings = self._findings.pop(scan_id, None)
+            if findings is not None:
+                for field, value in findings.to_dict().items():
+                    self._index[field][value].discard(scan_id)
+
+    def query(self, **criteria):
+        """
+        Return the scan IDs whose findings match every criterion
+
+        Parameters:
+        -----------
+        **criteria
+            Field values to match, e.g. pe_present=True, rv_strain=True
+
+        Returns:
+        --------
+        set
+            Matching scan IDs; all reported scans when no criteria are given
+        """
+        with self._lock:
+            if not criteria:
+                return set(self._findings)
+            matches = None
+            for field, value in criteria.items():
+                ids = self._index[field].get(value, set())
+                matches = set(ids) if matches is None else matches & ids
+                if not matches:
+                    break
+            return matches
+
+    def reported(self):
+        """Return the IDs of all scans with findings"""
+        with self._lock:
+            return set(self._findings)
+
+# Shared by every session in the process
+findings_store = FindingsStore()
@@ -0,0 +1,224 @@
+import logging
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from config import (
+    HISTOGRAM_RANGE, HISTOGRAM_BIN_HU, HISTOGRAM_SLAB, HISTOGRAM_WORKERS,
+    AUTO_WINDOW_PERCENTILES, AUTO_WINDOW_MIN_HU
+)
+from core.slice_source import VIEW_AXES
+from utils.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Histograms are counted in the background as soon as a volume is registered
+_executor = ThreadPoolExecutor(max_workers=HISTOGRAM_WORKERS, thread_name_prefix="histogram")
+_pending = {}
+_lock = threading.Lock()
+
+# Histograms by id(volume), with a weak reference to detect reused ids
+_histograms = {}
+
+class VolumeHistogram:
+    """
+    HU histograms of every slice of a volume, along each view
+
+    The whole-volume histogram is the sum of the axial ones, so any window
+    derived from the histograms is a lookup rather than a pass over voxels.
+    """
+
+    def __init__(self, counts):
+        self.counts = counts
+        self.total = counts["axial"].sum(axis=0)
+
+    @property
+    def nbytes(self):
+        return sum(counts.nbytes for counts in self.counts.values())
+
+    def percentiles(self, percentiles=AUTO_WINDOW_PERCENTILES, view=None, slice_idx=None):
+        """
+        HU percentiles of the volume, or of one slice
+
+        Voxels below AUTO_WINDOW_MIN_HU are left out, so the air around
+        the patient does not dominate.
+
+        Parameters:
+        -----------
+        percentiles : sequence of float
+            Percentiles in [0, 100]
+        view : str, optional
+            'axial', 'sagittal' or 'coronal', to use one slice
+        slice_idx : int, optional
+            The slice index along the view
+
+        Returns:
+        --------
+        list of float or None
+            The HU at each percentile, to the bin centre, or None if no
+            voxel is above the floor
+        """
+        import numpy as np
+        counts = self.total if view is None else self.counts[view][slice_idx]
+        floor = max(0, (AUTO_WINDOW_MIN_HU - HISTOGRAM_RANGE[0]) // HISTOGRAM_BIN_HU)
+        cumulative = np.cumsum(counts[floor:], dtype=np.int64)
+        if not cumulative.size or not cumulative[-1]:
+            return None
+        ranks = np.asarray(percentiles, dtype=np.float64) / 100 * cumulative[-1]
+        bins = np.searchsorted(cumulative, np.maximum(ranks, 1)) + floor
+        return [HISTOGRAM_RANGE[0] + (int(b) + 0.5) * HISTOGRAM_BIN_HU for b in bins]
+
+    def window(self, view=None, slice_idx=None):
+        """
+        Window spanning the auto-window percentiles of the volume, or of one slice
+
+        Returns:
+        --------
+        tuple or None
+            (center, width) in whole HU, or None if the volume or slice
+            is empty
+        """
+        bounds = self.percentiles(view=view, slice_idx=slice_idx)
+        if bounds is None:
+            return None
+        low, high = bounds[0], bounds[-1]
+        return round((low + high) / 2), max(round(high - low), HISTOGRAM_BIN_HU)
+
+def _bin_index(hu):
+    """Histogram bin of every voxel, with out-of-range values clipped into the end bins"""
+    import numpy as np
+    nbins = (HISTOGRAM_RANGE[1] - HISTOGRAM_RANGE[0]) // HISTOGRAM_BIN_HU
+    if hu.dtype.kind in "iu":
+        bins = np.subtract(hu, HISTOGRAM_RANGE[0], dtype=np.int32)
+        bins //= HISTOGRAM_BIN_HU
+    else:
+        bins = np.subtract(hu, HISTOGRAM_RANGE[0], dtype=np.float32)
+        bins /= HISTOGRAM_BIN_HU
+        bins = np.nan_to_num(np.floor(bins, out=bins), nan=0).astype(np.int32)
+    return np.clip(bins, 0, nbins - 1, out=bins)
+
+@timed("histogram.compute")
+def compute_histogram(volume):
+    """
+    Count the HU histogram of every slice of a volume in one pass
+
+    The volume is read one slab of axial slices at a time; each slab adds
+    to the histograms of its own axial slices and of every sagittal and
+    coronal slice it crosses.
+
+    Parameters:
+    -----------
+    volume : array-like
+        The scan in HU, shaped (x, y, z)
+
+    Returns:
+    --------
+    VolumeHistogram
+        The histograms
+    """
+    import numpy as np
+    nx, ny, nz = volume.shape
+    nbins = (HISTOGRAM_RANGE[1] - HISTOGRAM_RANGE[0]) // HISTOGRAM_BIN_HU
+    counts = {"sagittal": np.zeros((nx, nbins), dtype=np.int32),
+              "coronal": np.zeros((ny, nbins), dtype=np.int32),
+              "axial": np.zeros((nz, nbins), dtype=np.int32)}
+
+    for z0 in range(0, nz, HISTOGRAM_SLAB):
+        bins = _bin_index(np.asarray(volume[:, :, z0:z0 + HISTOGRAM_SLAB]))
+        dz = bins.shape[2]
+        # Offsetting each slice's bins by slice * nbins counts every slice in one bincount
+        for view, n in (("sagittal", nx), ("coronal", ny), ("axial", dz)):
+            shape = [1, 1, 1]
+            shape[VIEW_AXES[view]] = n
+            offsets = (np.arange(n, dtype=np.int32) * nbins).reshape(shape)
+            slab_counts = np.bincount((bins + offsets).ravel(), minlength=n * nbins).reshape(n, nbins)
+            if view == "axial":
+                counts[view][z0:z0 + dz] = slab_counts
+            else:
+                counts[view] += slab_counts
+
+    return VolumeHistogram(counts)
+
+def _known(volume):
+    with _lock:
+        entry = _histograms.get(id(volume))
+    if entry is not None and entry[0]() is volume:
+        return entry[1]
+    return None
+
+def _build(volume):
+    try:
+        histogram = compute_histogram(volume)
+        with _lock:
+            for volume_id, (ref, _) in list(_histograms.items()):
+                if ref() is None:
+                    del _histograms[volume_id]
+            _histograms[id(volume)] = (weakref.ref(volume), histogram)
+        return histogram
+    except Exception as e:
+        logger.error(f"Error computing HU histogram: {str(e)}")
+        return None
+    finally:
+        with _lock:
+            _pending.pop(id(volume), None)
+
+def schedule_histogram(volume):
+    """
+    Queue the histograms of a volume for counting in the background
+
+    Returns:
+    --------
+    concurrent.futures.Future
+        Resolves to the VolumeHistogram, or None if it could not be
+        counted; already counted volumes get a finished future, and
+        repeated calls for the same volume share one job
+    """
+    histogram = _known(volume)
+    if histogram is not None:
+        future = Future()
+        future.set_result(histogram)
+        return future
+    with _lock:
+        future = _pending.get(id(volume))
+        if future is None:
+            future = _executor.submit(_build, volume)
+            _pending[id(volume)] = future
+        return future
+
+def share_histogram(volume, copy):
+    """
+    Let a copy of a volume with the same voxels reuse its histograms, if counted
+
+    Returns:
+    --------
+    bool
+        True if the histograms were known and are now shared
+    """
+    histogram = _known(volume)
+    if histogram is None:
+        return False
+    with _lock:
+        _histograms[id(copy)] = (weakref.ref(copy), histogram)
+    return True
+
+def histogram_for(volume, wait=False):
+    """
+    Return the histograms of a volume, scheduling them if not counted yet
+
+    Parameters:
+    -----------
+    volume : array-like
+        The scan in HU, shaped (x, y, z)
+    wait : bool
+        Block until the histograms are counted instead of returning None
+
+    Returns:
+    --------
+    VolumeHistogram or None
+        The histograms, or None while they are being counted or if
+        counting failed
+    """
+    histogram = _known(volume)
+    if histogram is not None:
+        return histogram
+    future = schedule_histogram(volume)
+    return future.result() if wait else None
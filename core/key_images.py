@@ -0,0 +1,142 @@
+import base64
+import io
+import logging
+from dataclasses import dataclass, asdict
+from config import KEY_IMAGE_THUMBNAIL_SIZE, KEY_IMAGE_THUMBNAIL_QUALITY, KEY_IMAGE_CACHE_MAX_BYTES
+from utils.shared_cache import SharedCache
+
+logger = logging.getLogger(__name__)
+
+# Compressed thumbnails by key image reference, shared across sessions and workers
+thumbnail_cache = SharedCache("thumbnails", max_bytes=KEY_IMAGE_CACHE_MAX_BYTES)
+
+@dataclass(frozen=True)
+class KeyImage:
+    """
+    Reference to a displayed slice attached to a report
+
+    Only the coordinates needed to reproduce the image are stored; pixels
+    live in the thumbnail cache and can be regenerated from the scan.
+    """
+    scan_id: str
+    view: str
+    slice_idx: int
+    window_center: float
+    window_width: float
+
+    @property
+    def ref(self):
+        """Compact string form, e.g. 'abc123/axial/150@100,700'"""
+        return f"{self.scan_id}/{self.view}/{self.slice_idx}@{self.window_center:g},{self.window_width:g}"
+
+    @property
+    def caption(self):
+        return (f"{self.view.capitalize()} slice {self.slice_idx} "
+                f"(W {self.window_width:g} / L {self.window_center:g})")
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a key image reference from a dict, ignoring unknown keys"""
+        return cls(**{key: data[key] for key in cls.__dataclass_fields__ if key in data})
+
+def decode_slice_image(image):
+    """
+    Decode the image of a slice from core.slice_source
+
+    Parameters:
+    -----------
+    image : bytes, str or numpy.ndarray
+        Encoded PNG/WebP bytes, a data URL, or a pixel array
+
+    Returns:
+    --------
+    numpy.ndarray or None
+        The pixels, or None for image forms that cannot be decoded locally
+    """
+    import numpy as np
+    if isinstance(image, np.ndarray):
+        return image
+    if isinstance(image, str):
+        if not image.startswith("data:image"):
+            return None
+        image = base64.b64decode(image.split(",", 1)[1])
+    from PIL import Image
+    return np.asarray(Image.open(io.BytesIO(image)))
+
+def make_thumbnail(image):
+    """
+    Downscale and compress a slice image
+
+    Parameters:
+    -----------
+    image : bytes, str or numpy.ndarray
+        Any form accepted by decode_slice_image
+
+    Returns:
+    --------
+    bytes or None
+        WebP bytes at most KEY_IMAGE_THUMBNAIL_SIZE pixels on a side
+    """
+    import numpy as np
+    from PIL import Image
+    pixels = decode_slice_image(image)
+    if pixels is None:
+        return None
+    if pixels.dtype != np.uint8:
+        pixels = np.clip(pixels, 0, 255).astype(np.uint8)
+    thumb = Image.fromarray(pixels)
+    thumb.thumbnail((KEY_IMAGE_THUMBNAIL_SIZE, KEY_IMAGE_THUMBNAIL_SIZE))
+    buffer = io.BytesIO()
+    thumb.save(buffer, format="WEBP", quality=KEY_IMAGE_THUMBNAIL_QUALITY)
+    return buffer.getvalue()
+
+def cache_thumbnail(key_image, image):
+    """
+    Cache the thumbnail of a key image from the slice as displayed
+
+    Called when the key image is captured, so the report never has to
+    fetch the slice again.
+
+    Parameters:
+    -----------
+    key_image : KeyImage
+        The reference the thumbnail is cached under
+    image : bytes, str or numpy.ndarray
+        Any form accepted by decode_slice_image
+    """
+    thumbnail = make_thumbnail(image)
+    if thumbnail is not None:
+        thumbnail_cache.put(key_image.ref, thumbnail)
+
+def key_image_thumbnail(key_image):
+    """
+    Return the compressed thumbnail of a key image, building it on demand
+
+    Thumbnails evicted from the cache are regenerated from the scan's
+    slice source, which usually serves the slice from its cache.
+
+    Returns:
+    --------
+    bytes or None
+        WebP bytes, or None if the slice is no longer available
+    """
+    thumbnail = thumbnail_cache.get(key_image.ref)
+    if thumbnail is not None:
+        return thumbnail
+
+    from core.slice_source import slice_source_for
+    slice_data = slice_source_for(key_image.scan_id).get_slice(key_image.view, key_image.slice_idx,
+                                                               key_image.window_center, key_image.window_width)
+    if not slice_data or "image" not in slice_data:
+        return None
+    try:
+        thumbnail = make_thumbnail(slice_data["image"])
+    except Exception as e:
+        logger.error(f"Could not build thumbnail for {key_image.ref}: {str(e)}")
+        return None
+    if thumbnail is not None:
+        thumbnail_cache.put(key_image.ref, thumbnail)
+    return thumbnail
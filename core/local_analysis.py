@@ -0,0 +1,297 @@
+import logging
+import math
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from config import (
+    LOCAL_ANALYSIS_BUDGET_S, LOCAL_ANALYSIS_WORKERS, LOCAL_ANALYSIS_MAX_SIDE, LOCAL_ANALYSIS_SLAB,
+    LOCAL_ANALYSIS_CLOT_HU, LOCAL_ANALYSIS_MIN_VOXELS, LUNG_HU, VESSEL_HU, BONE_HU
+)
+from core.findings import Findings, CLOT_BURDEN_LEVELS, FINDINGS_SOURCE_LOCAL
+from utils.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Candidates must lie within reach of the lungs, which keeps the marrow
+# inside vertebrae and ribs out
+LUNG_MARGIN = 12  # Voxels at the analysis resolution
+
+# Extra time the caller waits past the worker's own budget
+_GRACE_S = 5.0
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Waits on the analysis process off the Streamlit script thread
+_runner = ThreadPoolExecutor(max_workers=LOCAL_ANALYSIS_WORKERS, thread_name_prefix="local-analysis")
+
+@dataclass(frozen=True)
+class LocalAnalysis:
+    """
+    Result of the local PE-candidate detector
+
+    Attributes:
+    -----------
+    findings : Findings
+        Structured findings for the report; pe_present is None when the
+        budget ran out before any candidate was found
+    candidates : tuple of dict
+        Filling-defect candidates, most proximal first, with their centroid
+        (x, y, z in original voxel coordinates), size in voxels, mean HU,
+        slice range and clot burden grade
+    completed : bool
+        Whether every slice was analyzed within the budget
+    slices_analyzed : int
+        Axial slices analyzed
+    slices_total : int
+        Axial slices in the volume
+    elapsed_s : float
+        Time spent in the detector
+    """
+    findings: Findings
+    candidates: tuple = field(default_factory=tuple)
+    completed: bool = True
+    slices_analyzed: int = 0
+    slices_total: int = 0
+    elapsed_s: float = 0.0
+
+def prepare_volume(volume, max_side=LOCAL_ANALYSIS_MAX_SIDE):
+    """
+    Downsample a volume in-plane to int16 HU for the detector
+
+    Parameters:
+    -----------
+    volume : array-like
+        The scan in HU, shaped (x, y, z)
+    max_side : int
+        Longest in-plane side after downsampling
+
+    Returns:
+    --------
+    tuple
+        (int16 volume, in-plane step) where step maps analysis voxels back
+        to the original grid
+    """
+    import numpy as np
+    step = max(1, math.ceil(max(volume.shape[0], volume.shape[1]) / max_side))
+    work = np.asarray(volume[::step, ::step, :])
+    if work.dtype != np.int16:
+        work = np.clip(np.rint(work), -32768, 32767).astype(np.int16)
+    return np.ascontiguousarray(work), step
+
+def _slab_order(nz, slab):
+    """Slab start indices from the middle of the volume outwards, where the central arteries are"""
+    starts = list(range(0, nz, slab))
+    middle = nz / 2
+    return sorted(starts, key=lambda start: abs(start + slab / 2 - middle))
+
+def _grade(distance, crosses_midline):
+    """Clot burden grade from a candidate's distance to the mediastinum, as a fraction of the body half-width"""
+    if crosses_midline and distance < 0.12:
+        return "saddle"
+    if distance < 0.2:
+        return "central"
+    if distance < 0.4:
+        return "lobar"
+    if distance < 0.65:
+        return "segmental"
+    return "subsegmental"
+
+def _location(candidate):
+    """Describe where a candidate is, in the words the report uses"""
+    burden = candidate["clot_burden"]
+    if burden == "saddle":
+        return "main pulmonary artery bifurcation"
+    if burden == "central":
+        return f"{candidate['side']} main pulmonary artery"
+    if burden == "lobar":
+        return f"{candidate['side']} {candidate['lobe']} lobe pulmonary artery"
+    return f"{burden} {candidate['side']} {candidate['lobe']} lobe pulmonary arteries"
+
+def detect_pe_candidates(work, step=1, budget_s=LOCAL_ANALYSIS_BUDGET_S):
+    """
+    Find filling defects in contrast-enhanced pulmonary arteries
+
+    Contrast-filled lumen is thresholded per slab of axial slices and closed
+    in-plane; low-attenuation voxels that the closed lumen surrounds but the
+    lumen itself does not contain are filling-defect voxels. These are
+    grouped into 3D connected components, and components that are too small,
+    not mostly bordered by lumen, touching bone, or away from the lungs are
+    discarded. Slabs are processed from the middle of the volume outwards
+    and the budget is checked between slabs, so a cut-off run has still
+    covered the central arteries.
+
+    The first axis is taken to run from patient right to left and the last
+    from inferior to superior, as in DICOM series. Right heart strain is not
+    assessed.
+
+    Parameters:
+    -----------
+    work : numpy.ndarray
+        int16 HU volume shaped (x, y, z), as returned by prepare_volume
+    step : int
+        In-plane downsampling step, to report candidates in original voxels
+    budget_s : float
+        Time after which no further slabs are started
+
+    Returns:
+    --------
+    LocalAnalysis
+        The findings and candidates
+    """
+    import numpy as np
+    from scipy import ndimage
+
+    start = time.perf_counter()
+    nx, ny, nz = work.shape
+    vessel = np.zeros(work.shape, dtype=bool)
+    defect = np.zeros(work.shape, dtype=bool)
+    bone = np.zeros(work.shape, dtype=bool)
+
+    # In-plane connectivity only, so the slab is processed as a stack of 2D slices
+    in_plane = np.zeros((3, 3, 3), dtype=bool)
+    in_plane[:, :, 1] = ndimage.generate_binary_structure(2, 1)
+    # A square neighbourhood is separable, so the margin costs two 1D passes
+    margin = (2 * LUNG_MARGIN + 1, 2 * LUNG_MARGIN + 1, 1)
+
+    analyzed = 0
+    for z0 in _slab_order(nz, LOCAL_ANALYSIS_SLAB):
+        if time.perf_counter() - start > budget_s:
+            break
+        hu = work[:, :, z0:z0 + LOCAL_ANALYSIS_SLAB]
+        lumen = (hu >= VESSEL_HU[0]) & (hu <= VESSEL_HU[1])
+        closed = ndimage.binary_closing(lumen, structure=in_plane, iterations=2)
+        enclosed = ndimage.binary_fill_holes(closed, structure=in_plane)
+        lungs = ndimage.maximum_filter((hu >= LUNG_HU[0]) & (hu <= LUNG_HU[1]), size=margin)
+        vessel[:, :, z0:z0 + LOCAL_ANALYSIS_SLAB] = lumen
+        bone[:, :, z0:z0 + LOCAL_ANALYSIS_SLAB] = hu > BONE_HU
+        defect[:, :, z0:z0 + LOCAL_ANALYSIS_SLAB] = (
+            enclosed & ~lumen & lungs & (hu >= LOCAL_ANALYSIS_CLOT_HU[0]) & (hu <= LOCAL_ANALYSIS_CLOT_HU[1])
+        )
+        analyzed += hu.shape[2]
+
+    # Components are measured inside the bounding box of all defect voxels only
+    extent = [np.flatnonzero(defect.any(axis=tuple(a for a in range(3) if a != axis))) for axis in range(3)]
+    candidates = []
+    count = 0
+    if extent[0].size:
+        box = tuple(slice(max(e[0] - 1, 0), e[-1] + 2) for e in extent)
+        offset = np.array([b.start for b in box])
+        defect, vessel, bone = defect[box], vessel[box], bone[box]
+        labels, count = ndimage.label(defect)
+    if count:
+        index = np.arange(1, count + 1)
+        sizes = np.bincount(labels.ravel(), minlength=count + 1)[1:]
+
+        # Border voxels of each component, attributed to it by dilating the label image
+        grown = ndimage.grey_dilation(labels, footprint=ndimage.generate_binary_structure(3, 1))
+        border = (labels == 0) & (grown > 0)
+        border_labels = grown[border]
+        border_total = np.bincount(border_labels, minlength=count + 1)[1:]
+        border_vessel = np.bincount(border_labels, weights=vessel[border], minlength=count + 1)[1:]
+        border_bone = np.bincount(border_labels, weights=bone[border], minlength=count + 1)[1:]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            vessel_share = np.where(border_total > 0, border_vessel / border_total, 0)
+            bone_share = np.where(border_total > 0, border_bone / border_total, 1)
+
+        keep = (sizes >= LOCAL_ANALYSIS_MIN_VOXELS) & (vessel_share >= 0.6) & (bone_share < 0.05)
+        if keep.any():
+            kept = index[keep]
+            centroids = ndimage.center_of_mass(defect, labels, kept)
+            mean_hu = ndimage.mean(work[box], labels, kept)
+            extents = ndimage.find_objects(labels)
+
+            # The mediastinum is taken as the middle of the body outline
+            body = np.flatnonzero((work[:, :, nz // 2] > -500).any(axis=1))
+            body_x = (body[0] + body[-1]) / 2 if body.size else nx / 2
+            half_width = max((body[-1] - body[0]) / 2 if body.size else nx / 2, 1)
+
+            for label, centroid, hu in zip(kept, centroids, mean_hu):
+                cx, cy, cz = np.asarray(centroid) + offset
+                x_range, _, z_range = extents[label - 1]
+                distance = abs(cx - body_x) / half_width
+                crosses = x_range.start + offset[0] <= body_x < x_range.stop + offset[0]
+                candidate = {
+                    "centroid": (round(float(cx) * step, 1), round(float(cy) * step, 1), round(float(cz), 1)),
+                    "voxels": int(sizes[label - 1]) * step * step,
+                    "mean_hu": round(float(hu), 1),
+                    "slices": (int(z_range.start + offset[2]), int(z_range.stop - 1 + offset[2])),
+                    "clot_burden": _grade(distance, crosses),
+                    "side": "right" if cx < body_x else "left",
+                    "lobe": "upper" if cz >= nz / 2 else "lower",
+                }
+                candidate["location"] = _location(candidate)
+                candidates.append(candidate)
+            candidates.sort(key=lambda c: (-CLOT_BURDEN_LEVELS.index(c["clot_burden"]), -c["voxels"]))
+
+    completed = analyzed >= nz
+    # Right heart strain is not assessed, so rv_strain stays None
+    if candidates:
+        findings = Findings(pe_present=True, location=candidates[0]["location"],
+                            clot_burden=candidates[0]["clot_burden"], source=FINDINGS_SOURCE_LOCAL)
+    elif completed:
+        findings = Findings(pe_present=False, source=FINDINGS_SOURCE_LOCAL)
+    else:
+        findings = Findings(source=FINDINGS_SOURCE_LOCAL)
+
+    return LocalAnalysis(findings=findings, candidates=tuple(candidates), completed=completed,
+                         slices_analyzed=analyzed, slices_total=nz, elapsed_s=time.perf_counter() - start)
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned workers do not inherit the Streamlit server's threads and locks
+            _pool = ProcessPoolExecutor(max_workers=LOCAL_ANALYSIS_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+@timed("local_analysis.run")
+def run_local_analysis(volume, budget_s=LOCAL_ANALYSIS_BUDGET_S):
+    """
+    Run the PE-candidate detector on a volume in the analysis process
+
+    The volume is downsampled here so only a compact int16 copy is sent to
+    the worker. The worker stops starting new slabs once the budget is
+    spent; the caller never waits much longer than that.
+
+    Parameters:
+    -----------
+    volume : array-like
+        The scan in HU, shaped (x, y, z)
+    budget_s : float
+        Time budget for the detector
+
+    Returns:
+    --------
+    LocalAnalysis or None
+        The result, or None if the analysis failed or overran its budget
+    """
+    try:
+        with timed("local_analysis.prepare"):
+            work, step = prepare_volume(volume)
+        future = _get_pool().submit(detect_pe_candidates, work, step, budget_s)
+        return future.result(timeout=budget_s + _GRACE_S)
+    except FutureTimeoutError:
+        logger.error(f"Local analysis did not finish within {budget_s:g} s")
+        return None
+    except Exception as e:
+        logger.error(f"Local analysis failed: {str(e)}")
+        return None
+
+def start_local_analysis(volume, budget_s=LOCAL_ANALYSIS_BUDGET_S):
+    """
+    Start run_local_analysis without blocking the caller
+
+    Downsampling, the analysis process's cold start and the wait for its
+    result all happen on a background thread, so a Streamlit rerun can
+    poll the returned future the way PDF exports are polled.
+
+    Returns:
+    --------
+    concurrent.futures.Future
+        Resolves to the LocalAnalysis, or None if it failed or overran its budget
+    """
+    return _runner.submit(run_local_analysis, volume, budget_s)
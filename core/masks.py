@@ -0,0 +1,331 @@
+import hashlib
+import logging
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    MASK_CACHE_DIR, MASK_CACHE_SIZE, MASK_WORKERS, MASK_SLAB, MASK_MIN_VESSEL_VOXELS,
+    MASK_OVERLAY_ALPHA, MASK_OVERLAY_COLORS, LUNG_HU, VESSEL_HU, BONE_HU
+)
+from utils.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+MASK_NAMES = ("lung", "vessel")
+
+# Mask computations run in the background so the viewer never waits on them
+_executor = ThreadPoolExecutor(max_workers=MASK_WORKERS, thread_name_prefix="masks")
+_pending = {}
+_lock = threading.Lock()
+
+# Open mask sets by volume hash, most recently used last
+_mask_sets = OrderedDict()
+
+# Volume hashes by id(volume), with a weak reference to detect reused ids
+_volume_keys = {}
+
+class MaskSet:
+    """
+    Bit-packed lung and vessel masks of one volume
+
+    Each mask is stored as one row of packed bits per axial slice, so an
+    axial plane is a single unpackbits call and sagittal or coronal planes
+    gather only the bytes holding their bits.
+    """
+
+    def __init__(self, shape, packed):
+        self.shape = tuple(shape)
+        self.packed = packed
+
+    @property
+    def nbytes(self):
+        return sum(packed.nbytes for packed in self.packed.values())
+
+    def plane(self, name, view, slice_idx):
+        """
+        Unpack one plane of a mask
+
+        Parameters:
+        -----------
+        name : str
+            'lung' or 'vessel'
+        view : str
+            'axial', 'sagittal' or 'coronal'
+        slice_idx : int
+            The slice index along the view
+
+        Returns:
+        --------
+        numpy.ndarray
+            Boolean plane shaped like the same slice of the volume
+        """
+        import numpy as np
+        nx, ny, nz = self.shape
+        packed = self.packed[name]
+        if view == "axial":
+            return np.unpackbits(packed[slice_idx], count=nx * ny).reshape(nx, ny).view(bool)
+        if view == "sagittal":
+            bits = slice_idx * ny + np.arange(ny)
+        else:
+            bits = np.arange(nx) * ny + slice_idx
+        gathered = packed[:, bits >> 3]
+        return (((gathered >> (7 - (bits & 7)).astype(np.uint8)) & 1).T).astype(bool)
+
+def volume_hash(volume):
+    """
+    Content hash of a volume, read one slab of axial slices at a time
+
+    Parameters:
+    -----------
+    volume : array-like
+        The scan, shaped (x, y, z)
+
+    Returns:
+    --------
+    str
+        The SHA-256 hex digest of the shape, dtype and voxels
+    """
+    import numpy as np
+    digest = hashlib.sha256()
+    first = np.asarray(volume[:, :, :1])
+    digest.update(repr((tuple(volume.shape), first.dtype.str)).encode())
+    for z0 in range(0, volume.shape[2], MASK_SLAB):
+        digest.update(np.ascontiguousarray(volume[:, :, z0:z0 + MASK_SLAB]).tobytes())
+    return digest.hexdigest()
+
+def _pack(mask):
+    """Pack a boolean (x, y, z) mask into one row of bits per axial slice"""
+    import numpy as np
+    nx, ny, nz = mask.shape
+    return np.packbits(np.moveaxis(mask, 2, 0).reshape(nz, nx * ny), axis=1)
+
+@timed("masks.compute")
+def compute_masks(volume):
+    """
+    Compute the lung and contrast-enhanced vessel masks of a volume
+
+    Lungs are aerated voxels, opened in-plane to drop noise, grouped into 3D
+    components; components touching the edge of the field of view (air
+    around the patient) and those much smaller than the largest are
+    dropped, and holes left by the vessels inside the lungs are filled.
+    Vessels are contrast-density voxels near the lungs and away from bone,
+    without components too small to be vessels.
+
+    Parameters:
+    -----------
+    volume : array-like
+        The scan in HU, shaped (x, y, z)
+
+    Returns:
+    --------
+    MaskSet
+        The packed masks
+    """
+    import numpy as np
+    from scipy import ndimage
+
+    nx, ny, nz = volume.shape
+    lung = np.zeros((nx, ny, nz), dtype=bool)
+    vessel = np.zeros((nx, ny, nz), dtype=bool)
+    bone = np.zeros((nx, ny, nz), dtype=bool)
+    in_plane = np.zeros((3, 3, 3), dtype=bool)
+    in_plane[:, :, 1] = ndimage.generate_binary_structure(2, 1)
+
+    for z0 in range(0, nz, MASK_SLAB):
+        hu = np.asarray(volume[:, :, z0:z0 + MASK_SLAB])
+        aerated = (hu >= LUNG_HU[0]) & (hu <= LUNG_HU[1])
+        lung[:, :, z0:z0 + MASK_SLAB] = ndimage.binary_opening(aerated, structure=in_plane)
+        vessel[:, :, z0:z0 + MASK_SLAB] = (hu >= VESSEL_HU[0]) & (hu <= VESSEL_HU[1])
+        bone[:, :, z0:z0 + MASK_SLAB] = hu > BONE_HU
+
+    labels, count = ndimage.label(lung)
+    if count:
+        sizes = np.bincount(labels.ravel(), minlength=count + 1)
+        sizes[0] = 0
+        edge = np.unique(np.concatenate([labels[0].ravel(), labels[-1].ravel(),
+                                         labels[:, 0].ravel(), labels[:, -1].ravel()]))
+        sizes[edge] = 0
+        keep = sizes >= max(sizes.max() * 0.1, 1)
+        keep[0] = False
+        lung = keep[labels]
+        lung = ndimage.binary_fill_holes(lung, structure=in_plane)
+    del labels
+
+    # Pulmonary vessels run inside the lungs and through the hila between them.
+    # The margin is generous, so it is checked on a coarse grid and only at
+    # vessel voxels.
+    vessel &= ~ndimage.maximum_filter(bone, size=(7, 7, 1))
+    step = 4
+    margin = max(1, nx // (20 * step))
+    near_lungs = ndimage.maximum_filter(lung[::step, ::step], size=(2 * margin + 1, 2 * margin + 1, 1))
+    vx, vy, vz = np.nonzero(vessel)
+    far = ~near_lungs[vx // step, vy // step, vz]
+    vessel[vx[far], vy[far], vz[far]] = False
+    del near_lungs, vx, vy, vz, far
+    labels, count = ndimage.label(vessel)
+    if count:
+        sizes = np.bincount(labels.ravel(), minlength=count + 1)
+        keep = sizes >= MASK_MIN_VESSEL_VOXELS
+        keep[0] = False
+        vessel = keep[labels]
+
+    return MaskSet((nx, ny, nz), {"lung": _pack(lung), "vessel": _pack(vessel)})
+
+def _mask_path(key, name):
+    return os.path.join(MASK_CACHE_DIR, f"{key}.{name}.npy")
+
+def _load(key, shape):
+    """Memory-map a mask set from the disk cache, or None on a miss"""
+    import numpy as np
+    try:
+        packed = {name: np.load(_mask_path(key, name), mmap_mode="r") for name in MASK_NAMES}
+    except (FileNotFoundError, ValueError):
+        return None
+    return MaskSet(shape, packed)
+
+def _save(key, mask_set):
+    """Write a mask set to the disk cache atomically"""
+    import numpy as np
+    for name in MASK_NAMES:
+        dest = _mask_path(key, name)
+        tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                np.save(f, np.asarray(mask_set.packed[name]))
+            os.replace(tmp, dest)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+def _remember(key, mask_set):
+    with _lock:
+        _mask_sets[key] = mask_set
+        _mask_sets.move_to_end(key)
+        while len(_mask_sets) > MASK_CACHE_SIZE:
+            _mask_sets.popitem(last=False)
+
+def _known_key(volume):
+    with _lock:
+        entry = _volume_keys.get(id(volume))
+    if entry is not None and entry[0]() is volume:
+        return entry[1]
+    return None
+
+def _build(volume):
+    """Hash a volume, then load its masks from disk or compute and store them"""
+    try:
+        key = volume_hash(volume)
+        mask_set = _load(key, volume.shape)
+        if mask_set is None:
+            mask_set = compute_masks(volume)
+            _save(key, mask_set)
+            logger.info(f"Cached lung/vessel masks {key[:12]} ({mask_set.nbytes / 1024 ** 2:.1f} MB)")
+        _remember(key, mask_set)
+        with _lock:
+            for volume_id, (ref, _) in list(_volume_keys.items()):
+                if ref() is None:
+                    del _volume_keys[volume_id]
+            _volume_keys[id(volume)] = (weakref.ref(volume), key)
+        return mask_set
+    except Exception as e:
+        logger.error(f"Error computing lung/vessel masks: {str(e)}")
+        return None
+    finally:
+        with _lock:
+            _pending.pop(id(volume), None)
+
+def schedule_masks(volume):
+    """
+    Queue the masks of a volume for computation in the background
+
+    Returns:
+    --------
+    concurrent.futures.Future
+        Resolves to the MaskSet, or None if it could not be computed;
+        repeated calls for the same volume share one job
+    """
+    with _lock:
+        future = _pending.get(id(volume))
+        if future is None:
+            future = _executor.submit(_build, volume)
+            _pending[id(volume)] = future
+        return future
+
+def share_masks(volume, copy):
+    """
+    Let a copy of a volume with the same voxels reuse its masks, if computed
+
+    Returns:
+    --------
+    bool
+        True if the masks were known and are now shared
+    """
+    key = _known_key(volume)
+    if key is None:
+        return False
+    with _lock:
+        _volume_keys[id(copy)] = (weakref.ref(copy), key)
+    return True
+
+def masks_for(volume):
+    """
+    Return the masks of a volume if they are ready, scheduling them if not
+
+    Parameters:
+    -----------
+    volume : array-like
+        The scan in HU, shaped (x, y, z)
+
+    Returns:
+    --------
+    MaskSet or None
+        The masks, or None while they are being computed
+    """
+    key = _known_key(volume)
+    if key is None:
+        schedule_masks(volume)
+        return None
+    with _lock:
+        mask_set = _mask_sets.get(key)
+        if mask_set is not None:
+            _mask_sets.move_to_end(key)
+            return mask_set
+    mask_set = _load(key, volume.shape)
+    if mask_set is None:
+        schedule_masks(volume)
+        return None
+    _remember(key, mask_set)
+    return mask_set
+
+@timed("render.mask_overlay")
+def overlay_masks(image, mask_set, view, slice_idx, names=MASK_NAMES):
+    """
+    Tint a windowed slice with its lung and vessel masks
+
+    Parameters:
+    -----------
+    image : numpy.ndarray
+        The windowed uint8 slice as displayed, i.e. the transposed plane
+    mask_set : MaskSet
+        The volume's masks
+    view : str
+        'axial', 'sagittal' or 'coronal'
+    slice_idx : int
+        The slice index along the view
+    names : sequence of str
+        The masks to draw, later ones on top
+
+    Returns:
+    --------
+    numpy.ndarray
+        An RGB uint8 image
+    """
+    import numpy as np
+    rgb = np.repeat(image[:, :, None], 3, axis=2)
+    for name in names:
+        plane = mask_set.plane(name, view, slice_idx).T
+        color = np.array(MASK_OVERLAY_COLORS[name], dtype=np.float32)
+        rgb[plane] = (rgb[plane] * (1 - MASK_OVERLAY_ALPHA) + color * MASK_OVERLAY_ALPHA).astype(np.uint8)
+    return rgb
@@ -0,0 +1,342 @@
+import hashlib
+import io
+import logging
+import multiprocessing
+import textwrap
+import threading
+import zipfile
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from html.parser import HTMLParser
+from config import PDF_EXPORT_WORKERS, PDF_PAGE_SIZE, PDF_MARGIN_INCHES
+from core.key_images import decode_slice_image
+from utils.shared_cache import SharedCache
+
+logger = logging.getLogger(__name__)
+
+# Rendered PDFs by content hash, shared by every session and worker on the host
+pdf_cache = SharedCache("pdf")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Text styles per block kind: font size (pt), weight, space before (pt)
+_STYLES = {
+    "title": (16, "bold", 0),
+    "subtitle": (10, "normal", 2),
+    "heading": (11.5, "bold", 12),
+    "paragraph": (10, "normal", 3),
+    "bullet": (10, "normal", 1),
+}
+_COLORS = {"pe-finding": "#c0392b", "normal-finding": "#27ae60", "report-subtitle": "#7f8c8d",
+           "report-footer": "#7f8c8d"}
+# Elements without an end tag, which must not open a class scope
+_VOID_TAGS = frozenset(("area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source",
+                        "track", "wbr"))
+
+class _ReportParser(HTMLParser):
+    """Flatten report HTML into (kind, text, color, bold) blocks"""
+
+    def __init__(self):
+        super().__init__()
+        self.blocks = []
+        self._text = []
+        self._kind = "paragraph"
+        self._classes = []
+        self._skip = 0
+        self._bold = 0
+
+    def _flush(self):
+        text = " ".join("".join(self._text).split())
+        if text:
+            default = "#2c3e50" if self._kind in ("title", "heading") else "#222222"
+            color = next((_COLORS[name] for classes in reversed(self._classes)
+                          for name in classes.split() if name in _COLORS), default)
+            self.blocks.append((self._kind, text, color, self._bold > 0))
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("style", "script"):
+            self._skip += 1
+            return
+        if tag not in _VOID_TAGS:
+            self._classes.append(dict(attrs).get("class") or "")
+        if tag in ("h1", "h2", "h3", "h4", "h5", "p", "li", "div", "ul", "br", "hr"):
+            self._flush()
+        if tag in ("h1", "h2", "h3"):
+            self._kind = "title"
+        elif tag in ("h4", "h5"):
+            self._kind = "heading"
+        elif tag == "li":
+            self._kind = "bullet"
+        elif tag == "p":
+            self._kind = "subtitle" if "report-subtitle" in self._classes[-1] else "paragraph"
+        elif tag in ("strong", "b"):
+            self._bold += 1
+
+    def handle_endtag(self, tag):
+        if tag in ("style", "script"):
+            self._skip = max(0, self._skip - 1)
+            return
+        if tag in ("h1", "h2", "h3", "h4", "h5", "p", "li", "div", "ul"):
+            self._flush()
+            if tag in ("h1", "h2", "h3", "h4", "h5", "li"):
+                self._kind = "paragraph"
+        elif tag in ("strong", "b"):
+            self._bold = max(0, self._bold - 1)
+        if self._classes and tag not in _VOID_TAGS:
+            self._classes.pop()
+
+    def handle_data(self, data):
+        if not self._skip:
+            self._text.append(data)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+def report_blocks(report_html):
+    """
+    Split report HTML into text blocks for layout
+
+    Parameters:
+    -----------
+    report_html : str
+        The report HTML
+
+    Returns:
+    --------
+    list of tuple
+        (kind, text, color, bold) per block, kind being one of 'title',
+        'subtitle', 'heading', 'paragraph' or 'bullet'
+    """
+    parser = _ReportParser()
+    parser.feed(report_html)
+    parser.close()
+    return parser.blocks
+
+def render_report_pdf(report_html, images=()):
+    """
+    Render a report, followed by its key images, as a PDF
+
+    Runs in the export worker processes, so it only uses the object-oriented
+    matplotlib API and never touches pyplot state.
+
+    Parameters:
+    -----------
+    report_html : str
+        The report HTML
+    images : sequence of (str, image)
+        Captions and slice images (encoded PNG/WebP bytes, data URLs or
+        uint8 arrays) to embed after the report text
+
+    Returns:
+    --------
+    bytes
+        The PDF document
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    page_w, page_h = PDF_PAGE_SIZE
+    margin = PDF_MARGIN_INCHES
+    buffer = io.BytesIO()
+
+    with PdfPages(buffer, metadata={"Title": "CT Pulmonary Angiography Report"}) as pdf:
+        state = {"figure": None, "y": 0.0}
+
+        def new_page():
+            if state["figure"] is not None:
+                pdf.savefig(state["figure"])
+            state["figure"] = Figure(figsize=PDF_PAGE_SIZE)
+            state["y"] = page_h - margin
+
+        def reserve(height):
+            if state["figure"] is None or state["y"] - height < margin:
+                new_page()
+            top = state["y"]
+            state["y"] -= height
+            return top
+
+        for kind, text, color, bold in report_blocks(report_html):
+            size, weight, space_before = _STYLES[kind]
+            indent = 0.25 if kind == "bullet" else 0.0
+            # Average glyph width is roughly half the font size
+            width_chars = max(20, int((page_w - 2 * margin - indent) * 72 / (size * 0.52)))
+            lines = textwrap.wrap(text, width_chars) or [""]
+            line_height = size * 1.45 / 72
+            top = reserve(space_before / 72 + line_height * len(lines)) - space_before / 72
+            align = "center" if kind in ("title", "subtitle") else "left"
+            x = 0.5 if align == "center" else (margin + indent) / page_w
+            for i, line in enumerate(lines):
+                if kind == "bullet" and i == 0:
+                    line = "•  " + line
+                state["figure"].text(x, (top - i * line_height) / page_h, line, ha=align, va="top",
+                                     fontsize=size, color=color, fontweight="bold" if bold else weight)
+
+        arrays = [(caption, decode_slice_image(image)) for caption, image in images]
+        arrays = [(caption, array) for caption, array in arrays if array is not None]
+        if arrays:
+            size, _, space_before = _STYLES["heading"]
+            heading_height = (space_before + size * 1.45) / 72
+            cell_w = (page_w - 2 * margin - 0.3) / 2
+            # Keep the heading on the same page as the first row of images
+            if state["figure"] is None or state["y"] - heading_height - (cell_w + 0.35) < margin:
+                new_page()
+            top = reserve(heading_height) - space_before / 72
+            state["figure"].text(margin / page_w, top / page_h, "KEY IMAGES:", va="top",
+                                 fontsize=size, fontweight="bold", color="#2c3e50")
+            for row in range(0, len(arrays), 2):
+                top = reserve(cell_w + 0.35)
+                for col, (caption, array) in enumerate(arrays[row:row + 2]):
+                    left = margin + col * (cell_w + 0.3)
+                    ax = state["figure"].add_axes([left / page_w, (top - cell_w) / page_h,
+                                                   cell_w / page_w, cell_w / page_h])
+                    ax.imshow(array, cmap="gray" if array.ndim == 2 else None)
+                    ax.set_axis_off()
+                    state["figure"].text((left + cell_w / 2) / page_w, (top - cell_w - 0.08) / page_h, caption,
+                                         ha="center", va="top", fontsize=8.5, color="#7f8c8d")
+
+        if state["figure"] is None:
+            new_page()
+        pdf.savefig(state["figure"])
+
+    return buffer.getvalue()
+
+def report_pdf_key(report_html, images=()):
+    """Content hash identifying the PDF of a report and its key images"""
+    import numpy as np
+    digest = hashlib.sha256(report_html.encode("utf-8"))
+    for caption, image in images:
+        digest.update(b"\0" + caption.encode("utf-8") + b"\0")
+        if isinstance(image, np.ndarray):
+            digest.update(repr((image.shape, image.dtype.str)).encode())
+            digest.update(np.ascontiguousarray(image).tobytes())
+        elif isinstance(image, str):
+            digest.update(image.encode("utf-8"))
+        else:
+            digest.update(bytes(image))
+    return digest.hexdigest()
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned workers do not inherit the Streamlit server's threads and locks
+            _pool = ProcessPoolExecutor(max_workers=PDF_EXPORT_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def _store(key):
+    def callback(future):
+        if future.exception() is None:
+            pdf_cache.put(key, future.result())
+        else:
+            logger.error(f"PDF export failed: {future.exception()}")
+    return callback
+
+def export_report_pdf(report_html, images=()):
+    """
+    Start exporting a report to PDF without blocking the caller
+
+    Parameters:
+    -----------
+    report_html : str
+        The report HTML
+    images : sequence of (str, image)
+        Captions and key slice images to embed
+
+    Returns:
+    --------
+    concurrent.futures.Future
+        Resolves to the PDF bytes; already resolved when the same report
+        and images were exported before
+    """
+    key = report_pdf_key(report_html, images)
+    cached = pdf_cache.get(key)
+    if cached is not None:
+        future = Future()
+        future.set_result(cached)
+        return future
+
+    future = _get_pool().submit(render_report_pdf, report_html, list(images))
+    future.add_done_callback(_store(key))
+    return future
+
+def export_reports_bulk(reports, max_parallel=PDF_EXPORT_WORKERS):
+    """
+    Export many reports to PDF concurrently
+
+    At most max_parallel renders are in flight at once, so memory stays
+    bounded however many reports are queued. Cached reports cost nothing.
+
+    Parameters:
+    -----------
+    reports : dict
+        Scan ID to (report_html, images)
+    max_parallel : int
+        Maximum number of reports rendering at the same time
+
+    Returns:
+    --------
+    dict
+        Scan ID to PDF bytes; reports that failed to render are omitted
+    """
+    pending = iter(reports.items())
+    in_flight = {}
+    results = {}
+
+    def submit_next():
+        for scan_id, (report_html, images) in pending:
+            in_flight[export_report_pdf(report_html, images)] = scan_id
+            return True
+        return False
+
+    for _ in range(max(1, max_parallel)):
+        if not submit_next():
+            break
+
+    while in_flight:
+        done = next(as_completed(in_flight))
+        scan_id = in_flight.pop(done)
+        try:
+            results[scan_id] = done.result()
+        except Exception as e:
+            logger.error(f"PDF export failed for scan {scan_id}: {str(e)}")
+        submit_next()
+
+    return results
+
+# Runs bulk exports off the Streamlit script thread
+_bulk_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-bulk")
+
+def export_reports_archive(reports, max_parallel=PDF_EXPORT_WORKERS):
+    """
+    Export many reports to PDF and pack them into one ZIP archive
+
+    Parameters:
+    -----------
+    reports : dict
+        Scan ID to (report_html, images)
+    max_parallel : int
+        Maximum number of reports rendering at the same time
+
+    Returns:
+    --------
+    bytes
+        The archive, one ctpa_report_<scan_id>.pdf per exported report
+    """
+    archive = io.BytesIO()
+    # PDFs are already compressed, so they are stored as they are
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_STORED) as zf:
+        for scan_id, pdf in export_reports_bulk(reports, max_parallel).items():
+            zf.writestr(f"ctpa_report_{scan_id}.pdf", pdf)
+    return archive.getvalue()
+
+def start_bulk_export(reports, max_parallel=PDF_EXPORT_WORKERS):
+    """
+    Run export_reports_archive in the background and return its Future
+
+    The archive is built once, when the export finishes, so the Future's
+    result can be offered for download on every rerun at no cost.
+    """
+    return _bulk_executor.submit(export_reports_archive, reports, max_parallel)
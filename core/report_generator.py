@@ -1,229 +1,470 @@
-import time
 from datetime import datetime
+from functools import lru_cache
+from html import escape
+from string import Template
+from core.findings import Findings, DEMO_PE_FINDINGS
 
-def generate_ctpa_report(scan_data):
+# Shared by every report variant; emitted once per report as part of the chrome
+REPORT_CSS = """
+<style>
+    .report-container {
+        font-family: 'Arial', sans-serif;
+        max-width: 800px;
+        margin: 20px auto;
+        padding: 25px;
+        border: 1px solid #ccc;
+        border-radius: 8px;
+        box-shadow: 0 2px 5px rgba(0,0,0,0.1);
+        background-color: #fff;
+    }
+
+    .report-header {
+        text-align: center;
+        padding-bottom: 15px;
+        border-bottom: 2px solid #2c3e50;
+    }
+
+    .report-title {
+        color: #2c3e50;
+        margin: 0;
+        font-size: 22px;
+        font-weight: 700;
+    }
+
+    .report-subtitle {
+        color: #7f8c8d;
+        font-style: italic;
+    }
+
+    .logo-container {
+        text-align: center;
+        margin-bottom: 15px;
+    }
+
+    .report-section {
+        margin: 15px 0;
+        padding-bottom: 10px;
+    }
+
+    .report-section h4 {
+        color: #2c3e50;
+        margin: 0 0 8px 0;
+        font-size: 16px;
+        font-weight: 600;
+        border-bottom: 1px solid #eee;
+        padding-bottom: 5px;
+    }
+
+    .report-section p, .report-section li {
+        margin: 5px 0;
+        line-height: 1.5;
+        color: #333;
+        font-size: 14px;
+    }
+
+    .report-section ul {
+        padding-left: 20px;
+    }
+
+    .pe-finding {
+        color: #c0392b;
+        font-weight: 600;
+    }
+
+    .normal-finding {
+        color: #27ae60;
+        font-weight: 600;
+    }
+
+    .report-footer {
+        margin-top: 20px;
+        padding-top: 10px;
+        border-top: 1px solid #eee;
+        font-size: 12px;
+        color: #7f8c8d;
+        text-align: center;
+    }
+
+    .impression-section {
+        background-color: #f9f9f9;
+        padding: 10px 15px;
+        border-left: 4px solid #2c3e50;
+        margin: 15px 0;
+    }
+
+    .recommendation-section {
+        background-color: #f9f9f9;
+        padding: 10px 15px;
+        border-left: 4px solid #3498db;
+        margin: 15px 0;
+    }
+
+    @media print {
+        .report-container {
+            box-shadow: none;
+            border: none;
+        }
+    }
+</style>
+"""
+
+# Templates are parsed once at import; rendering a report is only substitutions
+_HEADER = Template("""
+<div class="report-container">
+    <div class="report-header">
+        <div class="logo-container">
+            <!-- Hospital logo could go here -->
+            <!-- <img src="hospital_logo.png" alt="Hospital Logo" width="180"> -->
+        </div>
+        <h3 class="report-title">CT PULMONARY ANGIOGRAPHY REPORT</h3>$subtitle
+    </div>
+""")
+_SUBTITLE = Template("""
+        <p class="report-subtitle">($text)</p>""")
+_SECTION = Template("""
+    <div class="report-section$css_class">
+        <h4>$title:</h4>
+        $body
+    </div>
+""")
+_LIST = Template("<ul>\n$items\n        </ul>")
+_ITEM = Template("            <li>$text</li>")
+_FOOTER = Template("""
+    <div class="report-footer">
+        <p>$line<br>
+        $note</p>
+    </div>
+</div>
+""")
+
+# Report lines that do not depend on the PE findings
+PARENCHYMA_FINDINGS = [
+    "Lung parenchyma shows no consolidation or ground glass opacity",
+    "No pleural effusion",
+    "Mediastinal and hilar lymph nodes within normal limits",
+]
+
+FALLBACK_FINDINGS = [
+    "CT Pulmonary Angiogram study performed to evaluate for pulmonary embolism",
+    "Pulmonary arterial tree visualized to the subsegmental level",
+    "Lung parenchyma and airways visualized",
+    "Mediastinal and hilar structures evaluated",
+    "Limited evaluation of the chest wall and upper abdomen",
+]
+
+TECHNIQUE = ("Contrast-enhanced CT of the chest with pulmonary arterial phase imaging.<br>\n"
+             "        IV contrast: 70 ml of non-ionic contrast material.<br>\n"
+             "        Slice thickness: 1.0 mm")
+
+def render_section(title, body, css_class=None):
+    """
+    Render one report section
+
+    Parameters:
+    -----------
+    title : str
+        The section heading, without the trailing colon
+    body : str
+        The section content as HTML
+    css_class : str, optional
+        Extra class for the section, e.g. 'impression-section'
+
+    Returns:
+    --------
+    str
+        The section HTML
+    """
+    return _SECTION.substitute(title=title, body=body, css_class=f" {css_class}" if css_class else "")
+
+def render_list(items):
+    """Render (text, css class or None) pairs as an HTML list, escaping the text"""
+    rendered = []
+    for text, css_class in items:
+        text = escape(text)
+        if css_class:
+            text = f'<div class="{css_class}">{text}</div>'
+        rendered.append(_ITEM.substitute(text=text))
+    return _LIST.substitute(items="\n".join(rendered))
+
+def render_fields(fields):
+    """Render (label, value) pairs as a paragraph of labelled lines, escaping the values"""
+    lines = [f"<strong>{label}:</strong> {escape(str(value))}" for label, value in fields]
+    return "<p>\n            " + " <br>\n            ".join(lines) + "\n        </p>"
+
+@lru_cache(maxsize=None)
+def report_chrome(subtitle=None):
+    """
+    Return the static stylesheet and header of a report
+
+    Rendered once per subtitle and cached for the life of the process.
+
+    Parameters:
+    -----------
+    subtitle : str, optional
+        Text shown in parentheses under the title
+
+    Returns:
+    --------
+    str
+        The stylesheet followed by the opening of the report container
+    """
+    subtitle_html = _SUBTITLE.substitute(text=escape(subtitle)) if subtitle else ""
+    return REPORT_CSS + _HEADER.substitute(subtitle=subtitle_html)
+
+def render_footer(line, note):
+    """Render the footer that closes the report container"""
+    return _FOOTER.substitute(line=escape(line), note=escape(note))
+
+def _literal(html):
+    # Static content embedded in a template must not be read as placeholders
+    return html.replace("$", "$$")
+
+def render_findings(findings):
+    """
+    Render the findings, impression and recommendation sections
+
+    Parameters:
+    -----------
+    findings : Findings
+        The structured findings; pe_present None renders the not-assessed text
+
+    Returns:
+    --------
+    str
+        The sections as HTML
+    """
+    if findings.pe_present is None:
+        return _fallback_findings_sections()
+
+    if findings.pe_present:
+        location = findings.location or "pulmonary arteries"
+        items = [(f"Filling defect in the {location} consistent with acute pulmonary embolism", "pe-finding")]
+        if findings.clot_burden:
+            items.append((f"{findings.clot_burden.capitalize()} clot burden", None))
+        if findings.rv_strain:
+            items.append(("CT signs of right heart strain", "pe-finding"))
+        elif findings.rv_strain is False:
+            items.append(("No evidence of right heart strain", None))
+        else:
+            items.append(("Right heart strain not assessed", None))
+        strain = {True: " with evidence of right heart strain", False: " without evidence of right heart strain",
+                  None: ""}[findings.rv_strain]
+        impression = (f"<p><strong>Acute pulmonary embolism</strong>"
+                      f"{escape(f' in the {location}{strain}.')}</p>")
+        recommendation = "Anticoagulation therapy as per institutional protocol. Clinical correlation recommended."
+        if findings.rv_strain:
+            recommendation = "Urgent risk stratification for right ventricular dysfunction. " + recommendation
+    else:
+        items = [
+            ("No filling defects in the main, lobar, segmental, or subsegmental pulmonary arteries", "normal-finding"),
+            ("Normal caliber of the main pulmonary artery", None),
+        ]
+        impression = '<p><strong class="normal-finding">No evidence of pulmonary embolism.</strong></p>'
+        recommendation = "No further imaging required for suspected pulmonary embolism. Clinical correlation recommended."
+
+    items += [(text, None) for text in PARENCHYMA_FINDINGS]
+    return "".join([
+        render_section("FINDINGS", render_list(items)),
+        render_section("IMPRESSION", impression, "impression-section"),
+        render_section("RECOMMENDATION", f"<p>{escape(recommendation)}</p>", "recommendation-section"),
+    ])
+
+@lru_cache(maxsize=256)
+def _ctpa_template(findings):
+    """
+    Compile the full CTPA report for one findings variant into a single template
+
+    Everything except the patient details, date and signature is static, so
+    rendering a report is one substitution of a handful of escaped values.
+    """
+    patient = render_fields([
+        ("Patient ID", "\0patient_id"),
+        ("Name", "\0patient_name"),
+        ("DOB", "\0patient_dob"),
+        ("Gender", "\0patient_gender"),
+        ("Referring Physician", "\0referring_physician"),
+    ])
+    html = "".join([
+        report_chrome(),
+        render_section("PATIENT INFORMATION", patient),
+        render_section("EXAM", "<p>CT Pulmonary Angiography (CTPA)</p>"),
+        render_section("DATE", "<p>\0report_date</p>"),
+        render_section("TECHNIQUE", f"<p>{TECHNIQUE}</p>"),
+        render_findings(findings),
+        render_footer("Report generated by Dr. \0radiologist", "This report was electronically signed on \0report_date"),
+    ])
+    # Placeholders were marked with a NUL so the static text could be escaped first
+    return Template(_literal(html).replace("\0", "$"))
+
+def generate_ctpa_report(scan_data, findings=DEMO_PE_FINDINGS, report_date=None):
     """
     Generate a CTPA report
-    
+
     Parameters:
     -----------
     scan_data : numpy.ndarray
-        The scan data for analysis
-        
+        The scan data for analysis; patient details are read from its
+        attributes when present
+    findings : Findings
+        The structured findings the report is rendered from
+    report_date : str, optional
+        The date shown on the report; defaults to now
+
     Returns:
     --------
     str
         HTML string containing the formatted report
     """
     try:
-        # Simulate processing time
-        time.sleep(1)
-        
         # In a real application, this would analyze the scan data
         # and generate a real report based on medical findings
-        
-        report_date = datetime.now().strftime("%B %d, %Y at %I:%M %p")
-        
-        # For demonstration, always show a PE case (or toggle based on your needs)
-        pe_present = True
-        
-        # Define CSS styling for the report
-        css_style = """
-        <style>
-            .report-container {
-                font-family: 'Arial', sans-serif;
-                max-width: 800px;
-                margin: 20px auto;
-                padding: 25px;
-                border: 1px solid #ccc;
-                border-radius: 8px;
-                box-shadow: 0 2px 5px rgba(0,0,0,0.1);
-                background-color: #fff;
-            }
-            
-            .report-header {
-                text-align: center;
-                padding-bottom: 15px;
-                border-bottom: 2px solid #2c3e50;
-            }
-            
-            .report-title {
-                color: #2c3e50;
-                margin: 0;
-                font-size: 22px;
-                font-weight: 700;
-            }
-            
-            .logo-container {
-                text-align: center;
-                margin-bottom: 15px;
-            }
-            
-            .report-section {
-                margin: 15px 0;
-                padding-bottom: 10px;
-            }
-            
-            .report-section h4 {
-                color: #2c3e50;
-                margin: 0 0 8px 0;
-                font-size: 16px;
-                font-weight: 600;
-                border-bottom: 1px solid #eee;
-                padding-bottom: 5px;
-            }
-            
-            .report-section p, .report-section li {
-                margin: 5px 0;
-                line-height: 1.5;
-                color: #333;
-                font-size: 14px;
-            }
-            
-            .report-section ul {
-                padding-left: 20px;
-            }
-            
-            .pe-finding {
-                color: #c0392b;
-                font-weight: 600;
-            }
-            
-            .normal-finding {
-                color: #27ae60;
-                font-weight: 600;
-            }
-            
-            .report-footer {
-                margin-top: 20px;
-                padding-top: 10px;
-                border-top: 1px solid #eee;
-                font-size: 12px;
-                color: #7f8c8d;
-                text-align: center;
-            }
-            
-            .impression-section {
-                background-color: #f9f9f9;
-                padding: 10px 15px;
-                border-left: 4px solid #2c3e50;
-                margin: 15px 0;
-            }
-            
-            .recommendation-section {
-                background-color: #f9f9f9;
-                padding: 10px 15px;
-                border-left: 4px solid #3498db;
-                margin: 15px 0;
-            }
-            
-            @media print {
-                .report-container {
-                    box-shadow: none;
-                    border: none;
-                }
-            }
-        </style>
-        """
-        
-        if pe_present:
-            findings = """
-            <div class="report-section">
-                <h4>FINDINGS:</h4>
-                <ul>
-                    <li><div class="pe-finding">Filling defect in the right lower lobe pulmonary artery consistent with acute pulmonary embolism</div></li>
-                    <li>No evidence of right heart strain</li>
-                    <li>Lung parenchyma shows no consolidation or ground glass opacity</li>
-                    <li>No pleural effusion</li>
-                    <li>Mediastinal and hilar lymph nodes within normal limits</li>
-                </ul>
-            </div>
-            
-            <div class="report-section impression-section">
-                <h4>IMPRESSION:</h4>
-                <p><strong>Acute pulmonary embolism</strong> in the right lower lobe pulmonary artery without evidence of right heart strain.</p>
-            </div>
-            
-            <div class="report-section recommendation-section">
-                <h4>RECOMMENDATION:</h4>
-                <p>Anticoagulation therapy as per institutional protocol. Clinical correlation recommended.</p>
-            </div>
-            """
-        else:
-            findings = """
-            <div class="report-section">
-                <h4>FINDINGS:</h4>
-                <ul>
-                    <li><div class="normal-finding">No filling defects in the main, lobar, segmental, or subsegmental pulmonary arteries</div></li>
-                    <li>Normal caliber of the main pulmonary artery</li>
-                    <li>Lung parenchyma shows no consolidation or ground glass opacity</li>
-                    <li>No pleural effusion</li>
-                    <li>Mediastinal and hilar lymph nodes within normal limits</li>
-                </ul>
-            </div>
-            
-            <div class="report-section impression-section">
-                <h4>IMPRESSION:</h4>
-                <p><strong class="normal-finding">No evidence of pulmonary embolism.</strong></p>
-            </div>
-            
-            <div class="report-section recommendation-section">
-                <h4>RECOMMENDATION:</h4>
-                <p>No further imaging required for suspected pulmonary embolism. Clinical correlation recommended.</p>
-            </div>
-            """
-        
-        return f"""
-        {css_style}
-        <div class="report-container">
-            <div class="report-header">
-                <div class="logo-container">
-                    <!-- Hospital logo could go here -->
-                    <!-- <img src="hospital_logo.png" alt="Hospital Logo" width="180"> -->
-                </div>
-                <h3 class="report-title">CT PULMONARY ANGIOGRAPHY REPORT</h3>
-            </div>
-            
-            <div class="report-section">
-                <h4>PATIENT INFORMATION:</h4>
-                <p>
-                    <strong>Patient ID:</strong> {getattr(scan_data, 'patient_id', 'Anonymous')} <br>
-                    <strong>Name:</strong> {getattr(scan_data, 'patient_name', 'Anonymous')} <br>
-                    <strong>DOB:</strong> {getattr(scan_data, 'patient_dob', '12/12/1990')} <br>
-                    <strong>Gender:</strong> {getattr(scan_data, 'patient_gender', 'Anonymous')} <br>
-                    <strong>Referring Physician:</strong> {getattr(scan_data, 'referring_physician', 'Dr Jane Doe')}
-                </p>
-            </div>
-            
-            <div class="report-section">
-                <h4>EXAM:</h4>
-                <p>CT Pulmonary Angiography (CTPA)</p>
-            </div>
-            
-            <div class="report-section">
-                <h4>DATE:</h4>
-                <p>{report_date}</p>
-            </div>
-            
-            <div class="report-section">
-                <h4>TECHNIQUE:</h4>
-                <p>Contrast-enhanced CT of the chest with pulmonary arterial phase imaging.<br>
-                IV contrast: 70 ml of non-ionic contrast material.<br>
-                Slice thickness: 1.0 mm</p>
-            </div>
-            
-            {findings}
-            
-            <div class="report-footer">
-                <p>Report generated by Dr. {getattr(scan_data, 'radiologist', 'Dr Jane Doe')}<br>
-                This report was electronically signed on {report_date}</p>
-            </div>
-        </div>
-        """
+
+        if report_date is None:
+            report_date = datetime.now().strftime("%B %d, %Y at %I:%M %p")
+
+        return _ctpa_template(findings).substitute(
+            patient_id=escape(str(getattr(scan_data, 'patient_id', 'Anonymous'))),
+            patient_name=escape(str(getattr(scan_data, 'patient_name', 'Anonymous'))),
+            patient_dob=escape(str(getattr(scan_data, 'patient_dob', '12/12/1990'))),
+            patient_gender=escape(str(getattr(scan_data, 'patient_gender', 'Anonymous'))),
+            referring_physician=escape(str(getattr(scan_data, 'referring_physician', 'Dr Jane Doe'))),
+            radiologist=escape(str(getattr(scan_data, 'radiologist', 'Dr Jane Doe'))),
+            report_date=escape(report_date),
+        )
     except Exception as e:
         return f"""
         <div style="color: red; padding: 20px; border: 1px solid red; border-radius: 5px; margin: 20px;">
             <h3>Error Generating Report</h3>
-            <p>{str(e)}</p>
+            <p>{escape(str(e))}</p>
         </div>
-        """
\ No newline at end of file
+        """
+
+@lru_cache(maxsize=None)
+def _fallback_findings_sections():
+    return "".join([
+        render_section("FINDINGS", (
+            "<p>This is a fallback report generated when the AI analysis system is unavailable.<br>\n"
+            "        Please consult with a radiologist for a professional interpretation of this scan.</p>\n        "
+            + render_list([(text, None) for text in FALLBACK_FINDINGS])
+        )),
+        render_section("IMPRESSION", (
+            "<p><strong>Note:</strong> This is a fallback report. A qualified radiologist should review "
+            "this study to provide an accurate diagnosis and interpretation.</p>"
+        ), "impression-section"),
+    ])
+
+@lru_cache(maxsize=None)
+def _fallback_template():
+    """Compile the fallback report into a single template (see _ctpa_template)"""
+    html = "".join([
+        report_chrome("Fallback Report Generator"),
+        render_section("SCAN INFORMATION", render_fields([
+            ("Scan ID", "\0scan_id"),
+            ("Filename", "\0filename"),
+            ("Date", "\0report_date"),
+        ])),
+        render_findings(Findings()),
+        render_footer("Report generated using fallback generator on \0report_date",
+                      "This report does not represent a medical diagnosis."),
+    ])
+    return Template(_literal(html).replace("\0", "$"))
+
+def generate_fallback_report(scan_id, filename="Unknown", report_date=None):
+    """
+    Generate the report shown when the analysis backend is unavailable
+
+    Parameters:
+    -----------
+    scan_id : str
+        The scan identifier
+    filename : str
+        The scan's original filename, if known
+    report_date : str, optional
+        The date shown on the report; defaults to now
+
+    Returns:
+    --------
+    str
+        HTML string containing the formatted report
+    """
+    if report_date is None:
+        report_date = datetime.now().strftime("%B %d, %Y at %I:%M %p")
+
+    return _fallback_template().substitute(
+        scan_id=escape(str(scan_id)),
+        filename=escape(str(filename)),
+        report_date=escape(report_date),
+    )
+
+@lru_cache(maxsize=64)
+def _local_analysis_template(findings):
+    """Compile the report of the local CPU analysis for one findings variant (see _ctpa_template)"""
+    if findings.pe_present:
+        location = findings.location or "pulmonary arteries"
+        items = [(f"Filling defect in the {location} suggestive of pulmonary embolism", "pe-finding")]
+        if findings.clot_burden:
+            items.append((f"{findings.clot_burden.capitalize()} clot burden", None))
+        impression = (f"<p><strong>Suspected acute pulmonary embolism</strong>"
+                      f"{escape(f' in the {location}.')}</p>")
+    elif findings.pe_present is False:
+        items = [("No filling defects detected in the contrast-enhanced pulmonary arteries", "normal-finding")]
+        impression = '<p><strong class="normal-finding">No filling defects detected.</strong></p>'
+    else:
+        items = [("The analysis did not cover the whole volume within its time budget", None)]
+        impression = "<p><strong>Inconclusive:</strong> no filling defects found in the analyzed slices.</p>"
+    items += [("\0coverage", None), ("Right heart strain and lung parenchyma were not assessed", None)]
+
+    html = "".join([
+        report_chrome("Local CPU Analysis"),
+        render_section("SCAN INFORMATION", render_fields([
+            ("Scan ID", "\0scan_id"),
+            ("Filename", "\0filename"),
+            ("Date", "\0report_date"),
+        ])),
+        render_section("METHOD", (
+            "<p>Automated screening for filling defects in contrast-filled pulmonary arteries, run on this "
+            "workstation because the AI analysis system was unavailable.</p>"
+        )),
+        render_section("FINDINGS", render_list(items)),
+        render_section("IMPRESSION", impression, "impression-section"),
+        render_section("RECOMMENDATION", (
+            "<p>Preliminary automated result. A qualified radiologist should review this study, and the AI "
+            "analysis should be repeated once it is available.</p>"
+        ), "recommendation-section"),
+        render_footer("Report generated by the local analysis on \0report_date",
+                      "This report does not represent a medical diagnosis."),
+    ])
+    return Template(_literal(html).replace("\0", "$"))
+
+def generate_local_analysis_report(scan_id, analysis, filename="Unknown", report_date=None):
+    """
+    Generate the report of the local CPU analysis
+
+    Parameters:
+    -----------
+    scan_id : str
+        The scan identifier
+    analysis : core.local_analysis.LocalAnalysis
+        The detector's result
+    filename : str
+        The scan's original filename, if known
+    report_date : str, optional
+        The date shown on the report; defaults to now
+
+    Returns:
+    --------
+    str
+        HTML string containing the formatted report
+    """
+    if report_date is None:
+        report_date = datetime.now().strftime("%B %d, %Y at %I:%M %p")
+
+    candidates = len(analysis.candidates)
+    coverage = (f"{candidates} candidate filling defect{'s' if candidates != 1 else ''} in "
+                f"{analysis.slices_analyzed} of {analysis.slices_total} axial slices analyzed")
+    return _local_analysis_template(analysis.findings).substitute(
+        scan_id=escape(str(scan_id)),
+        filename=escape(str(filename)),
+        report_date=escape(report_date),
+        coverage=escape(coverage),
+    )
@@ -1,11 +1,618 @@
-import nibabel as nib
+import numpy as np
 import gc
-from CTPA_App_Frontend.utils.notification import add_notification
+import gzip
+import io
+import logging
+import os
+import struct
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from config import (
+    NPZ_VOLUME_KEY, NPZ_VOLUME_KEYS, NPZ_STREAM_CHUNK_BYTES, DICOM_DECODE_WORKERS,
+    STREAM_SLAB_SLICES, STREAM_WORKERS
+)
+from core.volume_cache import open_cached_volume, cache_volume
+from utils.notification import add_notification
+
+logger = logging.getLogger(__name__)
+
+# Size of the fixed part of a zip local file header
+_ZIP_LOCAL_HEADER_SIZE = 30
+
+# Pixel data is decoded a slice at a time on a shared pool; the decoders
+# release the GIL for the bulk of the work
+_dicom_executor = ThreadPoolExecutor(max_workers=DICOM_DECODE_WORKERS, thread_name_prefix="dicom-decode")
+
+# Compressed NIfTI and .npz volumes are inflated on their own pool, one thread per volume
+_stream_executor = ThreadPoolExecutor(max_workers=STREAM_WORKERS, thread_name_prefix="volume-stream")
+
+class NpzScan:
+    """
+    Lazy handle on a NumPy .npz archive
+
+    Only the zip directory is read when the handle is created. Member arrays
+    are opened on first access: uncompressed (stored) members are memory-mapped
+    straight out of the archive, compressed members are streamed into a
+    preallocated array in fixed-size chunks.
+    """
+
+    def __init__(self, file_path, key=None):
+        self.file_path = file_path
+        self.key = key or NPZ_VOLUME_KEY or None
+        with zipfile.ZipFile(file_path) as zf:
+            self._members = {
+                info.filename[:-4]: info
+                for info in zf.infolist()
+                if info.filename.endswith(".npy")
+            }
+        self._headers = {}
+
+    def keys(self):
+        """Return the names of the arrays in the archive"""
+        return list(self._members)
+
+    @property
+    def volume_key(self):
+        """The member used as the scan volume"""
+        if self.key:
+            if self.key not in self._members:
+                raise KeyError(f"Array '{self.key}' not found in {self.file_path} (available: {', '.join(self._members)})")
+            return self.key
+        for key in NPZ_VOLUME_KEYS:
+            if key in self._members:
+                return key
+        # Fall back to the first 3D array in the archive
+        for key in self._members:
+            if len(self._read_header(key)[0]) == 3:
+                return key
+        raise KeyError(f"No volume array found in {self.file_path}")
+
+    @property
+    def shape(self):
+        """Shape of the volume array, read from its header only"""
+        return self._read_header(self.volume_key)[0]
+
+    def _read_header(self, key):
+        """Read (shape, fortran_order, dtype, data_offset) for a member"""
+        if key not in self._headers:
+            info = self._members[key]
+            with zipfile.ZipFile(self.file_path) as zf, zf.open(info) as member:
+                shape, fortran_order, dtype = _read_npy_header(member)
+            # The data offset is only needed to memory-map stored members
+            data_offset = None
+            if info.compress_type == zipfile.ZIP_STORED:
+                with open(self.file_path, "rb") as f:
+                    data_offset = _stored_member_offset(f, info)
+                    f.seek(data_offset)
+                    _read_npy_header(f)
+                    data_offset = f.tell()
+            self._headers[key] = (shape, fortran_order, dtype, data_offset)
+        return self._headers[key]
+
+    def get_array(self, key=None):
+        """
+        Load an array from the archive
+
+        Parameters:
+        -----------
+        key : str, optional
+            The array name, defaults to the volume array
+
+        Returns:
+        --------
+        numpy.ndarray
+            A read-only memory map for stored members, otherwise an in-memory array
+        """
+        key = key or self.volume_key
+        shape, fortran_order, dtype, data_offset = self._read_header(key)
+        order = "F" if fortran_order else "C"
+
+        if dtype.hasobject:
+            # Object arrays are pickled, and loading pickles from uploads is unsafe
+            raise ValueError(f"Array '{key}' in {self.file_path}: object arrays are not supported")
+
+        if data_offset is not None:
+            return np.memmap(self.file_path, dtype=dtype, mode="r", offset=data_offset, shape=shape, order=order)
+
+        return self._stream_member(key, shape, order, dtype)
+
+    @contextmanager
+    def _open_data(self, key):
+        """Open a member positioned at the start of its array data"""
+        with zipfile.ZipFile(self.file_path) as zf, zf.open(self._members[key]) as member:
+            _read_npy_header(member)
+            yield member
+
+    def _stream_member(self, key, shape, order, dtype):
+        """Inflate a compressed member into a preallocated array chunk by chunk"""
+        arr = np.empty(shape, dtype=dtype, order=order)
+        # A contiguous byte view of the destination in on-disk order
+        dest = (arr.T if order == "F" else arr).reshape(-1).view(np.uint8)
+        with self._open_data(key) as member:
+            pos = 0
+            while pos < dest.size:
+                n = member.readinto(memoryview(dest[pos:pos + NPZ_STREAM_CHUNK_BYTES]))
+                if not n:
+                    raise ValueError(f"Array '{key}' in {self.file_path} is truncated")
+                pos += n
+        return arr
+
+    def get_fdata(self):
+        """
+        Return the volume array
+
+        Unlike nibabel's get_fdata the stored dtype is kept, so a memory-mapped
+        member stays mapped instead of being copied into float64. Compressed
+        members are inflated in the background and returned straight away as
+        a StreamedVolume.
+        """
+        key = self.volume_key
+        shape, fortran_order, dtype, data_offset = self._read_header(key)
+        if data_offset is not None or dtype.hasobject:
+            # get_array maps stored members and rejects object arrays
+            return self.get_array(key)
+        return StreamedVolume(lambda: self._open_data(key), shape, dtype, order="F" if fortran_order else "C",
+                              description=f"array '{key}' in {self.file_path}")
+
+def _read_npy_header(f):
+    """Read the .npy magic and header from a file object positioned at its start"""
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        return np.lib.format.read_array_header_1_0(f)
+    return np.lib.format.read_array_header_2_0(f)
+
+def _stored_member_offset(f, info):
+    """Return the file offset at which a zip member's data starts"""
+    f.seek(info.header_offset)
+    header = f.read(_ZIP_LOCAL_HEADER_SIZE)
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    return info.header_offset + _ZIP_LOCAL_HEADER_SIZE + name_len + extra_len
+
+class DicomSeries:
+    """
+    Lazy handle on a DICOM series
+
+    Only the headers are read when the handle is created, and the slices are
+    ordered along the scan axis by ImagePositionPatient. Pixel data is decoded
+    slice by slice on a thread pool in the background, starting from the
+    middle slice the viewer shows first. A slice that is needed before the
+    background decode reaches it is decoded straight away by the caller.
+
+    The series can be a directory of files, a single .dcm file or a .zip
+    archive of the series as exported from PACS. Multi-frame (enhanced CT)
+    files contribute one slice per frame, placed by the frame's position in
+    the per-frame functional groups; such a file is decoded in one go, so
+    all of its frames become available together.
+    """
+
+    def __init__(self, file_path):
+        from pydicom.errors import InvalidDicomError
+
+        self.file_path = file_path
+        self._zip = zipfile.ZipFile(file_path) if zipfile.is_zipfile(file_path) else None
+
+        headers = []
+        for source in self._sources():
+            try:
+                headers.append((source, self._read(source, header_only=True)))
+            except (InvalidDicomError, AttributeError, EOFError):
+                # DICOMDIR indexes, thumbnails and other non-image files
+                continue
+        headers = [(source, ds) for source, ds in headers if "Rows" in ds and "Columns" in ds]
+        if not headers:
+            raise ValueError(f"No DICOM images found in {file_path}")
+
+        # PACS exports may bundle several series; keep the largest
+        by_series = {}
+        for source, ds in headers:
+            by_series.setdefault(ds.get("SeriesInstanceUID", ""), []).append((source, ds))
+        headers = max(by_series.values(), key=len)
+        if len(by_series) > 1:
+            logger.info(f"{file_path} holds {len(by_series)} series, loading the one with {len(headers)} slices")
+
+        # One entry per slice: (position, source index, frame or None, rescale)
+        frames = [(position, i, frame, rescale)
+                  for i, (_, ds) in enumerate(headers) for frame, position, rescale in _dicom_frames(ds)]
+        frames.sort(key=lambda item: item[0])
+        first = headers[0][1]
+        self._sources_sorted = [source for source, _ in headers]
+        self._frames = [(i, frame) for _, i, frame, _ in frames]
+        self._rescale = [rescale for _, _, _, rescale in frames]
+        # The slices each source file holds, decoded together
+        self._source_slices = [[] for _ in headers]
+        for k, (i, frame) in enumerate(self._frames):
+            self._source_slices[i].append((k, frame))
+        self.shape = (int(first.Columns), int(first.Rows), len(frames))
+        self.dtype = _volume_dtype([(headers[i][1], rescale) for _, i, _, rescale in frames])
+        self.header = first
+
+        # Fortran order keeps every axial slice contiguous, as in the volume cache
+        self._data = np.zeros(self.shape, dtype=self.dtype, order="F")
+        self._state = [0] * len(frames)  # 0 pending, 1 decoding, 2 decoded
+        self._ready = [threading.Event() for _ in frames]
+        self._errors = {}
+        self._lock = threading.Lock()
+        self._remaining = len(frames)
+
+        middle = len(frames) // 2
+        for k in sorted(range(len(frames)), key=lambda k: abs(k - middle)):
+            _dicom_executor.submit(self._decode, k)
+
+    def _sources(self):
+        """List the files (or archive members) that may hold slices"""
+        if self._zip is not None:
+            return [info.filename for info in self._zip.infolist() if not info.is_dir()]
+        if os.path.isdir(self.file_path):
+            return sorted(entry.path for entry in os.scandir(self.file_path) if entry.is_file())
+        return [self.file_path]
+
+    def _read(self, source, header_only=False):
+        import pydicom
+        if self._zip is not None:
+            if header_only:
+                # Stop inflating the member once the header has been parsed
+                with self._zip.open(source) as member:
+                    return pydicom.dcmread(member, stop_before_pixels=True)
+            # ZipFile supports concurrent reads of separate members
+            return pydicom.dcmread(io.BytesIO(self._zip.read(source)))
+        return pydicom.dcmread(source, stop_before_pixels=header_only)
+
+    def _claim(self, k):
+        """
+        Mark the slices of the file holding slice k as being decoded
+
+        Returns:
+        --------
+        list or None
+            The (slice, frame) pairs to decode, or None if someone else
+            already has
+        """
+        source_slices = self._source_slices[self._frames[k][0]]
+        with self._lock:
+            if self._state[k]:
+                return None
+            for j, _ in source_slices:
+                self._state[j] = 1
+            return source_slices
+
+    def _decode(self, k):
+        """Decode the file holding slice k into the volume unless another thread already has"""
+        source_slices = self._claim(k)
+        if source_slices is None:
+            return
+        try:
+            pixels = self._read(self._sources_sorted[self._frames[k][0]]).pixel_array
+            for j, frame in source_slices:
+                frame_pixels = pixels if frame is None else pixels[frame]
+                slope, intercept = self._rescale[j]
+                if slope != 1 or intercept != 0:
+                    frame_pixels = frame_pixels * slope + intercept
+                self._data[:, :, j] = frame_pixels.T
+        except Exception as e:
+            logger.error(f"Error decoding slice {k} of {self.file_path}: {str(e)}")
+            for j, _ in source_slices:
+                self._errors[j] = e
+        finally:
+            with self._lock:
+                for j, _ in source_slices:
+                    self._state[j] = 2
+                self._remaining -= len(source_slices)
+                finished = not self._remaining
+            for j, _ in source_slices:
+                self._ready[j].set()
+            if finished and self._zip is not None:
+                self._zip.close()
+
+    def wait(self, slices=None):
+        """
+        Block until the given slices are decoded
+
+        Parameters:
+        -----------
+        slices : iterable of int, optional
+            Indices along the scan axis, defaults to the whole series
+        """
+        slices = range(self.shape[2]) if slices is None else slices
+        for k in slices:
+            self._decode(k)
+            self._ready[k].wait()
+            if k in self._errors:
+                raise ValueError(f"Slice {k} of {self.file_path} could not be decoded: {self._errors[k]}")
+
+    @property
+    def decoded(self):
+        """Number of slices decoded so far"""
+        with self._lock:
+            return self.shape[2] - self._remaining
+
+    def get_fdata(self):
+        """
+        Return the volume as a lazily decoded array
+
+        Like NpzScan the stored dtype is kept: int16 Hounsfield units when
+        the rescale is integral, float32 otherwise.
+        """
+        return DicomVolume(self)
+
+class DicomVolume:
+    """
+    Array view of a DicomSeries
+
+    Indexing waits only for the slices it touches, so an axial slice can be
+    shown while the rest of the series is still being decoded. Sagittal and
+    coronal reformats touch every slice and wait for the whole series.
+    """
+
+    def __init__(self, series):
+        self._series = series
+        self.shape = series.shape
+        self.dtype = series.dtype
+        self.ndim = 3
+
+    # Slices are decoded along the z axis
+    scan_axis = 2
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        return self._series._data.nbytes
+
+    def loaded_slices(self):
+        """Boolean mask of the slices along the scan axis that are decoded"""
+        with self._series._lock:
+            return np.array(self._series._state) == 2
+
+    def __getitem__(self, key):
+        self._series.wait(_indices_along(key, self.scan_axis, self.shape))
+        return self._series._data[key]
+
+    def __array__(self, dtype=None, copy=None):
+        self._series.wait()
+        data = self._series._data
+        return data if dtype is None else data.astype(dtype)
+
+class StreamedVolume:
+    """
+    Array view of a volume inflated from a compressed stream in the background
+
+    The stream is read one slab of STREAM_SLAB_SLICES slices at a time along
+    the axis that is slowest in its byte order (z for Fortran-ordered NIfTI
+    and .npz data, x for C-ordered .npz data), and every slab can be read as
+    soon as it is written. Like DicomVolume, indexing waits only for the
+    slices it touches, so the viewer can show slices while the rest is still
+    inflating. Gzip and deflate streams cannot be entered midway, so slices
+    arrive in file order.
+    """
+
+    def __init__(self, open_stream, shape, dtype, order="F", scale=None, description="volume", on_loaded=None):
+        """
+        Parameters:
+        -----------
+        open_stream : callable
+            Returns a context manager yielding a binary file object
+            positioned at the start of the voxel data
+        shape : tuple of int
+            The volume shape
+        dtype : numpy.dtype
+            The dtype of the stored voxels, including byte order
+        order : str
+            'F' or 'C', the order of the stored voxels
+        scale : tuple of float, optional
+            (slope, intercept) to apply; scaled volumes are float32
+        description : str
+            How the volume is named in errors
+        on_loaded : callable, optional
+            Called with the complete array from the loading thread
+        """
+        self.shape = tuple(shape)
+        self.ndim = len(self.shape)
+        self.scan_axis = self.ndim - 1 if order == "F" else 0
+        self._raw_dtype = np.dtype(dtype)
+        self.dtype = np.dtype(np.float32) if scale else self._raw_dtype.newbyteorder("=")
+        self._order = order
+        self._scale = scale
+        self._description = description
+        self._on_loaded = on_loaded
+        self._data = np.empty(self.shape, dtype=self.dtype, order=order)
+        self._loaded = 0  # Slices along the scan axis written so far
+        self._error = None
+        self._cond = threading.Condition()
+        _stream_executor.submit(self._stream, open_stream)
+
+    def _stream(self, open_stream):
+        count = self.shape[self.scan_axis]
+        slice_items = self._data.size // count if count else 0
+        # Native unscaled voxels are read straight into the volume
+        direct = self._scale is None and self._raw_dtype == self.dtype
+        # A contiguous view of the destination in on-disk order
+        dest = (self._data.T if self._order == "F" else self._data).reshape(-1)
+        try:
+            with open_stream() as stream:
+                for k0 in range(0, count, STREAM_SLAB_SLICES):
+                    k1 = min(k0 + STREAM_SLAB_SLICES, count)
+                    slab = dest[k0 * slice_items:k1 * slice_items]
+                    if direct:
+                        _read_exactly(stream, slab.view(np.uint8), self._description)
+                    else:
+                        raw = np.empty(slab.size, dtype=self._raw_dtype)
+                        _read_exactly(stream, raw.view(np.uint8), self._description)
+                        if self._scale:
+                            slope, intercept = self._scale
+                            np.multiply(raw, slope, out=slab, casting="unsafe")
+                            slab += intercept
+                        else:
+                            slab[...] = raw
+                    with self._cond:
+                        self._loaded = k1
+                        self._cond.notify_all()
+        except Exception as e:
+            logger.error(f"Error loading {self._description}: {str(e)}")
+            with self._cond:
+                self._error = e
+                self._cond.notify_all()
+            return
+
+        if self._on_loaded is not None:
+            try:
+                self._on_loaded(self._data)
+            except Exception as e:
+                logger.error(f"Error after loading {self._description}: {str(e)}")
+
+    def wait(self, slices=None):
+        """
+        Block until the given slices are loaded
+
+        Parameters:
+        -----------
+        slices : iterable of int, optional
+            Indices along the scan axis, defaults to the whole volume
+        """
+        slices = range(self.shape[self.scan_axis]) if slices is None else slices
+        last = max(slices, default=-1)
+        with self._cond:
+            while self._loaded <= last and self._error is None:
+                self._cond.wait()
+            if self._loaded <= last:
+                raise ValueError(f"Slice {last} of {self._description} could not be loaded: {self._error}")
+
+    @property
+    def nbytes(self):
+        return self._data.nbytes
+
+    def loaded_slices(self):
+        """Boolean mask of the slices along the scan axis that are loaded"""
+        with self._cond:
+            return np.arange(self.shape[self.scan_axis]) < self._loaded
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        self.wait(_indices_along(key, self.scan_axis, self.shape))
+        return self._data[key]
+
+    def __array__(self, dtype=None, copy=None):
+        self.wait()
+        return self._data if dtype is None else self._data.astype(dtype)
+
+def _indices_along(key, axis, shape):
+    """Return the indices along axis that an index key reads, or None for all of them"""
+    key = key if isinstance(key, tuple) else (key,)
+    if len(key) <= axis or any(part is Ellipsis for part in key):
+        return None
+    part = key[axis]
+    if isinstance(part, (int, np.integer)):
+        return [int(part) % shape[axis]]
+    if isinstance(part, slice):
+        return range(*part.indices(shape[axis]))
+    return np.unique(np.arange(shape[axis])[part])
+
+def _read_exactly(stream, dest, description):
+    """Fill a uint8 array from a binary stream"""
+    pos = 0
+    while pos < dest.size:
+        n = stream.readinto(memoryview(dest[pos:]))
+        if not n:
+            raise ValueError(f"{description} is truncated")
+        pos += n
+
+def _slice_position(ds):
+    """Position of a slice along the scan axis, from its DICOM header"""
+    return _plane_position(ds.get("ImagePositionPatient"), ds.get("ImageOrientationPatient"),
+                           float(ds.get("InstanceNumber", 0) or 0))
+
+def _plane_position(position, orientation, fallback):
+    """Distance of an image plane along its normal, or along z without an orientation"""
+    if position is not None and orientation is not None:
+        normal = np.cross([float(v) for v in orientation[:3]], [float(v) for v in orientation[3:]])
+        return float(np.dot(normal, [float(v) for v in position]))
+    if position is not None:
+        return float(position[2])
+    return fallback
+
+def _rescale(ds):
+    """(slope, intercept) of a dataset or functional group, or None if it has none"""
+    if "RescaleSlope" not in ds and "RescaleIntercept" not in ds:
+        return None
+    return float(ds.get("RescaleSlope", 1) or 1), float(ds.get("RescaleIntercept", 0) or 0)
+
+def _functional_group(groups, name):
+    """The first item of a functional group macro, e.g. PlanePositionSequence, or None"""
+    sequence = groups.get(name) if groups is not None else None
+    return sequence[0] if sequence else None
+
+def _dicom_frames(ds):
+    """
+    List the slices a DICOM file holds
+
+    A classic file holds one slice. An enhanced (multi-frame) one holds
+    NumberOfFrames, each placed and rescaled by its per-frame functional
+    groups, falling back to the shared groups, then to the top-level
+    attributes; frames without a position keep their order in the file.
+
+    Returns:
+    --------
+    list of tuple
+        (frame index or None for a single-frame file, position along the
+        scan axis, (slope, intercept)) per slice
+    """
+    count = int(ds.get("NumberOfFrames", 1) or 1)
+    per_frame = ds.get("PerFrameFunctionalGroupsSequence") or []
+    if count == 1 and not per_frame:
+        return [(None, _slice_position(ds), _rescale(ds) or (1.0, 0.0))]
+
+    shared = _functional_group(ds, "SharedFunctionalGroupsSequence")
+    base = _slice_position(ds)
+    frames = []
+    for f in range(count):
+        groups = per_frame[f] if f < len(per_frame) else None
+        plane = _functional_group(groups, "PlanePositionSequence")
+        orientation = (_functional_group(groups, "PlaneOrientationSequence")
+                       or _functional_group(shared, "PlaneOrientationSequence"))
+        transform = (_functional_group(groups, "PixelValueTransformationSequence")
+                     or _functional_group(shared, "PixelValueTransformationSequence"))
+        position = _plane_position(
+            plane.get("ImagePositionPatient") if plane is not None else None,
+            (orientation.get("ImageOrientationPatient") if orientation is not None else None)
+            or ds.get("ImageOrientationPatient"),
+            base + f,
+        )
+        rescale = (_rescale(transform) if transform is not None else None) or _rescale(ds) or (1.0, 0.0)
+        frames.append((f if count > 1 else None, position, rescale))
+    return frames
+
+def _volume_dtype(slices):
+    """
+    Use int16 when every slice's Hounsfield units fit it exactly, float32 otherwise
+
+    Parameters:
+    -----------
+    slices : list of tuple
+        (header, (slope, intercept)) per slice
+    """
+    for ds, (slope, intercept) in slices:
+        bits = int(ds.get("BitsStored", 16))
+        if ds.get("PixelRepresentation", 0):
+            low, high = -(2 ** (bits - 1)), 2 ** (bits - 1) - 1
+        else:
+            low, high = 0, 2 ** bits - 1
+        if slope != 1 or not intercept.is_integer() or low + intercept < -32768 or high + intercept > 32767:
+            return np.dtype(np.float32)
+    return np.dtype(np.int16)
 
 def load_nifti_scan(file_path):
     """
     Load a NIfTI scan from a file
     
+    Compressed scans are served from the decompressed volume cache when
+    available. On a miss only the header is read here; get_scan_data
+    inflates the voxels progressively and stores them in the cache once
+    complete, so the next open is memory-mapped.
+    
     Parameters:
     -----------
     file_path : str
@@ -19,33 +626,154 @@ def load_nifti_scan(file_path):
     if not file_path:
         return None
         
+    import nibabel as nib
     try:
         img = nib.load(file_path)
+        if file_path.lower().endswith(".nii.gz"):
+            cached = open_cached_volume(file_path)
+            if cached is not None:
+                return nib.Nifti1Image(cached, img.affine, img.header)
         return img
     except Exception as e:
         add_notification(f"Error loading scan: {str(e)}", "error")
         return None
 
+def load_npz_scan(file_path, key=None):
+    """
+    Open a NumPy .npz scan lazily
+    
+    Parameters:
+    -----------
+    file_path : str
+        The path to the .npz file
+    key : str, optional
+        The name of the volume array, defaults to NPZ_VOLUME_KEY or auto-detection
+        
+    Returns:
+    --------
+    NpzScan or None
+        A lazy handle on the archive, or None if opening failed
+    """
+    if not file_path:
+        return None
+        
+    try:
+        scan = NpzScan(file_path, key)
+        # Resolve the volume key now so a bad archive is reported at load time
+        scan.volume_key
+        return scan
+    except Exception as e:
+        add_notification(f"Error loading scan: {str(e)}", "error")
+        return None
+
+def load_dicom_series(file_path):
+    """
+    Open a DICOM series lazily
+    
+    Parameters:
+    -----------
+    file_path : str
+        The path to a .dcm file, a .zip archive or a directory of DICOM files
+        
+    Returns:
+    --------
+    DicomSeries or None
+        A handle whose pixel data decodes in the background, or None if
+        no readable series was found
+    """
+    if not file_path:
+        return None
+        
+    try:
+        return DicomSeries(file_path)
+    except Exception as e:
+        add_notification(f"Error loading scan: {str(e)}", "error")
+        return None
+
+def load_scan(file_path):
+    """
+    Load a scan, choosing the loader from the file extension
+    
+    Parameters:
+    -----------
+    file_path : str
+        The path to a NIfTI, .npz, .dcm or .zip file, or a directory of DICOM files
+        
+    Returns:
+    --------
+    nibabel.Nifti1Image, NpzScan, DicomSeries or None
+        The loaded scan, or None if loading failed
+    """
+    if file_path and file_path.lower().endswith(".npz"):
+        return load_npz_scan(file_path)
+    if file_path and (file_path.lower().endswith((".dcm", ".zip")) or os.path.isdir(file_path)):
+        return load_dicom_series(file_path)
+    return load_nifti_scan(file_path)
+
+def stream_nifti(nifti_img):
+    """
+    Start inflating the voxels of a NIfTI image in the background
+    
+    Images opened from the volume cache are already memory-mapped and are
+    returned as they are; compressed images are added to the cache once
+    fully inflated.
+    
+    Parameters:
+    -----------
+    nifti_img : nibabel.Nifti1Image
+        An image loaded from a .nii or .nii.gz file
+        
+    Returns:
+    --------
+    numpy.ndarray or StreamedVolume
+        The memory-mapped volume, or a view that fills in slab by slab;
+        the stored dtype is kept unless the image is scaled, in which case
+        it is float32
+    """
+    dataobj = nifti_img.dataobj
+    if isinstance(dataobj, np.ndarray):
+        return dataobj
+    
+    file_path = nifti_img.get_filename()
+    # The proxy holds the effective scaling; the header fields are reset on load
+    slope, inter = dataobj.slope, dataobj.inter
+    scale = None if slope == 1.0 and inter == 0.0 else (float(slope), float(inter))
+    opener = gzip.open if file_path.lower().endswith(".gz") else open
+    
+    @contextmanager
+    def open_stream():
+        with opener(file_path, "rb") as f:
+            f.seek(dataobj.offset)
+            yield f
+    
+    on_loaded = (lambda data: cache_volume(file_path, data)) if file_path.lower().endswith(".gz") else None
+    return StreamedVolume(open_stream, dataobj.shape, dataobj.dtype, order=dataobj.order,
+                          scale=scale, description=file_path, on_loaded=on_loaded)
+
 def get_scan_data(nifti_img):
     """
     Extract data from a NIfTI image
     
     Parameters:
     -----------
-    nifti_img : nibabel.Nifti1Image
+    nifti_img : nibabel.Nifti1Image, NpzScan or DicomSeries
         The NIfTI image to extract data from
         
     Returns:
     --------
-    numpy.ndarray
-        The scan data as a numpy array
+    numpy.ndarray, StreamedVolume or DicomVolume
+        The scan data as a numpy array, or an array view that fills in as
+        the scan is inflated or decoded in the background
     """
     try:
-        scan_data = nifti_img.get_fdata()
+        if hasattr(nifti_img, "dataobj"):
+            scan_data = stream_nifti(nifti_img)
+        else:
+            scan_data = nifti_img.get_fdata()
         # Free memory
         del nifti_img
         gc.collect()
         return scan_data
     except Exception as e:
         add_notification(f"Error extracting scan data: {str(e)}", "error")
-        return None
\ No newline at end of file
+        return None
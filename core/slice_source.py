@@ -0,0 +1,627 @@
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from config import (
+    SLICE_CACHE_SIZE, SHARED_SLICE_CACHE, SLICE_PREFETCH_WORKERS, LOCAL_VOLUMES_MAX_BYTES,
+    SLICE_FRAME_WORKERS, SLICE_FRAME_IN_FLIGHT, SLICE_FRAME_VIEWERS, VOLUME_IDLE_SECONDS
+)
+from utils.metrics import metrics, timed
+from utils.shared_cache import slice_cache as shared_slice_cache
+
+logger = logging.getLogger(__name__)
+
+# Axis of the (x, y, z) volume each view slices along
+VIEW_AXES = {"sagittal": 0, "coronal": 1, "axial": 2}
+
+# Windowed slices shared by all sessions in the process, most recently used last
+_slice_cache = OrderedDict()
+_slice_cache_lock = threading.Lock()
+
+# Prefetches run on a small shared pool; keys in flight are not queued twice
+_prefetch_executor = ThreadPoolExecutor(max_workers=SLICE_PREFETCH_WORKERS, thread_name_prefix="slice-prefetch")
+_prefetching = set()
+_prefetch_lock = threading.Lock()
+
+# Per viewer, least recently used first: the frame it waits for, the request queued
+# behind its fetches in flight, and its prefetch generation. Each viewer has up to
+# SLICE_FRAME_IN_FLIGHT fetches in flight; a newer request replaces the queued one.
+_frame_executor = ThreadPoolExecutor(max_workers=SLICE_FRAME_WORKERS, thread_name_prefix="slice-frame")
+_viewers = OrderedDict()
+_viewers_lock = threading.Lock()
+
+# Volumes opened in this process, so any caller can find the local source of a scan
+_local_volumes = weakref.WeakValueDictionary()
+# Content keys of volumes read from a file, by scan ID, as (weak reference to the volume, key)
+_content_keys = {}
+
+# Volumes kept alive for sessions that hold only their scan ID, most recently used last,
+# and when each was last touched
+_held_volumes = OrderedDict()
+_held_touched = {}
+_held_lock = threading.Lock()
+
+# Idle held volumes are compressed, and compressed ones touched again restored, one at a time
+_swap_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="volume-swap")
+_swapping = set()
+# Held volumes whose voxels int16 cannot hold exactly, by scan ID, as weak references; never compressed
+_inexact = {}
+
+def get_cached_slice(key, shared=True):
+    """
+    Return a slice from the in-process cache, then the host-wide shared
+    cache, or None
+    """
+    with _slice_cache_lock:
+        slice_data = _slice_cache.get(key)
+        if slice_data is not None:
+            _slice_cache.move_to_end(key)
+            return slice_data
+
+    if shared and SHARED_SLICE_CACHE:
+        slice_data = shared_slice_cache.get(key)
+        if slice_data is not None:
+            _remember_slice(key, slice_data)
+    return slice_data
+
+def cache_slice(key, slice_data, shared=True):
+    """Store a slice in the in-process cache and, if shared, the host-wide cache"""
+    _remember_slice(key, slice_data)
+    if shared and SHARED_SLICE_CACHE:
+        shared_slice_cache.put(key, slice_data)
+
+def _remember_slice(key, slice_data):
+    with _slice_cache_lock:
+        _slice_cache[key] = slice_data
+        _slice_cache.move_to_end(key)
+        while len(_slice_cache) > SLICE_CACHE_SIZE:
+            _slice_cache.popitem(last=False)
+
+def clear_slice_cache():
+    """Drop all slices cached in this process; the shared cache is left alone"""
+    with _slice_cache_lock:
+        _slice_cache.clear()
+
+@lru_cache(maxsize=32)
+def _window_lut(dtype_str, window_center, window_width):
+    """Grey level for every value of a 8/16-bit integer dtype, indexed by its unsigned bit pattern"""
+    import numpy as np
+    dtype = np.dtype(dtype_str)
+    patterns = np.arange(2 ** (8 * dtype.itemsize), dtype=f"u{dtype.itemsize}")
+    return _window_float(patterns.view(dtype), window_center, window_width)
+
+def _window_float(img, window_center, window_width):
+    import numpy as np
+    low = window_center - window_width / 2
+    scaled = np.subtract(img, low, dtype=np.float32)
+    scaled *= 255 / max(window_width, 1)
+    np.clip(scaled, 0, 255, out=scaled)
+    return np.rint(scaled, out=scaled).astype(np.uint8)
+
+@timed("render.apply_window")
+def apply_window(img_data, window_center, window_width):
+    """
+    Apply windowing to an image
+
+    8- and 16-bit integer images (int16 Hounsfield units from DICOM or the
+    int16 transport) go through a lookup table built once per window, so
+    windowing is a single gather; anything else is scaled in float32.
+
+    Parameters:
+    -----------
+    img_data : numpy.ndarray
+        The image data in HU
+    window_center : int
+        The window center (HU)
+    window_width : int
+        The window width (HU)
+
+    Returns:
+    --------
+    numpy.ndarray
+        The windowed image as uint8 grey levels
+    """
+    import numpy as np
+    img_data = np.asarray(img_data)
+    if img_data.dtype.kind in "iu" and img_data.dtype.itemsize <= 2:
+        lut = _window_lut(img_data.dtype.str, float(window_center), float(window_width))
+        return lut[img_data.view(f"u{img_data.dtype.itemsize}")]
+    return _window_float(img_data, window_center, window_width)
+
+class SliceSource:
+    """
+    Where the viewer, reports and exports get windowed slices from
+
+    Every source hands out the same slice dicts (image, view, slice_idx,
+    window_center, window_width, format) through one cache, one prefetcher
+    and one set of timing spans. Subclasses only provide the dimensions, a
+    cache key and how to produce slices that are not cached yet.
+    """
+
+    # Whether slices also go to the host-wide shared cache
+    shared = True
+
+    def __init__(self, scan_id):
+        self.scan_id = scan_id
+
+    @property
+    def dims(self):
+        """Volume shape as (x, y, z), or None if unknown"""
+        raise NotImplementedError
+
+    def cache_key(self, view, slice_idx, window_center, window_width):
+        raise NotImplementedError
+
+    def _fetch(self, view, slice_indices, window_center, window_width):
+        """Produce uncached slices, as a dict of slice index to slice data"""
+        raise NotImplementedError
+
+    def slice_count(self, view):
+        """Number of slices along a view, 0 if the dimensions are unknown"""
+        dims = self.dims
+        axis = VIEW_AXES[view]
+        return int(dims[axis]) if dims and len(dims) > axis else 0
+
+    def loaded_slices(self, view):
+        """
+        Which slices along a view can be read without waiting
+
+        Returns:
+        --------
+        numpy.ndarray or None
+            A boolean mask over the view's slices, or None once every slice
+            can be read
+        """
+        return None
+
+    def _get(self, view, slice_indices, window_center, window_width):
+        slices = {}
+        missing = []
+        for idx in slice_indices:
+            cached = get_cached_slice(self.cache_key(view, idx, window_center, window_width), self.shared)
+            if cached is not None:
+                slices[idx] = cached
+            elif idx not in missing:
+                missing.append(idx)
+
+        if missing:
+            fetched = self._fetch(view, missing, window_center, window_width)
+            for idx, slice_data in fetched.items():
+                cache_slice(self.cache_key(view, idx, window_center, window_width), slice_data, self.shared)
+            slices.update(fetched)
+        return slices
+
+    @timed("source.get_slice")
+    def get_slice(self, view, slice_idx, window_center, window_width):
+        """
+        Get one windowed slice
+
+        Parameters:
+        -----------
+        view : str
+            'axial', 'sagittal' or 'coronal'
+        slice_idx : int
+            The slice index along the view
+        window_center : int
+            The window center (HU)
+        window_width : int
+            The window width (HU)
+
+        Returns:
+        --------
+        dict or None
+            The slice data, or None if it could not be loaded
+        """
+        return self._get(view, [int(slice_idx)], window_center, window_width).get(int(slice_idx))
+
+    @timed("source.get_slices")
+    def get_slices(self, view, slice_indices, window_center, window_width):
+        """
+        Get several slices of one view and window, producing uncached ones together
+
+        Returns:
+        --------
+        dict
+            Slice index to slice data; slices that failed to load are omitted
+        """
+        return self._get(view, [int(i) for i in slice_indices], window_center, window_width)
+
+    def request_slice(self, viewer, view, slice_idx, window_center, window_width):
+        """
+        Get the slice a viewer is to show next, in the background
+
+        Each viewer has up to SLICE_FRAME_IN_FLIGHT fetches in flight, and at
+        most one request queued behind them. Requesting a different slice or window supersedes
+        the previous request: a queued one is cancelled and never reaches the
+        backend, one in flight finishes into the cache but is no longer the
+        viewer's frame, and the viewer's prefetches that have not started
+        are dropped. Repeating the pending request shares its future, and
+        cached slices resolve at once. Cancelled and superseded requests are
+        counted in utils.metrics under source.frame.*.
+
+        Parameters:
+        -----------
+        viewer : hashable
+            Identifies the viewer, e.g. one per session
+        view : str
+            'axial', 'sagittal' or 'coronal'
+        slice_idx : int
+            The slice index along the view
+        window_center : int
+            The window center (HU)
+        window_width : int
+            The window width (HU)
+
+        Returns:
+        --------
+        concurrent.futures.Future
+            Resolves to the slice data, or None if it could not be loaded
+        """
+        key = self.cache_key(view, slice_idx, window_center, window_width)
+        cached = get_cached_slice(key, self.shared)
+        with _viewers_lock:
+            state = _viewer_state(viewer)
+            frame = state["frame"]
+            if state["key"] == key and frame is not None and not frame.cancelled():
+                return frame
+            if frame is not None and not frame.done():
+                metrics.count("source.frame.cancelled" if frame.cancel() else "source.frame.superseded")
+            state["generation"] += 1
+
+            frame = Future()
+            if cached is not None:
+                frame.set_result(cached)
+            else:
+                state["queued"] = (self, frame, (view, int(slice_idx), window_center, window_width))
+                if state["fetching"] < SLICE_FRAME_IN_FLIGHT:
+                    state["fetching"] += 1
+                    _frame_executor.submit(_fetch_frames, state)
+            state.update(key=key, frame=frame)
+            return frame
+
+    def prefetch(self, view, slice_indices, window_center, window_width, viewer=None):
+        """
+        Warm the cache with slices likely to be viewed next, without waiting
+
+        Slices already in the in-process cache or being prefetched are skipped,
+        and indices outside the volume or not loaded yet are ignored. With a
+        viewer, the prefetch is dropped if the viewer has requested another
+        frame by the time it starts, so a fast drag does not queue up the
+        neighbours of every slice it passes.
+        """
+        count = self.slice_count(view)
+        loaded = self.loaded_slices(view)
+        keys = {}
+        with _slice_cache_lock:
+            for idx in slice_indices:
+                if not 0 <= idx < count or (loaded is not None and not loaded[idx]):
+                    continue
+                key = self.cache_key(view, idx, window_center, window_width)
+                if key not in _slice_cache:
+                    keys[int(idx)] = key
+        with _prefetch_lock:
+            keys = {idx: key for idx, key in keys.items() if key not in _prefetching}
+            _prefetching.update(keys.values())
+        generation = None
+        if viewer is not None:
+            with _viewers_lock:
+                generation = _viewer_state(viewer)["generation"]
+        if keys:
+            _prefetch_executor.submit(self._prefetch, view, keys, window_center, window_width, viewer, generation)
+
+    def _prefetch(self, view, keys, window_center, window_width, viewer=None, generation=None):
+        try:
+            if viewer is not None:
+                with _viewers_lock:
+                    stale = _viewers.get(viewer, {}).get("generation") != generation
+                if stale:
+                    metrics.count("source.prefetch.dropped")
+                    return
+            with timed("source.prefetch"):
+                self._get(view, list(keys), window_center, window_width)
+        except Exception as e:
+            logger.warning(f"Prefetch of {self.scan_id} {view} slices failed: {str(e)}")
+        finally:
+            with _prefetch_lock:
+                _prefetching.difference_update(keys.values())
+
+def _viewer_state(viewer):
+    # Called with _viewers_lock held
+    state = _viewers.get(viewer)
+    if state is None:
+        state = _viewers[viewer] = {"key": None, "frame": None, "queued": None, "fetching": 0, "generation": 0}
+    _viewers.move_to_end(viewer)
+    while len(_viewers) > SLICE_FRAME_VIEWERS:
+        _viewers.popitem(last=False)
+    return state
+
+def _fetch_frames(state):
+    """Fetch a viewer's queued frames one at a time, skipping those superseded before they start"""
+    while True:
+        with _viewers_lock:
+            queued, state["queued"] = state["queued"], None
+            if queued is None:
+                state["fetching"] -= 1
+                return
+        source, frame, args = queued
+        if not frame.set_running_or_notify_cancel():
+            continue
+        try:
+            frame.set_result(source.get_slice(*args))
+        except Exception as e:
+            frame.set_exception(e)
+
+class LocalSliceSource(SliceSource):
+    """
+    Slices cut from a volume held in this process
+
+    Works with anything indexable like a numpy array: in-memory arrays,
+    memory maps from the volume cache and .npz scans, and DICOM volumes that
+    are still decoding. Volumes read from a file are keyed by the file's
+    content hash, so their windowed slices also go to the host-wide shared
+    cache and other sessions and workers viewing the same file reuse them.
+    Volumes without one stay in the in-process cache only.
+    """
+
+    def __init__(self, scan_id, volume, content_key=None):
+        super().__init__(scan_id)
+        self.volume = volume
+        self.content_key = content_key
+        self.shared = content_key is not None
+
+    @property
+    def dims(self):
+        return tuple(self.volume.shape)
+
+    def cache_key(self, view, slice_idx, window_center, window_width):
+        if self.content_key is not None:
+            return ("local", self.content_key, view, int(slice_idx), float(window_center), float(window_width))
+        # The volume's identity keeps a re-uploaded scan from hitting stale slices
+        return ("local", self.scan_id, id(self.volume), view, int(slice_idx),
+                float(window_center), float(window_width))
+
+    def loaded_slices(self, view):
+        # Volumes still loading in the background (DicomVolume, StreamedVolume) report their progress
+        import numpy as np
+        loaded_slices = getattr(self.volume, "loaded_slices", None)
+        if loaded_slices is None:
+            return None
+        loaded = loaded_slices()
+        if loaded.all():
+            return None
+        if VIEW_AXES[view] == self.volume.scan_axis:
+            return loaded
+        # Any other view cuts through every slice along the scan axis
+        return np.zeros(self.slice_count(view), dtype=bool)
+
+    def plane(self, view, slice_idx):
+        """The raw slice in HU, oriented for display"""
+        import numpy as np
+        if view == "axial":
+            plane = self.volume[:, :, slice_idx]
+        elif view == "sagittal":
+            plane = self.volume[slice_idx, :, :]
+        else:
+            plane = self.volume[:, slice_idx, :]
+        return np.asarray(plane).T
+
+    def _fetch(self, view, slice_indices, window_center, window_width):
+        count = self.slice_count(view)
+        return {
+            idx: {
+                "view": view,
+                "slice_idx": idx,
+                "window_center": float(window_center),
+                "window_width": float(window_width),
+                "format": "local",
+                "image": apply_window(self.plane(view, idx), window_center, window_width),
+            }
+            for idx in slice_indices if 0 <= idx < count
+        }
+
+class RemoteSliceSource(SliceSource):
+    """Slices rendered by the backend and fetched through api.client"""
+
+    def __init__(self, scan_id, metadata=None):
+        super().__init__(scan_id)
+        self._metadata = metadata
+
+    @property
+    def dims(self):
+        if self._metadata is None:
+            from api.client import get_scan_metadata
+            self._metadata = get_scan_metadata(self.scan_id) or {}
+        return self._metadata.get("dimensions")
+
+    def cache_key(self, view, slice_idx, window_center, window_width):
+        from api import client
+        return (client.API_URL, client.SLICE_TRANSPORT, self.scan_id, view, int(slice_idx),
+                float(window_center), float(window_width))
+
+    def _fetch(self, view, slice_indices, window_center, window_width):
+        from api.client import fetch_scan_slice, fetch_scan_slices
+        if len(slice_indices) == 1:
+            # Single slices go through the hedged /slice endpoint
+            slice_data = fetch_scan_slice(self.scan_id, view, slice_indices[0], window_center, window_width)
+            return {slice_indices[0]: slice_data} if slice_data else {}
+        return fetch_scan_slices(self.scan_id, view, slice_indices, window_center, window_width)
+
+def register_volume(scan_id, volume, content_key=None):
+    """
+    Make a volume loaded in this process the slice source for its scan,
+    and start counting its HU histograms for the auto window
+
+    Parameters:
+    -----------
+    scan_id : str
+        The scan identifier
+    volume : array-like
+        The scan in HU, shaped (x, y, z)
+    content_key : str, optional
+        The content hash of the file the volume was read from
+        (core.volume_cache.scan_cache_key); lets its slices be shared
+        across processes
+    """
+    from core.histogram import schedule_histogram
+    _local_volumes[scan_id] = volume
+    with _held_lock:
+        if content_key is not None:
+            _content_keys[scan_id] = (weakref.ref(volume), content_key)
+        elif _content_key(scan_id, volume) is None:
+            _content_keys.pop(scan_id, None)
+    schedule_histogram(volume)
+
+def _content_key(scan_id, volume):
+    entry = _content_keys.get(scan_id)
+    return entry[1] if entry is not None and entry[0]() is volume else None
+
+def resident_bytes(volume):
+    """Memory a volume occupies in this process; memory maps are backed by their files and count as nothing"""
+    import numpy as np
+    if isinstance(volume, np.memmap):
+        return 0
+    return int(getattr(volume, "nbytes", 0))
+
+def hold_volume(scan_id, volume, content_key=None):
+    """
+    Register a volume and keep it alive in this process
+
+    Held volumes are shared by every session viewing the scan and are
+    released, least recently used first, once they take more than
+    LOCAL_VOLUMES_MAX_BYTES; the most recent one is always kept.
+
+    Holding a volume also touches it. Volumes nobody has touched for
+    VOLUME_IDLE_SECONDS are swapped in the background for a
+    core.volume_cache.CompressedVolume (see compress_idle_volumes), so
+    studies left open take a fraction of their memory and more of them fit;
+    touching a compressed volume restores it to a plain array of its
+    original dtype in the background, and its slices are read slab by slab
+    meanwhile. Swaps are counted in utils.metrics under volume.compressed
+    and volume.restored.
+    """
+    from core.volume_cache import CompressedVolume
+    register_volume(scan_id, volume, content_key)
+    with _held_lock:
+        _held_volumes[scan_id] = volume
+        _held_volumes.move_to_end(scan_id)
+        _held_touched[scan_id] = time.monotonic()
+        total = sum(resident_bytes(held) for held in _held_volumes.values())
+        while total > LOCAL_VOLUMES_MAX_BYTES and len(_held_volumes) > 1:
+            released_id, released = _held_volumes.popitem(last=False)
+            _held_touched.pop(released_id, None)
+            _inexact.pop(released_id, None)
+            total -= resident_bytes(released)
+            logger.info(f"Released the in-memory volume of {released_id}")
+
+        restore = isinstance(volume, CompressedVolume) and scan_id not in _swapping
+        if restore:
+            _swapping.add(scan_id)
+    if restore:
+        _swap_executor.submit(_swap_held, scan_id, volume)
+    compress_idle_volumes()
+
+def compress_idle_volumes():
+    """
+    Compress, in the background, the held volumes nobody has touched for VOLUME_IDLE_SECONDS
+
+    Run whenever a volume is held and on every page run (from
+    utils.session.enforce_session_budget), so a study left open is
+    compressed even if no other scan is opened after it. Only volumes whose
+    voxels int16 holds exactly are compressed; others stay as they are.
+    """
+    now = time.monotonic()
+    with _held_lock:
+        swaps = [(held_id, held) for held_id, held in _held_volumes.items()
+                 if held_id not in _swapping and now - _held_touched[held_id] > VOLUME_IDLE_SECONDS
+                 and _compressible(held_id, held)]
+        _swapping.update(held_id for held_id, _ in swaps)
+    for held_id, held in swaps:
+        _swap_executor.submit(_swap_held, held_id, held)
+
+def _compressible(scan_id, volume):
+    """
+    Whether a held volume is a fully loaded one taking memory, rather than a
+    memory map, already compressed, or found not to fit int16 exactly
+    """
+    from core.volume_cache import CompressedVolume
+    if isinstance(volume, CompressedVolume) or getattr(volume, "ndim", 0) != 3 or not resident_bytes(volume):
+        return False
+    inexact = _inexact.get(scan_id)
+    if inexact is not None and inexact() is volume:
+        return False
+    loaded_slices = getattr(volume, "loaded_slices", None)
+    return loaded_slices is None or bool(loaded_slices().all())
+
+def _swap_held(scan_id, volume):
+    """Compress an idle held volume, or restore a compressed one touched again, and hold the result instead"""
+    from core.histogram import share_histogram
+    from core.masks import share_masks
+    from core.volume_cache import CompressedVolume, compress_volume
+    try:
+        restoring = isinstance(volume, CompressedVolume)
+        try:
+            swapped = volume.decompress() if restoring else compress_volume(volume, exact=True)
+        except ValueError as e:
+            # Rounding would change the voxels; keep the volume as it is
+            with _held_lock:
+                _inexact[scan_id] = weakref.ref(volume)
+            logger.info(f"Keeping the in-memory volume of {scan_id} uncompressed: {str(e)}")
+            return
+        # The copy has the same voxels, so it keeps the histograms and masks already computed
+        share_histogram(volume, swapped)
+        share_masks(volume, swapped)
+        with _held_lock:
+            if _held_volumes.get(scan_id) is not volume:
+                return  # Released or replaced meanwhile
+            if not restoring and time.monotonic() - _held_touched[scan_id] <= VOLUME_IDLE_SECONDS:
+                return  # Touched again while it was being compressed
+            _held_volumes[scan_id] = swapped
+            _local_volumes[scan_id] = swapped
+            content_key = _content_key(scan_id, volume)
+            if content_key is not None:
+                _content_keys[scan_id] = (weakref.ref(swapped), content_key)
+        metrics.count("volume.restored" if restoring else "volume.compressed")
+        logger.info(f"{'Restored' if restoring else 'Compressed'} the in-memory volume of {scan_id} "
+                    f"({resident_bytes(volume) / 1024 ** 2:.1f} MB -> {resident_bytes(swapped) / 1024 ** 2:.1f} MB)")
+    except Exception as e:
+        logger.error(f"Error swapping the in-memory volume of {scan_id}: {str(e)}")
+    finally:
+        with _held_lock:
+            _swapping.discard(scan_id)
+
+def local_volume(scan_id):
+    """Return the volume of a scan loaded in this process, or None"""
+    return _local_volumes.get(scan_id)
+
+def slice_source_for(scan_id, volume=None, metadata=None):
+    """
+    Return the slice source for a scan
+
+    Parameters:
+    -----------
+    scan_id : str
+        The scan identifier
+    volume : array-like, optional
+        The scan volume when it is loaded locally; it is registered so later
+        lookups by scan ID alone also read it
+    metadata : dict, optional
+        Backend metadata with the scan's dimensions, if already known
+
+    Returns:
+    --------
+    SliceSource
+        A LocalSliceSource for volumes loaded in this process, otherwise a
+        RemoteSliceSource
+    """
+    if volume is not None:
+        register_volume(scan_id, volume)
+    else:
+        volume = _local_volumes.get(scan_id)
+    if volume is not None:
+        with _held_lock:
+            content_key = _content_key(scan_id, volume)
+        return LocalSliceSource(scan_id, volume, content_key)
+    return RemoteSliceSource(scan_id, metadata)
@@ -0,0 +1,335 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+from config import (
+    VOLUME_CACHE_DIR, VOLUME_CACHE_MAX_BYTES, SCAN_HASH_MEMO_ENTRIES,
+    COMPRESSED_VOLUME_CODEC, COMPRESSED_SLAB_SLICES, COMPRESSED_SLAB_CACHE
+)
+from utils.file_handler import compute_file_hash
+from utils.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=SCAN_HASH_MEMO_ENTRIES)
+def _memoized_hash(real_path, size, mtime_ns):
+    # size and mtime are part of the key, so a rewritten file is hashed again
+    return compute_file_hash(real_path)
+
+def scan_cache_key(file_path):
+    """
+    Return the content hash used to key a scan in the cache
+
+    Parameters:
+    -----------
+    file_path : str
+        The path to the scan file
+
+    Returns:
+    --------
+    str
+        The SHA-256 hex digest of the file
+    """
+    stat = os.stat(file_path)
+    return _memoized_hash(os.path.realpath(file_path), stat.st_size, stat.st_mtime_ns)
+
+def _cache_path(key):
+    return os.path.join(VOLUME_CACHE_DIR, f"{key}.npy")
+
+def open_cached_volume(file_path):
+    """
+    Open the decompressed copy of a scan if it has been cached
+
+    Parameters:
+    -----------
+    file_path : str
+        The path to the original scan file
+
+    Returns:
+    --------
+    numpy.memmap or None
+        A read-only memory map of the volume, or None on a cache miss
+    """
+    path = _cache_path(scan_cache_key(file_path))
+    try:
+        volume = np.load(path, mmap_mode="r")
+    except (FileNotFoundError, ValueError):
+        return None
+    # Bump the modification time, which doubles as the LRU clock
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return volume
+
+def cache_volume(file_path, volume):
+    """
+    Store a volume that has already been inflated in the cache
+
+    Used by the progressive loader, so a scan read once is not inflated a
+    second time just to fill the cache.
+
+    Parameters:
+    -----------
+    file_path : str
+        The path to the original scan file
+    volume : numpy.ndarray
+        The voxels in Fortran order, so every axial slice is a contiguous
+        run of bytes that can be memory-mapped on its own
+
+    Returns:
+    --------
+    str
+        The path to the cached .npy file
+    """
+    dest = _cache_path(scan_cache_key(file_path))
+    if os.path.exists(dest):
+        os.utime(dest)
+        return dest
+
+    tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            np.save(f, volume)
+        os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    logger.info(f"Cached decompressed volume for {file_path}")
+    enforce_cache_limit()
+    return dest
+
+def enforce_cache_limit(max_bytes=VOLUME_CACHE_MAX_BYTES):
+    """
+    Delete least recently used cache files until the cache fits in max_bytes
+
+    Parameters:
+    -----------
+    max_bytes : int
+        The size limit for the cache directory
+    """
+    entries = []
+    for entry in os.scandir(VOLUME_CACHE_DIR):
+        if entry.name.endswith(".npy"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except FileNotFoundError:
+            pass
+
+def slab_codec(name=COMPRESSED_VOLUME_CODEC):
+    """
+    Return the compress and decompress functions of a slab codec
+
+    zstd and lz4 are optional dependencies; without them slabs fall back to
+    zlib, which is slower but always available.
+
+    Parameters:
+    -----------
+    name : str
+        'zstd', 'lz4' or 'zlib'
+
+    Returns:
+    --------
+    tuple
+        (name, compress, decompress) of the codec actually used
+    """
+    if name == "zstd":
+        try:
+            import zstandard
+            # Compressor objects are not thread-safe, so each call gets its own
+            return ("zstd", lambda data: zstandard.ZstdCompressor(level=1).compress(data),
+                    lambda data: zstandard.ZstdDecompressor().decompress(data))
+        except ImportError:
+            logger.warning("zstandard is not installed, compressing volumes with zlib")
+    elif name == "lz4":
+        try:
+            import lz4.frame
+            return "lz4", lz4.frame.compress, lz4.frame.decompress
+        except ImportError:
+            logger.warning("lz4 is not installed, compressing volumes with zlib")
+    elif name != "zlib":
+        logger.warning(f"Unknown volume codec {name!r}, compressing volumes with zlib")
+    import zlib
+    return "zlib", lambda data: zlib.compress(data, 1), zlib.decompress
+
+def _to_int16(slab):
+    """Whole HU as int16, rounding floats and clipping anything out of range"""
+    if slab.dtype == np.int16:
+        return slab
+    if slab.dtype.kind == "f":
+        slab = np.rint(slab)
+    return np.clip(slab, -32768, 32767).astype(np.int16)
+
+class CompressedVolume:
+    """
+    An int16 volume held compressed, one slab of axial slices at a time
+
+    Each slab is stored with its axial slices contiguous and its bytes
+    shuffled (all low bytes, then all high bytes), which CT compresses far
+    better than interleaved int16. Indexing like a numpy array decompresses
+    only the slabs the index touches, keeping the last COMPRESSED_SLAB_CACHE
+    of them, so paging through axial slices costs one slab per
+    COMPRESSED_SLAB_SLICES slices. Sagittal and coronal planes need every
+    slab.
+    """
+
+    def __init__(self, slabs, shape, codec, slab_slices, source_dtype=np.int16):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(np.int16)
+        self.source_dtype = np.dtype(source_dtype)
+        self.ndim = len(self.shape)
+        self.slab_slices = slab_slices
+        self.codec, _, self._decompress = slab_codec(codec)
+        self._slabs = slabs
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def compressed_bytes(self):
+        return sum(len(slab) for slab in self._slabs)
+
+    @property
+    def nbytes(self):
+        """Memory held: the compressed slabs plus the decompressed ones cached"""
+        with self._lock:
+            cached = sum(slab.nbytes for slab in self._cache.values())
+        return self.compressed_bytes + cached
+
+    def _inflate(self, slab_idx):
+        nx, ny, nz = self.shape
+        dz = min(self.slab_slices, nz - slab_idx * self.slab_slices)
+        with timed("volume_cache.decompress_slab"):
+            shuffled = np.frombuffer(self._decompress(self._slabs[slab_idx]), dtype=np.uint8)
+        # Undo the byte shuffle, then view the (z, x, y) slab as (x, y, z)
+        slab = np.ascontiguousarray(shuffled.reshape(2, -1).T).view(np.int16)
+        return slab.reshape(dz, nx, ny).transpose(1, 2, 0)
+
+    def _slab(self, slab_idx):
+        with self._lock:
+            slab = self._cache.get(slab_idx)
+            if slab is not None:
+                self._cache.move_to_end(slab_idx)
+                return slab
+        slab = self._inflate(slab_idx)
+        with self._lock:
+            self._cache[slab_idx] = slab
+            while len(self._cache) > COMPRESSED_SLAB_CACHE:
+                self._cache.popitem(last=False)
+        return slab
+
+    def __getitem__(self, key):
+        index = key if isinstance(key, tuple) else (key,)
+        if len(index) > 3 or not all(isinstance(k, (slice, int, np.integer)) for k in index):
+            # Fancy indexing and the like read the whole volume
+            return np.asarray(self)[key]
+        kx, ky, kz = index + (slice(None),) * (3 - len(index))
+
+        nz = self.shape[2]
+        if isinstance(kz, slice):
+            zs = range(*kz.indices(nz))
+        else:
+            z = int(kz) + nz if kz < 0 else int(kz)
+            if not 0 <= z < nz:
+                raise IndexError(f"index {kz} is out of bounds for axis 2 with size {nz}")
+            zs = [z]
+
+        pieces = []
+        start = 0
+        while start < len(zs):
+            # Run of requested slices within one slab
+            slab_idx = zs[start] // self.slab_slices
+            stop = start
+            while stop < len(zs) and zs[stop] // self.slab_slices == slab_idx:
+                stop += 1
+            offsets = [z - slab_idx * self.slab_slices for z in zs[start:stop]]
+            plane = self._slab(slab_idx)[kx, ky]
+            if offsets == list(range(offsets[0], offsets[-1] + 1)):
+                pieces.append(plane[..., offsets[0]:offsets[-1] + 1])
+            else:
+                pieces.append(plane[..., offsets])
+            start = stop
+
+        if not pieces:
+            return self._slab(0)[kx, ky][..., :0]
+        if not isinstance(kz, slice):
+            return pieces[0][..., 0]
+        return pieces[0] if len(pieces) == 1 else np.concatenate(pieces, axis=-1)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.decompress() if dtype is None else self.decompress().astype(dtype, copy=False)
+
+    @timed("volume_cache.decompress")
+    def decompress(self):
+        """
+        Return the whole volume in the dtype it was compressed from
+
+        Returns:
+        --------
+        numpy.ndarray
+            The voxels in Fortran order, so axial slices stay contiguous
+        """
+        out = np.empty(self.shape, dtype=np.int16, order="F")
+        for slab_idx in range(len(self._slabs)):
+            z0 = slab_idx * self.slab_slices
+            # Straight into the output, without churning the slab cache
+            slab = self._inflate(slab_idx)
+            out[:, :, z0:z0 + slab.shape[2]] = slab
+        return out.astype(self.source_dtype, order="F", copy=False)
+
+@timed("volume_cache.compress")
+def compress_volume(volume, codec=COMPRESSED_VOLUME_CODEC, slab_slices=COMPRESSED_SLAB_SLICES, exact=False):
+    """
+    Downcast a volume to int16 and compress it one slab of axial slices at a time
+
+    Floats are rounded to whole HU, which is lossless for scans stored as
+    integers and below what any window can show for scaled ones. The volume's
+    dtype is recorded, so decompressing returns it as the dtype it came in.
+
+    Parameters:
+    -----------
+    volume : array-like
+        The scan in HU, shaped (x, y, z)
+    codec : str
+        'zstd', 'lz4' or 'zlib', see slab_codec
+    slab_slices : int
+        Axial slices per compressed slab
+    exact : bool
+        Raise ValueError rather than round or clip a volume whose voxels are
+        not all whole numbers within the int16 range
+
+    Returns:
+    --------
+    CompressedVolume
+        The compressed volume
+    """
+    codec, compress, _ = slab_codec(codec)
+    slabs = []
+    source_dtype = np.int16
+    for z0 in range(0, volume.shape[2], slab_slices):
+        voxels = np.asarray(volume[:, :, z0:z0 + slab_slices])
+        source_dtype = voxels.dtype
+        hu = _to_int16(voxels)
+        if exact and hu is not voxels and not np.array_equal(hu, voxels):
+            raise ValueError(f"Voxels of {voxels.dtype} are not all whole numbers within the int16 range")
+        # (z, x, y) so axial slices are contiguous, then low bytes before high bytes
+        planes = np.ascontiguousarray(hu.transpose(2, 0, 1))
+        slabs.append(compress(np.ascontiguousarray(planes.view(np.uint8).reshape(-1, 2).T)))
+    return CompressedVolume(slabs, volume.shape, codec, slab_slices, source_dtype)
@@ -0,0 +1,44 @@
+import os
+from multiprocessing import Process
+
+from utils.app_state import AppStateStore
+
+def append_reports(path, worker, count):
+    # A small journal limit, so compactions race the other workers' appends
+    store = AppStateStore(path, compact_bytes=2048)
+    for i in range(count):
+        store.record("report", scan_id=f"worker_{worker}_{i}", report=f"{i:064x}")
+
+def test_concurrent_writers_keep_every_record(tmp_path):
+    path = str(tmp_path / "app_state.json")
+    workers = [Process(target=append_reports, args=(path, w, 100)) for w in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    reports = AppStateStore(path).load()["reports"]
+    assert reports == {f"worker_{w}_{i}": f"{i:064x}" for w in range(4) for i in range(100)}
+    assert os.path.exists(path)  # At least one compaction happened
+
+def test_compaction_keeps_state_and_empties_journal(tmp_path):
+    store = AppStateStore(str(tmp_path / "app_state.json"), compact_bytes=10 ** 6)
+    store.record("scan", scan={"scan_id": "a", "filename": "a.nii.gz"})
+    store.record("report", scan_id="a", report="digest")
+    store.record("findings", scan_id="a", findings={"pe_present": True})
+    store.record("current", scan_id="a")
+    before = store.load()
+
+    store.compact()
+    assert os.path.getsize(store.journal_path) == 0
+    assert store.load() == before
+    assert before["findings"] == {"a": {"pe_present": True}} and before["current_scan"] == "a"
+
+def test_partial_and_corrupt_journal_records_are_skipped(tmp_path):
+    store = AppStateStore(str(tmp_path / "app_state.json"))
+    store.record("report", scan_id="a", report="digest")
+    with open(store.journal_path, "a") as f:
+        f.write('{"op": "report", "scan_id": "b"}\n')  # Missing its report
+        f.write('{"op": "report", "scan_id": "c", "rep')  # Cut short by a crash
+    assert store.load()["reports"] == {"a": "digest"}
@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+import pytest
+
+pydicom = pytest.importorskip("pydicom")
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import CTImageStorage, EnhancedCTImageStorage, ExplicitVRLittleEndian, generate_uid
+
+from core.scan_loader import DicomSeries
+
+ORIENTATION = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0]
+
+def ct_dataset(sop_class, rows, columns):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = sop_class
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = sop_class
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.SeriesInstanceUID = "1.2.3"
+    ds.Modality = "CT"
+    ds.Rows, ds.Columns = rows, columns
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit = 16, 12, 11
+    ds.PixelRepresentation = 0
+    return ds
+
+def dataset(**attributes):
+    item = Dataset()
+    for keyword, value in attributes.items():
+        setattr(item, keyword, value)
+    return item
+
+@pytest.fixture
+def volume():
+    """Hounsfield units shaped (x, y, z), distinct in every slice"""
+    return (np.arange(8 * 6 * 5).reshape(8, 6, 5) - 1024).astype(np.int16)
+
+def test_series_of_single_frame_files(tmp_path, volume):
+    # Written in reverse so the loader has to order the slices by position
+    for z in reversed(range(volume.shape[2])):
+        ds = ct_dataset(CTImageStorage, volume.shape[1], volume.shape[0])
+        ds.ImagePositionPatient = [0.0, 0.0, 2.5 * z]
+        ds.ImageOrientationPatient = ORIENTATION
+        ds.RescaleSlope, ds.RescaleIntercept = 1, -1024
+        ds.PixelData = (volume[:, :, z].T + 1024).astype(np.uint16).tobytes()
+        ds.save_as(os.path.join(tmp_path, f"{4 - z}.dcm"), enforce_file_format=True)
+
+    data = DicomSeries(str(tmp_path)).get_fdata()
+    assert data.shape == volume.shape and data.dtype == np.int16
+    assert np.array_equal(np.asarray(data), volume)
+
+def test_multi_frame_file_is_expanded_into_slices(tmp_path, volume):
+    frames = volume.shape[2]
+    ds = ct_dataset(EnhancedCTImageStorage, volume.shape[1], volume.shape[0])
+    ds.NumberOfFrames = frames
+    ds.SharedFunctionalGroupsSequence = [dataset(
+        PlaneOrientationSequence=[dataset(ImageOrientationPatient=ORIENTATION)],
+        PixelValueTransformationSequence=[dataset(RescaleSlope=1, RescaleIntercept=-1024, RescaleType="HU")],
+    )]
+    # Frames stored top to bottom; their positions put them back in order
+    order = list(reversed(range(frames)))
+    ds.PerFrameFunctionalGroupsSequence = [
+        dataset(PlanePositionSequence=[dataset(ImagePositionPatient=[0.0, 0.0, 2.5 * z])]) for z in order
+    ]
+    ds.PixelData = np.stack([volume[:, :, z].T + 1024 for z in order]).astype(np.uint16).tobytes()
+    path = os.path.join(tmp_path, "enhanced.dcm")
+    ds.save_as(path, enforce_file_format=True)
+
+    data = DicomSeries(path).get_fdata()
+    assert data.shape == volume.shape and data.dtype == np.int16
+    assert np.array_equal(data[:, :, 2], volume[:, :, 2])
+    assert np.array_equal(np.asarray(data), volume)
+    assert data.loaded_slices().all()
@@ -0,0 +1,62 @@
+import itertools
+
+import pytest
+
+from core.findings import Findings, FindingsStore, CLOT_BURDEN_LEVELS, FINDINGS_SOURCE_LOCAL
+from core.report_generator import generate_ctpa_report, generate_fallback_report
+
+@pytest.mark.parametrize("report, pe_present", [
+    ("There is no acute pulmonary embolism.", False),
+    ("Negative for pulmonary embolism", False),
+    ("No pulmonary embolism.", False),
+    ("Pulmonary embolism is ruled out.", False),
+    ("Acute pulmonary embolism in the right lower lobe segmental pulmonary artery. "
+     "No filling defects in the left pulmonary arteries.", True),
+    ("Filling defect in the right lower lobe pulmonary artery. No filling defect on the left.", True),
+    ("No filling defect on the left, but an embolus in the right lower lobe pulmonary artery.", True),
+    # Contradictory or non-committal reports are left unassessed
+    ("No pulmonary embolism. Filling defect in the right lower lobe pulmonary artery.", None),
+    ("Clinical indication: suspected pulmonary embolism.", None),
+    ("Pulmonary embolism cannot be excluded on this non-diagnostic study.", None),
+    ("", None),
+])
+def test_pe_status(report, pe_present):
+    assert Findings.from_report_html(f"<p>{report}</p>").pe_present is pe_present
+
+def test_positive_report_details():
+    findings = Findings.from_report_html(
+        "<ul><li>Acute pulmonary embolism in the right lower lobe segmental pulmonary artery</li>"
+        "<li>No filling defects in the left pulmonary arteries</li>"
+        "<li>No evidence of right heart strain</li></ul>"
+    )
+    assert findings == Findings(pe_present=True, location="right lower lobe segmental pulmonary artery",
+                                rv_strain=False, clot_burden="segmental")
+
+@pytest.mark.parametrize("pe_present, rv_strain, clot_burden", [
+    (pe_present, rv_strain, clot_burden)
+    for pe_present, rv_strain, clot_burden in itertools.product((True, False), (True, False, None),
+                                                                (None,) + CLOT_BURDEN_LEVELS)
+    if pe_present or (rv_strain is None and clot_burden is None)
+])
+def test_generated_reports_round_trip(pe_present, rv_strain, clot_burden):
+    location = "left lower lobe pulmonary artery" if pe_present else None
+    findings = Findings(pe_present=pe_present, location=location, rv_strain=rv_strain, clot_burden=clot_burden)
+    html = generate_ctpa_report({"scan_id": "scan", "filename": "scan.nii.gz"}, findings, "January 1, 2026")
+    assert Findings.from_report_html(html) == findings
+
+def test_fallback_report_is_unassessed():
+    assert Findings.from_report_html(generate_fallback_report("scan")).pe_present is None
+
+def test_strain_not_mentioned_is_unassessed():
+    findings = Findings.from_report_html("<p>Acute pulmonary embolism in the right main pulmonary artery.</p>")
+    assert findings.pe_present is True and findings.rv_strain is None
+    findings = Findings.from_report_html("<p>Embolus in the left lower lobe pulmonary artery. "
+                                         "Right heart strain was not assessed.</p>")
+    assert findings.rv_strain is None
+
+def test_local_findings_are_kept_apart():
+    store = FindingsStore()
+    store.put("backend", Findings(pe_present=False))
+    store.put("local", Findings(pe_present=False, source=FINDINGS_SOURCE_LOCAL))
+    assert store.query(pe_present=False, source="backend") == {"backend"}
+    assert store.query(source=FINDINGS_SOURCE_LOCAL) == {"local"}
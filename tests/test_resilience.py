@@ -0,0 +1,60 @@
+import pytest
+
+from api import resilience
+from api.resilience import CircuitBreaker, CircuitOpenError
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    return now
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        assert breaker.before_call() is False
+        breaker.record_failure()
+    assert breaker.state == "open"
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30)
+    open_breaker(breaker)
+    clock[0] += 30
+    assert breaker.state == "half_open"
+    assert breaker.before_call() is True
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    breaker.release_probe(True)
+    assert breaker.state == "closed" and breaker.before_call() is False
+
+def test_failed_probe_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30)
+    open_breaker(breaker)
+    clock[0] += 30
+    probe = breaker.before_call()
+    breaker.record_failure()
+    breaker.release_probe(probe)
+    assert breaker.state == "open"
+    clock[0] += 30
+    assert breaker.before_call() is True
+
+def test_released_probe_is_not_stuck(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30)
+    open_breaker(breaker)
+    clock[0] += 30
+    probe = breaker.before_call()
+    # The probe ended in an exception that recorded neither outcome
+    breaker.release_probe(probe)
+    assert breaker.before_call() is True
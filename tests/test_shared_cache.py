@@ -0,0 +1,22 @@
+import hashlib
+
+from utils.shared_cache import ChatStore, ReportStore
+
+def test_report_store_keeps_reports_evicted_from_memory(tmp_path):
+    store = ReportStore(directory=str(tmp_path), memory_bytes=100)
+    reports = [f"<p>Report {i} {'x' * 60}</p>" for i in range(5)]
+    digests = [hashlib.sha256(report.encode()).hexdigest() for report in reports]
+    for digest, report in zip(digests, reports):
+        store.put(digest, report)
+    assert len(store._memory) == 1
+    assert [store.get(digest) for digest in digests] == reports
+    assert ReportStore(directory=str(tmp_path)).get(digests[0]) == reports[0]
+    assert store.get("0" * 64) is None
+
+def test_chat_store_keeps_full_history(tmp_path):
+    store = ChatStore(directory=str(tmp_path))
+    for i in range(60):
+        store.append("handle", {"role": "user", "content": f"q{i}"})
+    assert [message["content"] for message in store.read("handle")] == [f"q{i}" for i in range(60)]
+    assert [message["content"] for message in store.read("handle", last=2)] == ["q58", "q59"]
+    assert store.read("missing") == []
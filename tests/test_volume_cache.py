@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from core.volume_cache import compress_volume
+
+@pytest.fixture
+def hu():
+    rng = np.random.default_rng(0)
+    return rng.integers(-1024, 3000, (16, 12, 20)).astype(np.int16)
+
+@pytest.mark.parametrize("dtype", [np.int16, np.int32, np.float32, np.float64])
+def test_whole_hu_round_trip_in_their_dtype(hu, dtype):
+    volume = hu.astype(dtype)
+    compressed = compress_volume(volume, "zlib", slab_slices=8, exact=True)
+    restored = compressed.decompress()
+    assert restored.dtype == dtype and np.array_equal(restored, volume)
+    assert np.array_equal(compressed[:, :, 9], hu[:, :, 9])
+    assert np.array_equal(compressed[3], hu[3])
+
+@pytest.mark.parametrize("volume", [
+    np.full((4, 4, 10), 0.5, dtype=np.float32),
+    np.full((4, 4, 10), 40000, dtype=np.int32),
+    np.full((4, 4, 10), np.nan),
+])
+@pytest.mark.filterwarnings("ignore:invalid value encountered in cast:RuntimeWarning")
+def test_exact_rejects_voxels_int16_cannot_hold(volume):
+    with pytest.raises(ValueError):
+        compress_volume(volume, "zlib", slab_slices=8, exact=True)
+
+def test_inexact_rounds_and_clips():
+    volume = np.array([0.4, 1.6, -40000.0, 40000.0]).reshape(1, 1, 4)
+    restored = np.asarray(compress_volume(volume, "zlib").decompress())
+    assert restored.ravel().tolist() == [0.0, 2.0, -32768.0, 32767.0]
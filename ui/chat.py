@@ -1,14 +1,74 @@
 import streamlit as st
 from api.client import ask_question
-from datetime import datetime
+from core.findings import findings_store, FINDINGS_SOURCE_LOCAL
+from utils.session import chat_messages, add_chat_message
+
+def answer_from_findings(scan_id, question):
+    """
+    Answer common questions from the indexed findings of a scan
+    
+    Used when the backend cannot answer, so the chat still gives a useful
+    reply for the report on screen.
+    
+    Parameters:
+    -----------
+    scan_id : str
+        The scan identifier
+    question : str
+        The user's question
+        
+    Returns:
+    --------
+    str
+        The answer
+    """
+    findings = findings_store.get(scan_id)
+    answer = _answer(findings, question.lower())
+    if findings is not None and findings.source == FINDINGS_SOURCE_LOCAL:
+        # The CPU heuristic is a screening aid, never a diagnosis
+        answer = ("This is a preliminary automated result from the local analysis, run while the AI "
+                  f"backend was unavailable, and needs review by a radiologist. {answer}")
+    return answer
+
+def _answer(findings, question):
+    """Answer a lower-cased question from findings"""
+    if findings is None or findings.pe_present is None:
+        return "The report on screen makes no assessment of pulmonary embolism, so I cannot answer this until the AI analysis system is available again."
+    pe_present = bool(findings.pe_present)
+    location = findings.location or "pulmonary arteries"
+    rv_strain = findings.rv_strain
+    
+    if "treatment" in question:
+        if pe_present:
+            return "Standard treatment for pulmonary embolism usually includes anticoagulation therapy. The specific medication and duration depends on patient factors and the severity of the PE. For this patient, I recommend following your institution's PE protocol."
+        return "No pulmonary embolism was detected in this scan, so no specific PE treatment is needed. However, you may want to consider the patient's symptoms and investigate other possible causes."
+    if "location" in question or "where" in question:
+        if pe_present:
+            answer = f"The pulmonary embolism is located in the {location} as indicated in the report."
+            if findings.clot_burden:
+                answer += f" The clot burden is {findings.clot_burden}."
+            return answer
+        return "No pulmonary embolism was detected in this scan. All major pulmonary arteries appear patent with normal contrast enhancement."
+    if "risk" in question or "prognosis" in question:
+        if pe_present and rv_strain is None:
+            return "This patient has a pulmonary embolism. Right heart strain was not assessed, so risk stratification should include echocardiography or cardiac biomarkers according to your institution's guidelines."
+        if pe_present and rv_strain:
+            return "This patient has a pulmonary embolism with CT signs of right heart strain, which indicates a higher risk of early adverse outcome. Urgent risk stratification according to your institution's guidelines is recommended."
+        if pe_present:
+            return "This patient has a pulmonary embolism without evidence of right heart strain, which generally indicates a better prognosis. However, close monitoring is still recommended, and risk stratification should be performed according to your institution's guidelines."
+        return "No pulmonary embolism was detected, so the immediate risk from PE is not present. However, the patient's risk factors should still be addressed if they were initially suspected of having a PE."
+    if pe_present:
+        strain = {True: "There is evidence of right heart strain.",
+                  False: "There is no evidence of right heart strain, which is a positive prognostic indicator.",
+                  None: "Right heart strain was not assessed."}[rv_strain]
+        return f"Based on the scan, there is a filling defect in the {location} consistent with acute pulmonary embolism. {strain} Would you like more specific information about the location, severity, or recommended follow-up?"
+    return "The scan shows no evidence of pulmonary embolism. All pulmonary arteries appear to be filling normally with contrast. Is there a specific aspect of the scan you'd like me to elaborate on?"
 
 def render_chat_interface(scan_id):
     """Render a chat interface for asking questions about the scan"""
     # Initialize chat history for this scan if not already present
-    if scan_id not in st.session_state.chat_history:
-        st.session_state.chat_history[scan_id] = [
-            {"role": "assistant", "content": "I'm your radiology assistant. How can I help you with this scan?", "time": datetime.now().strftime("%H:%M")}
-        ]
+    if not chat_messages(scan_id):
+        add_chat_message(scan_id, "assistant", "I'm your radiology assistant. How can I help you with this scan?")
     
     # Chat section title
     st.markdown("""
@@ -18,7 +78,7 @@ def render_chat_interface(scan_id):
     """, unsafe_allow_html=True)
     
     # Display all messages
-    for message in st.session_state.chat_history[scan_id]:
+    for message in chat_messages(scan_id):
         if message["role"] == "assistant":
             st.markdown(f"""
             <div style="background-color: #f0f0f0; border-radius: 10px; padding: 10px; margin: 5px 0;">
@@ -41,22 +101,19 @@ def render_chat_interface(scan_id):
         
         if submit_button and user_question:
             # Add user message to chat history
-            st.session_state.chat_history[scan_id].append(
-                {"role": "user", "content": user_question, "time": datetime.now().strftime("%H:%M")}
-            )
+            add_chat_message(scan_id, "user", user_question)
             
             # Ask the API
             response = ask_question(scan_id, user_question)
             
             if response:
                 # Add AI response to chat history
-                st.session_state.chat_history[scan_id].append(
-                    {"role": "assistant", "content": response["answer"], "time": datetime.now().strftime("%H:%M")}
-                )
+                add_chat_message(scan_id, "assistant", response["answer"])
+            elif findings_store.get(scan_id) is not None:
+                # Backend unavailable: answer from the findings of the report on screen
+                add_chat_message(scan_id, "assistant", answer_from_findings(scan_id, user_question))
             else:
                 # Add error message to chat history
-                st.session_state.chat_history[scan_id].append(
-                    {"role": "assistant", "content": "Sorry, I encountered an error processing your question.", "time": datetime.now().strftime("%H:%M")}
-                )
+                add_chat_message(scan_id, "assistant", "Sorry, I encountered an error processing your question.")
             
             st.rerun()
\ No newline at end of file
@@ -1,10 +1,16 @@
 import streamlit as st
 import streamlit.components.v1 as components
 from api.client import analyze_scan, get_api_health, API_URL, get_scan_metadata
+from core.findings import Findings
+from core.report_generator import generate_fallback_report, generate_local_analysis_report
+from core.pdf_export import export_report_pdf, start_bulk_export
+from core.key_images import key_image_thumbnail
+from core.slice_source import slice_source_for, local_volume
+from config import PDF_KEY_SLICES, LOCAL_ANALYSIS_ENABLED
 from utils.notification import add_notification
+from utils.session import get_report, set_report, set_findings, session_reports, key_images, remove_key_image
 import requests
 import json
-from datetime import datetime
 
 def render_report_section(scan_id):
     """Render the report section"""
@@ -17,14 +23,12 @@ def render_report_section(scan_id):
     <h3 style="color: black; margin: 0;">🩺 PE Analysis</h3>
     """, unsafe_allow_html=True)
     
-    # Initialize reports dict in session state if it doesn't exist
-    if 'reports' not in st.session_state:
-        st.session_state.reports = {}
-    
-    # Check if report exists in session state
-    if scan_id in st.session_state.reports and st.session_state.reports[scan_id]:
+    # The session holds the report's digest; the HTML lives in the shared report store
+    report_html = get_report(scan_id)
+    if report_html:
         # Display report using the correct components import
-        components.html(st.session_state.reports[scan_id], height=400, scrolling=True)
+        components.html(report_html, height=400, scrolling=True)
+        render_key_images(scan_id)
         
         # Report action buttons
         cols = st.columns([1, 1, 1])
@@ -33,38 +37,186 @@ def render_report_section(scan_id):
                 # Placeholder for copy functionality
                 add_notification("Report copied to clipboard!", "success")
         with cols[1]:
-            if st.button("📤 Export PDF", use_container_width=True):
-                # Placeholder for export functionality
-                add_notification("PDF export not implemented in this demo", "info")
+            render_pdf_export(scan_id, report_html)
         with cols[2]:
             if st.button("📝 Edit Report", use_container_width=True):
                 # Placeholder for edit functionality
                 add_notification("Report editing not implemented in this demo", "info")
     else:
+        # A local analysis started by the button below runs in the background
+        analyses = st.session_state.setdefault('local_analyses', {})
+        job = analyses.get(scan_id)
+        if job is not None:
+            if not job.done():
+                _poll_local_analysis(scan_id)
+                return
+            del analyses[scan_id]
+            report_html = finish_local_report(scan_id, job.result())
+            if report_html:
+                set_report(scan_id, report_html)
+                add_notification("AI backend unavailable: report generated by the local analysis", "warning")
+                st.rerun()
+            use_fallback_report(scan_id)
+        
         # Generate report button
         if st.button("🔍 Generate Analysis Report", type="primary", use_container_width=True):
             with st.spinner("Analyzing scan and generating report..."):
                 # First try the analyze endpoint
                 report_html = generate_report_using_analyze(scan_id)
-                
-                if report_html:
-                    st.session_state.reports[scan_id] = report_html
-                    add_notification("Report generated successfully!", "success")
-                    st.rerun()
-                else:
-                    # If that fails, try the fallback method
-                    add_notification("Using fallback report generator...", "info")
-                    report_html = generate_static_report(scan_id)
-                    
-                    if report_html:
-                        st.session_state.reports[scan_id] = report_html
-                        add_notification("Report generated using fallback method", "success")
-                        st.rerun()
-                    else:
-                        add_notification("Failed to generate report", "error")
+            
+            if report_html:
+                set_report(scan_id, report_html)
+                add_notification("Report generated successfully!", "success")
+                st.rerun()
+            
+            # Backend unavailable: analyze the scan here if it is loaded in this process
+            job = start_local_report(scan_id)
+            if job is not None:
+                analyses[scan_id] = job
+                st.rerun()
+            use_fallback_report(scan_id)
         
         st.info("Click the button above to generate a comprehensive PE analysis report.")
 
+def use_fallback_report(scan_id):
+    """Store the static fallback report and rerun, or notify that none could be generated"""
+    add_notification("Using fallback report generator...", "info")
+    report_html = generate_static_report(scan_id)
+    
+    if report_html:
+        set_report(scan_id, report_html)
+        add_notification("Report generated using fallback method", "success")
+        st.rerun()
+    else:
+        add_notification("Failed to generate report", "error")
+
+@st.fragment(run_every=1)
+def _poll_local_analysis(scan_id):
+    """Poll a running local analysis without rerunning the page; rerun it once the analysis finishes"""
+    job = st.session_state.local_analyses.get(scan_id)
+    if job is None or job.done():
+        st.rerun()
+    st.caption("⏳ AI backend unavailable, analyzing the scan locally...")
+
+def collect_key_images(scan_id):
+    """
+    Collect the key slice images embedded in a PDF export
+    
+    Uses the key images attached to the scan, as their cached thumbnails.
+    Without any, falls back to the slice being viewed and the middle axial
+    slice at the current window, which usually come from the slice cache.
+    
+    Parameters:
+    -----------
+    scan_id : str
+        The scan identifier
+        
+    Returns:
+    --------
+    list of tuple
+        (caption, image) pairs
+    """
+    attached = key_images(scan_id)
+    if attached:
+        thumbnails = [(key_image.caption, key_image_thumbnail(key_image)) for key_image in attached]
+        return [(caption, thumbnail) for caption, thumbnail in thumbnails if thumbnail is not None]
+    
+    window_center = st.session_state.get('window_center', 100)
+    window_width = st.session_state.get('window_width', 700)
+    view = st.session_state.get('current_view', 'axial')
+    
+    source = slice_source_for(scan_id)
+    wanted = []
+    if f"{view}_slice" in st.session_state:
+        wanted.append((view, st.session_state[f"{view}_slice"]))
+    if source.slice_count("axial"):
+        wanted.append(("axial", source.slice_count("axial") // 2))
+    
+    images = []
+    for view, slice_idx in dict.fromkeys(wanted):
+        slice_data = source.get_slice(view, slice_idx, window_center, window_width)
+        if slice_data and "image" in slice_data:
+            images.append((f"{view.capitalize()} slice {slice_idx} (W {window_width} / L {window_center})",
+                           slice_data["image"]))
+    return images[:PDF_KEY_SLICES]
+
+def render_key_images(scan_id):
+    """
+    Show the key images attached to a scan
+    
+    Thumbnails are only loaded once the gallery is opened, so reports with
+    many key images render as fast as reports without any.
+    """
+    attached = key_images(scan_id)
+    if not attached:
+        return
+    if not st.toggle(f"🖼️ Key images ({len(attached)})", key=f"show_key_images_{scan_id}"):
+        return
+    
+    cols = st.columns(4)
+    for i, key_image in enumerate(attached):
+        with cols[i % 4]:
+            thumbnail = key_image_thumbnail(key_image)
+            if thumbnail is not None:
+                st.image(thumbnail, caption=key_image.caption, use_container_width=True)
+            else:
+                st.caption(f"{key_image.caption} (unavailable)")
+            if st.button("Remove", key=f"remove_key_image_{key_image.ref}", use_container_width=True):
+                remove_key_image(key_image)
+                st.rerun()
+
+def render_pdf_export(scan_id, report_html):
+    """Render the Export PDF button and, once started, the export's progress or download"""
+    exports = st.session_state.setdefault('pdf_exports', {})
+    if st.button("📤 Export PDF", use_container_width=True, key=f"export_pdf_{scan_id}"):
+        # Rendering happens in the export process pool; this rerun continues immediately
+        exports[scan_id] = export_report_pdf(report_html, collect_key_images(scan_id))
+    
+    job = exports.get(scan_id)
+    if job is None:
+        return
+    if not job.done():
+        _poll_export(scan_id)
+    elif job.exception() is not None:
+        st.error(f"PDF export failed: {job.exception()}")
+        del exports[scan_id]
+    else:
+        st.download_button("⬇️ Download PDF", job.result(), file_name=f"ctpa_report_{scan_id}.pdf",
+                           mime="application/pdf", use_container_width=True, key=f"download_pdf_{scan_id}")
+
+@st.fragment(run_every=1)
+def _poll_export(job_key):
+    """Poll a running export without rerunning the page; rerun it once the export finishes"""
+    job = st.session_state.pdf_exports.get(job_key)
+    if job is not None and job.done():
+        st.rerun()
+    st.caption("⏳ Rendering PDF...")
+
+def render_bulk_pdf_export():
+    """Export every report in this session as PDFs in one ZIP archive"""
+    reports = session_reports()
+    if not reports:
+        return
+    
+    exports = st.session_state.setdefault('pdf_exports', {})
+    if st.button(f"📦 Export all reports ({len(reports)})", use_container_width=True):
+        exports["bulk"] = start_bulk_export(
+            {scan_id: (html, collect_key_images(scan_id)) for scan_id, html in reports.items()}
+        )
+    
+    job = exports.get("bulk")
+    if job is None:
+        return
+    if not job.done():
+        _poll_export("bulk")
+    elif job.exception() is not None:
+        st.error(f"Bulk PDF export failed: {job.exception()}")
+        del exports["bulk"]
+    else:
+        # The job's result is the finished archive, built once when the export completed
+        st.download_button("⬇️ Download ZIP", job.result(), file_name="ctpa_reports.zip",
+                           mime="application/zip", use_container_width=True)
+
 def generate_report_using_analyze(scan_id):
     """Generate a report using the analyze endpoint"""
     try:
@@ -78,70 +230,74 @@ def generate_report_using_analyze(scan_id):
         analysis = analyze_scan(scan_id, ["Generate a comprehensive CTPA report for this scan."])
         
         if analysis and "report_html" in analysis and analysis["report_html"]:
+            # Index the findings now so later lookups never parse the HTML. The backend's
+            # structured findings are authoritative; parsing is a fallback for backends that
+            # omit them, and a report it cannot read unambiguously is indexed as unassessed
+            if isinstance(analysis.get("findings"), dict):
+                findings = Findings.from_dict(analysis["findings"])
+            else:
+                findings = Findings.from_report_html(analysis["report_html"])
+            set_findings(scan_id, findings)
             return analysis["report_html"]
         return None
     except Exception as e:
         st.error(f"Error in analyze method: {str(e)}")
         return None
 
-def generate_static_report(scan_id):
-    """Generate a static report when API methods fail"""
+def start_local_report(scan_id):
+    """
+    Start analyzing a scan loaded in this process on the CPU when the backend cannot
     
-    # Get basic scan info if available
-    scan_info = "Unknown"
+    Returns:
+    --------
+    concurrent.futures.Future or None
+        Resolves to the core.local_analysis.LocalAnalysis, or None; None
+        straight away if the scan is not loaded locally or local analysis
+        is disabled
+    """
+    volume = local_volume(scan_id)
+    if not LOCAL_ANALYSIS_ENABLED or volume is None:
+        return None
+    
+    from core.local_analysis import start_local_analysis
+    return start_local_analysis(volume)
+
+def finish_local_report(scan_id, analysis):
+    """
+    Index a finished local analysis and write its report
+    
+    Returns:
+    --------
+    str or None
+        The report HTML, or None if the analysis failed
+    """
+    if analysis is None:
+        return None
+    
+    # Indexed with source 'local': listed as preliminary and kept out of the definitive worklist filters
+    set_findings(scan_id, analysis.findings)
+    return generate_local_analysis_report(scan_id, analysis, scan_filename(scan_id))
+
+def scan_filename(scan_id):
+    """The scan's original filename, from this session's uploads or the backend metadata, or 'Unknown'"""
+    for scan in st.session_state.get('uploaded_scans', []):
+        # Scans loaded here are keyed by their filename, backend ones by their ID
+        if (scan.get("scan_id") or scan.get("filename")) == scan_id and scan.get("filename"):
+            return scan["filename"]
     try:
         metadata = get_scan_metadata(scan_id)
         if metadata and "filename" in metadata:
-            scan_info = metadata["filename"]
-    except:
+            return metadata["filename"]
+    except Exception:
         pass
+    return "Unknown"
+
+def generate_static_report(scan_id):
+    """Generate a static report when API methods fail"""
     
-    report_date = datetime.now().strftime("%B %d, %Y at %I:%M %p")
-    
-    # Create a simple but informative HTML report
-    report = f"""
-    <div style="font-family: Arial, sans-serif; padding: 20px; border: 1px solid #ccc; border-radius: 8px; max-width: 800px; margin: 0 auto;">
-        <div style="text-align: center; padding-bottom: 15px; border-bottom: 2px solid #2c3e50;">
-            <h2 style="color: #2c3e50; margin: 0;">CT PULMONARY ANGIOGRAPHY REPORT</h2>
-            <p style="color: #7f8c8d; font-style: italic;">(Fallback Report Generator)</p>
-        </div>
-        
-        <div style="margin: 15px 0;">
-            <h3 style="color: #2c3e50; margin: 0 0 8px 0; font-size: 16px; border-bottom: 1px solid #eee; padding-bottom: 5px;">SCAN INFORMATION:</h3>
-            <p style="margin: 5px 0; line-height: 1.5;">
-                <strong>Scan ID:</strong> {scan_id}<br>
-                <strong>Filename:</strong> {scan_info}<br>
-                <strong>Date:</strong> {report_date}
-            </p>
-        </div>
-        
-        <div style="margin: 15px 0;">
-            <h3 style="color: #2c3e50; margin: 0 0 8px 0; font-size: 16px; border-bottom: 1px solid #eee; padding-bottom: 5px;">FINDINGS:</h3>
-            <p style="margin: 5px 0; line-height: 1.5;">
-                This is a fallback report generated when the AI analysis system is unavailable.<br>
-                Please consult with a radiologist for a professional interpretation of this scan.
-            </p>
-            <ul style="margin: 10px 0; padding-left: 20px;">
-                <li>CT Pulmonary Angiogram study performed to evaluate for pulmonary embolism</li>
-                <li>Pulmonary arterial tree visualized to the subsegmental level</li>
-                <li>Lung parenchyma and airways visualized</li>
-                <li>Mediastinal and hilar structures evaluated</li>
-                <li>Limited evaluation of the chest wall and upper abdomen</li>
-            </ul>
-        </div>
-        
-        <div style="background-color: #f9f9f9; padding: 10px 15px; border-left: 4px solid #2c3e50; margin: 15px 0;">
-            <h3 style="color: #2c3e50; margin: 0 0 8px 0; font-size: 16px; padding-bottom: 5px;">IMPRESSION:</h3>
-            <p style="margin: 5px 0; line-height: 1.5;">
-                <strong>Note:</strong> This is a fallback report. A qualified radiologist should review this study to provide an accurate diagnosis and interpretation.
-            </p>
-        </div>
-        
-        <div style="margin-top: 20px; padding-top: 10px; border-top: 1px solid #eee; font-size: 12px; color: #7f8c8d; text-align: center;">
-            <p>Report generated using fallback generator on {report_date}<br>
-            This report does not represent a medical diagnosis.</p>
-        </div>
-    </div>
-    """
+    # Get basic scan info if available
+    scan_info = scan_filename(scan_id)
     
-    return report
\ No newline at end of file
+    # The fallback report makes no assessment
+    set_findings(scan_id, Findings())
+    return generate_fallback_report(scan_id, scan_info)
\ No newline at end of file
@@ -1,17 +1,49 @@
 import streamlit as st
-from api.client import get_api_health, upload_scan, get_scan_list
+from api.client import upload_scan, get_scan_list
+from api import async_client
+from core.findings import findings_store, FINDINGS_SOURCE_BACKEND, FINDINGS_SOURCE_LOCAL
+from ui.report import render_bulk_pdf_export
 from utils.notification import add_notification
+from utils.session import add_uploaded_scan, set_current_scan
 
-def render_scan_list():
-    """Render the list of available scans"""
+# Worklist filters, each an index lookup in the findings store. Only the backend's
+# findings are definitive; the local CPU heuristic's are listed on their own
+WORKLIST_FILTERS = {
+    "All scans": None,
+    "PE positive": {"pe_present": True, "source": FINDINGS_SOURCE_BACKEND},
+    "PE negative": {"pe_present": False, "source": FINDINGS_SOURCE_BACKEND},
+    "Right heart strain": {"pe_present": True, "rv_strain": True, "source": FINDINGS_SOURCE_BACKEND},
+    "Preliminary (local analysis)": {"source": FINDINGS_SOURCE_LOCAL},
+    "Not yet reported": "unreported",
+}
+
+def filter_scans(scans, worklist_filter):
+    """Return the scans matching a WORKLIST_FILTERS entry"""
+    criteria = WORKLIST_FILTERS.get(worklist_filter)
+    if criteria is None:
+        return scans
+    if criteria == "unreported":
+        reported = findings_store.reported()
+        return [scan for scan in scans if scan["scan_id"] not in reported]
+    matches = findings_store.query(**criteria)
+    return [scan for scan in scans if scan["scan_id"] in matches]
+
+def render_scan_list(scans=None):
+    """Render the list of available scans, fetching them unless already given"""
     st.header("📋 Available Scans")
     
     # Get scans from API
-    scans = get_scan_list()
+    if scans is None:
+        scans = get_scan_list()
     
     if not scans:
         st.info("No CTPA scans available yet")
     else:
+        worklist_filter = st.selectbox("Filter by finding", list(WORKLIST_FILTERS), key="worklist_filter")
+        scans = filter_scans(scans, worklist_filter)
+        if not scans:
+            st.caption(f"No scans match \"{worklist_filter}\"")
+        
         for scan in scans:
             is_current = st.session_state.current_scan == scan["scan_id"]
             button_style = "primary" if is_current else "secondary"
@@ -22,7 +54,7 @@ def render_scan_list():
                           key=f"scan_{scan['scan_id']}",
                           type=button_style,
                           use_container_width=True):
-                    st.session_state.current_scan = scan["scan_id"]
+                    set_current_scan(scan["scan_id"])
                     st.rerun()
             
             # Show scan upload date
@@ -39,8 +71,13 @@ def render_sidebar():
         
         st.markdown("---")
         
+        # Health and scan list are independent, so fetch them concurrently
+        api_health, scans = async_client.run_concurrently(
+            async_client.get_api_health(),
+            async_client.get_scan_list()
+        )
+        
         # API connection status
-        api_health = get_api_health()
         if api_health["status"] == "healthy":
             st.success("✅ Connected to AI backend")
             
@@ -55,8 +92,8 @@ def render_sidebar():
         
         # Scan upload section
         st.header("📂 Upload CTPA Scan")
-        uploaded_file = st.file_uploader("Choose a scan file", type=["nii", "nii.gz", "npz"], 
-                                         help="Supported formats: NIfTI (.nii or .nii.gz) or NumPy (.npz)")
+        uploaded_file = st.file_uploader("Choose a scan file", type=["nii", "nii.gz", "npz", "dcm", "zip"], 
+                                         help="Supported formats: NIfTI (.nii or .nii.gz), NumPy (.npz) or DICOM (.dcm, or a .zip of the series)")
         
         if uploaded_file is not None:
             process_button = st.button("Process CTPA Scan", type="primary", use_container_width=True)
@@ -66,11 +103,15 @@ def render_sidebar():
                     scan_info = upload_scan(uploaded_file)
                     
                     if scan_info:
-                        st.session_state.current_scan = scan_info["scan_id"]
+                        add_uploaded_scan(scan_info)
+                        set_current_scan(scan_info["scan_id"])
                         add_notification(f"Successfully processed {uploaded_file.name}", "success")
                         st.rerun()
         
         st.markdown("---")
         
         # Scan list section
-        render_scan_list()
\ No newline at end of file
+        render_scan_list(scans)
+        
+        # Bulk export of this session's reports
+        render_bulk_pdf_export()
\ No newline at end of file
@@ -1,47 +1,139 @@
 import streamlit as st
-from api.client import get_scan_slice
+import time
+import uuid
+from concurrent.futures import TimeoutError as FrameTimeout, wait
+from config import (
+    CINE_DEFAULT_FPS, CINE_MAX_FRAMES, MONTAGE_LAYOUTS, SLICE_PREFETCH_RADIUS,
+    DEFAULT_WINDOW_CENTER, DEFAULT_WINDOW_WIDTH, WINDOW_PRESETS,
+    SLICE_FRAME_WAIT_SECONDS, SLICE_FRAME_POLL_SECONDS
+)
+from core.histogram import histogram_for
+from core.key_images import KeyImage
+from core.masks import masks_for, overlay_masks
+from core.slice_source import LocalSliceSource, get_cached_slice
+from utils.notification import add_notification
+from utils.session import add_key_image
+from utils.metrics import timed
 
-def display_window_controls():
-    """Display window controls and handle window settings"""
+def display_window_controls(source):
+    """
+    Display window controls and handle window settings
+    
+    Parameters:
+    -----------
+    source : core.slice_source.SliceSource
+        The scan's slice source; the auto window needs a local volume
+    """
     # Window controls container
     st.markdown("### Window Settings")
     
-    # Window presets
-    cols = st.columns(4)
-    with cols[0]:
-        if st.button("PE Protocol", use_container_width=True, type="primary"):
-            st.session_state.window_center = 100
-            st.session_state.window_width = 700
-            st.rerun()
-    with cols[1]:
-        if st.button("Pulmonary", use_container_width=True):
-            st.session_state.window_center = -600
-            st.session_state.window_width = 1500
-            st.rerun()
-    with cols[2]:
-        if st.button("Mediastinal", use_container_width=True):
-            st.session_state.window_center = 40
-            st.session_state.window_width = 400
-            st.rerun()
-    with cols[3]:
-        if st.button("Bone", use_container_width=True):
-            st.session_state.window_center = 500
-            st.session_state.window_width = 2000
+    # Window presets, and an auto window from the volume's HU histogram
+    local = isinstance(source, LocalSliceSource)
+    cols = st.columns(len(WINDOW_PRESETS) + 1)
+    for col, (name, (center, width)) in zip(cols, WINDOW_PRESETS.items()):
+        with col:
+            if st.button(name, use_container_width=True, type="primary" if col is cols[0] else "secondary"):
+                st.session_state.window_center = center
+                st.session_state.window_width = width
+                st.rerun()
+    with cols[-1]:
+        if st.button("Auto", use_container_width=True, disabled=not local,
+                     help="Window to the scan's HU percentiles" if local else "Needs a scan loaded in this session"):
+            # Counted once when the volume was registered; only the first click can wait for it
+            with st.spinner("Computing HU histogram..."):
+                histogram = histogram_for(source.volume, wait=True)
+            window = histogram.window() if histogram is not None else None
+            if window is None:
+                add_notification("Could not compute an auto window for this scan", "warning")
+            else:
+                st.session_state.window_center = min(max(window[0], -1000), 1000)
+                st.session_state.window_width = min(max(window[1], 1), 4000)
             st.rerun()
     
-    # Custom window controls
+    # Custom window controls, bound to the window settings so a change reruns the page once
     cols = st.columns(2)
     with cols[0]:
-        window_center = st.slider("Window Center (HU)", -1000, 1000, st.session_state.window_center, 10)
-        if window_center != st.session_state.window_center:
-            st.session_state.window_center = window_center
-            st.rerun()
+        st.slider("Window Center (HU)", -1000, 1000, step=10, key="window_center")
     
     with cols[1]:
-        window_width = st.slider("Window Width (HU)", 1, 4000, st.session_state.window_width, 50)
-        if window_width != st.session_state.window_width:
-            st.session_state.window_width = window_width
-            st.rerun()
+        st.slider("Window Width (HU)", 1, 4000, step=50, key="window_width")
+    
+    if local:
+        st.toggle("Per-slice auto window", key="slice_auto_window",
+                  help="Window each slice to its own HU percentiles instead of the settings above")
+
+def slice_windows(source, view, slice_indices):
+    """
+    Return the window each slice is shown with
+    
+    Per-slice auto windows come from the histograms counted when the volume
+    was registered, so they cost no pass over voxels; until those are ready,
+    and for slices with nothing above the air floor, the window settings
+    are used.
+    
+    Parameters:
+    -----------
+    source : core.slice_source.SliceSource
+        Where slices come from
+    view : str
+        The current view ('axial', 'sagittal', or 'coronal')
+    slice_indices : iterable of int
+        The slices to window
+    
+    Returns:
+    --------
+    dict
+        Slice index to (window center, window width)
+    """
+    window = (st.session_state.window_center, st.session_state.window_width)
+    histogram = None
+    if st.session_state.get("slice_auto_window") and isinstance(source, LocalSliceSource):
+        histogram = histogram_for(source.volume)
+    count = source.slice_count(view)
+    windows = {}
+    for idx in slice_indices:
+        slice_window = histogram.window(view, idx) if histogram is not None and 0 <= idx < count else None
+        windows[idx] = slice_window or window
+    return windows
+
+def loaded_only(source, view, slice_indices):
+    """Drop the slices that are still loading, so nothing waits on them"""
+    loaded = source.loaded_slices(view)
+    return [idx for idx in slice_indices if loaded is None or loaded[idx]]
+
+def _format_ranges(mask, limit=4):
+    """Describe the runs of True in a boolean mask, e.g. '0-63, 120-127'"""
+    import numpy as np
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], mask.astype(np.int8), [0]])))
+    runs = [f"{start}-{stop - 1}" if stop - 1 > start else f"{start}" for start, stop in zip(edges[::2], edges[1::2])]
+    if len(runs) > limit:
+        runs = runs[:limit] + ["..."]
+    return ", ".join(runs) or "none"
+
+@st.fragment(run_every=0.5)
+def _loading_status(source, view, slice_idx, waiting):
+    """
+    Show which slices of a loading scan are ready, refreshing on its own;
+    the page reruns once the shown slice or the whole scan has loaded
+    """
+    loaded = source.loaded_slices(view)
+    if loaded is None or (waiting and loaded[slice_idx]):
+        st.rerun()
+    st.progress(float(loaded.mean()), text=f"⏳ Loading scan: slices {_format_ranges(loaded)} of {len(loaded)} ready")
+
+def _by_window(windows):
+    """Group slice indices by their (center, width) window"""
+    groups = {}
+    for idx, window in windows.items():
+        groups.setdefault(window, []).append(idx)
+    return groups
+
+def get_windowed_slices(source, view, slice_indices):
+    """Get slices with their own windows, in one batch per distinct window"""
+    slices = {}
+    for (window_center, window_width), indices in _by_window(slice_windows(source, view, slice_indices)).items():
+        slices.update(source.get_slices(view, indices, window_center, window_width))
+    return slices
 
 def display_view_controls():
     """Display view controls for axial, sagittal, and coronal planes"""
@@ -74,20 +166,25 @@ def display_view_controls():
     # Add spacing
     st.markdown("<div style='margin-top: 1rem;'></div>", unsafe_allow_html=True)
 
-def display_scan_views(scan_id, metadata):
-    """Display the scan views based on the current view"""
-    # Get dimensions from metadata
-    if not metadata or "dimensions" not in metadata or not metadata["dimensions"]:
+def display_scan_views(source):
+    """
+    Display the scan views based on the current view
+    
+    Parameters:
+    -----------
+    source : core.slice_source.SliceSource
+        Where slices come from: a volume loaded in this process or the backend
+    """
+    dims = source.dims
+    if not dims:
         st.warning("Scan dimensions not available")
         return
     
-    dims = metadata["dimensions"]
-    
     # Create view buttons
     display_view_controls()
     
     # Window controls
-    display_window_controls()
+    display_window_controls(source)
     
     current_view = st.session_state.current_view
     
@@ -99,10 +196,8 @@ def display_scan_views(scan_id, metadata):
             st.session_state.axial_slice = max_slice // 2
         # Use the value from session_state for the slider
         slice_idx = st.slider('Navigate Slices', 0, max_slice, st.session_state.axial_slice, key='axial_nav')
-        # Store the value back to session_state, but only if changed
-        if slice_idx != st.session_state.axial_slice:
-            st.session_state.axial_slice = slice_idx
-            st.rerun()
+        # The slider's own rerun already carries the new value
+        st.session_state.axial_slice = slice_idx
         view_label = "Axial View"
     elif current_view == 'sagittal':
         max_slice = dims[0] - 1 if len(dims) > 0 else 0
@@ -111,10 +206,8 @@ def display_scan_views(scan_id, metadata):
             st.session_state.sagittal_slice = max_slice // 2
         # Use the value from session_state for the slider
         slice_idx = st.slider('Navigate Slices', 0, max_slice, st.session_state.sagittal_slice, key='sagittal_nav')
-        # Store the value back to session_state, but only if changed
-        if slice_idx != st.session_state.sagittal_slice:
-            st.session_state.sagittal_slice = slice_idx
-            st.rerun()
+        # The slider's own rerun already carries the new value
+        st.session_state.sagittal_slice = slice_idx
         view_label = "Sagittal View"
     else:  # coronal
         max_slice = dims[1] - 1 if len(dims) > 1 else 0
@@ -123,36 +216,253 @@ def display_scan_views(scan_id, metadata):
             st.session_state.coronal_slice = max_slice // 2
         # Use the value from session_state for the slider
         slice_idx = st.slider('Navigate Slices', 0, max_slice, st.session_state.coronal_slice, key='coronal_nav')
-        # Store the value back to session_state, but only if changed
-        if slice_idx != st.session_state.coronal_slice:
-            st.session_state.coronal_slice = slice_idx
-            st.rerun()
+        # The slider's own rerun already carries the new value
+        st.session_state.coronal_slice = slice_idx
         view_label = "Coronal View"
     
-    # Get the slice
-    slice_data = get_scan_slice(
-        scan_id, 
-        current_view, 
-        slice_idx, 
-        st.session_state.window_center, 
-        st.session_state.window_width
-    )
+    # Scans still loading in the background show which slices are ready
+    loaded = source.loaded_slices(current_view)
+    if loaded is not None:
+        _loading_status(source, current_view, slice_idx, not loaded[slice_idx])
+    
+    # Display mode
+    display_mode = st.radio("Display Mode", ["Single Slice", "Cine", "Montage"], horizontal=True, key='viewer_mode')
+    if display_mode == "Cine":
+        display_cine(source, current_view, slice_idx, max_slice, view_label)
+        return
+    if display_mode == "Montage":
+        display_montage(source, current_view, slice_idx, max_slice, view_label)
+        return
+    
+    if loaded is not None and not loaded[slice_idx]:
+        st.info(f"{view_label} slice {slice_idx} is still loading")
+        return
+    
+    # Get the slice; during a drag each rerun supersedes the frame the last one asked for
+    neighbours = [idx for offset in range(1, SLICE_PREFETCH_RADIUS + 1)
+                  for idx in (slice_idx + offset, slice_idx - offset)]
+    windows = slice_windows(source, current_view, [slice_idx] + neighbours)
+    window = windows.pop(slice_idx)
+    viewer = _viewer_id()
+    frame = source.request_slice(viewer, current_view, slice_idx, *window)
+    slice_data, pending = _frame_or_previous(source, frame, current_view, slice_idx, window)
+    
+    # Warm the neighbours so stepping through the stack is served from the cache,
+    # once the frame has landed so a drag does not prefetch around every slice it passes
+    if not pending:
+        for (window_center, window_width), indices in _by_window(windows).items():
+            source.prefetch(current_view, indices, window_center, window_width, viewer=viewer)
+    
+    if pending and slice_data is None:
+        st.info(f"Loading {view_label.lower()} slice {slice_idx}...")
+        _await_frame(frame)
+        return
     
     if slice_data and "image" in slice_data:
+        image = slice_data["image"]
+        # A frame still loading leaves the previous one on screen
+        shown_view = slice_data.get("view", current_view)
+        shown_idx = slice_data.get("slice_idx", slice_idx)
+        # Masks exist for volumes loaded here; they are computed once, in the background
+        if isinstance(source, LocalSliceSource) and st.toggle("🫁 Lung/vessel overlay", key="mask_overlay"):
+            mask_set = masks_for(source.volume)
+            if mask_set is None:
+                _poll_masks(source)
+            else:
+                image = overlay_masks(image, mask_set, shown_view, shown_idx)
+        
+        # The window the slice was rendered at; the requested one if its payload does not say
+        shown_center = slice_data.get("window_center", window[0])
+        shown_width = slice_data.get("window_width", window[1])
+        
         # Display the image
-        st.image(slice_data["image"], caption=f"{view_label} - Slice {slice_idx}", use_container_width=True)
+        caption = f"{view_label} - Slice {shown_idx}"
+        if pending:
+            caption += f" (loading slice {slice_idx}...)"
+        if st.session_state.get("slice_auto_window"):
+            caption += f" (W {shown_width:g} / L {shown_center:g})"
+        with timed("render.st_image"):
+            st.image(image, caption=caption, use_container_width=True)
+        
+        if st.button("📌 Add key image", key="add_key_image", disabled=pending):
+            key_image = KeyImage(source.scan_id, current_view, slice_idx, shown_center, shown_width)
+            if add_key_image(key_image, slice_data["image"]):
+                add_notification(f"Added {key_image.caption} to the report", "success")
+            else:
+                add_notification("This image is already attached to the report", "info")
+        
+        if pending:
+            _await_frame(frame)
     else:
         st.error("Failed to load scan slice")
 
-def render_viewer_section(scan_id, metadata):
-    """Render the scan viewer section"""
+def _viewer_id():
+    """This session's viewer, whose newer slice requests supersede its older ones"""
+    if 'viewer_id' not in st.session_state:
+        st.session_state.viewer_id = uuid.uuid4().hex
+    return st.session_state.viewer_id
+
+def _frame_or_previous(source, frame, view, slice_idx, window):
+    """
+    Wait briefly for a requested frame, falling back to the last one shown
+    
+    Returns:
+    --------
+    tuple
+        (slice data, pending): the requested slice and False once it has
+        loaded, otherwise this scan's previously shown slice, or None, and
+        True
+    """
+    try:
+        slice_data = frame.result(timeout=SLICE_FRAME_WAIT_SECONDS)
+    except FrameTimeout:
+        scan_id, key = st.session_state.get('viewer_frame') or (None, None)
+        previous = get_cached_slice(key, source.shared) if scan_id == source.scan_id else None
+        return previous, True
+    if slice_data:
+        st.session_state.viewer_frame = (source.scan_id, source.cache_key(view, slice_idx, *window))
+    return slice_data, False
+
+@st.fragment(run_every=SLICE_FRAME_POLL_SECONDS)
+def _await_frame(frame):
+    """
+    Check on the requested frame every SLICE_FRAME_POLL_SECONDS, waiting only
+    briefly each time so a newer slider value is never held up for long, and
+    rerun the page once it lands or is superseded
+    """
+    wait([frame], timeout=SLICE_FRAME_WAIT_SECONDS)
+    if frame.done():
+        st.rerun()
+
+@st.fragment(run_every=1)
+def _poll_masks(source):
+    """Wait for the masks without rerunning the page; rerun it once they are ready"""
+    if masks_for(source.volume) is not None:
+        st.rerun()
+    st.caption("⏳ Computing lung and vessel masks...")
+
+def display_cine(source, view, slice_idx, max_slice, view_label):
+    """
+    Play a cine loop of slices around the current one
+    
+    All frames are loaded together before playback starts, so the loop
+    itself never waits on the network or on windowing.
+    
+    Parameters:
+    -----------
+    source : core.slice_source.SliceSource
+        Where slices come from
+    view : str
+        The current view ('axial', 'sagittal', or 'coronal')
+    slice_idx : int
+        The current slice, used as the center of the cine range
+    max_slice : int
+        The last slice index of the view
+    view_label : str
+        Caption prefix for the frames
+    """
+    cols = st.columns(2)
+    with cols[0]:
+        fps = st.slider("Frames per Second", 1, 30, CINE_DEFAULT_FPS, key='cine_fps')
+    with cols[1]:
+        loops = st.number_input("Loops", 1, 20, 1, key='cine_loops')
+    
+    # Range of at most CINE_MAX_FRAMES slices centered on the current slice
+    stop = min(max_slice, max(0, slice_idx - CINE_MAX_FRAMES // 2) + CINE_MAX_FRAMES - 1)
+    start = max(0, stop - CINE_MAX_FRAMES + 1)
+    st.caption(f"Cine range: slices {start}-{stop}")
+    
+    frame = st.empty()
+    if st.button("▶️ Play Cine", type="primary", use_container_width=True):
+        with st.spinner("Loading cine frames..."):
+            ready = loaded_only(source, view, range(start, stop + 1))
+            frames = get_windowed_slices(source, view, ready) if ready else {}
+        if not frames:
+            st.error("Failed to load cine frames")
+            return
+        
+        frame_time = 1.0 / fps
+        for _ in range(int(loops)):
+            for idx in sorted(frames):
+                frame_start = time.perf_counter()
+                with timed("render.st_image"):
+                    frame.image(frames[idx]["image"], caption=f"{view_label} - Slice {idx}", use_container_width=True)
+                time.sleep(max(0.0, frame_time - (time.perf_counter() - frame_start)))
+    elif not loaded_only(source, view, [slice_idx]):
+        frame.info(f"{view_label} slice {slice_idx} is still loading")
+    else:
+        slice_data = source.get_slice(view, slice_idx, *slice_windows(source, view, [slice_idx])[slice_idx])
+        if slice_data and "image" in slice_data:
+            frame.image(slice_data["image"], caption=f"{view_label} - Slice {slice_idx}", use_container_width=True)
+        else:
+            frame.error("Failed to load scan slice")
+
+def display_montage(source, view, slice_idx, max_slice, view_label):
+    """
+    Show an N x M lightbox of slices around the current one
+    
+    Parameters:
+    -----------
+    source : core.slice_source.SliceSource
+        Where slices come from
+    view : str
+        The current view ('axial', 'sagittal', or 'coronal')
+    slice_idx : int
+        The current slice, placed at the center of the grid
+    max_slice : int
+        The last slice index of the view
+    view_label : str
+        Caption prefix for the tiles
+    """
+    cols = st.columns(2)
+    with cols[0]:
+        layout = st.selectbox("Layout", list(MONTAGE_LAYOUTS), key='montage_layout')
+    with cols[1]:
+        step = st.slider("Slice Spacing", 1, 20, 2, key='montage_step')
+    
+    rows, columns = MONTAGE_LAYOUTS[layout]
+    count = rows * columns
+    # Center the grid on the current slice, shifting it to stay inside the volume
+    start = max(0, min(slice_idx - (count // 2) * step, max_slice - (count - 1) * step))
+    indices = [idx for idx in range(start, start + count * step, step) if idx <= max_slice]
+    
+    # One batch for the whole grid, leaving out slices that are still loading
+    ready = loaded_only(source, view, indices)
+    if not ready:
+        st.info("The slices around this one are still loading")
+        return
+    slices = get_windowed_slices(source, view, ready)
+    if not slices:
+        st.error("Failed to load montage slices")
+        return
+    
+    for row in range(rows):
+        row_cols = st.columns(columns)
+        for col in range(columns):
+            position = row * columns + col
+            if position >= len(indices) or indices[position] not in slices:
+                continue
+            idx = indices[position]
+            with row_cols[col]:
+                with timed("render.st_image"):
+                    st.image(slices[idx]["image"], caption=f"{view_label} {idx}", use_container_width=True)
+
+def render_viewer_section(source):
+    """
+    Render the scan viewer section
+    
+    Parameters:
+    -----------
+    source : core.slice_source.SliceSource
+        The scan's slice source, from core.slice_source.slice_source_for
+    """
     # Initialize session state variables if not present
     if 'current_view' not in st.session_state:
         st.session_state.current_view = 'axial'
     if 'window_center' not in st.session_state:
-        st.session_state.window_center = 100  # Default to PE Protocol settings
+        st.session_state.window_center = DEFAULT_WINDOW_CENTER
     if 'window_width' not in st.session_state:
-        st.session_state.window_width = 700
+        st.session_state.window_width = DEFAULT_WINDOW_WIDTH
     
     # Scan visualization section heading
     st.markdown("""
@@ -160,4 +470,7 @@ def render_viewer_section(scan_id, metadata):
     """, unsafe_allow_html=True)
     
     # Display scan views
-    display_scan_views(scan_id, metadata)
\ No newline at end of file
+    try:
+        display_scan_views(source)
+    except Exception as e:
+        st.error(f"Error displaying scan: {str(e)}")
\ No newline at end of file
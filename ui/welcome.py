@@ -11,7 +11,7 @@ def render_welcome_message():
         
         This application helps radiologists and physicians visualize and analyze CTPA (CT Pulmonary Angiography) scans for the detection of pulmonary embolism. Here's how to get started:
         
-        1. **Upload your scan**: Use the file uploader in the sidebar to select a NIfTI file (.nii or .nii.gz) or NPZ file (.npz)
+        1. **Upload your scan**: Use the file uploader in the sidebar to select a NIfTI file (.nii or .nii.gz), NPZ file (.npz) or DICOM series (.dcm or .zip)
         2. **Process the scan**: Click the "Process CTPA Scan" button to load your file
         3. **View the report**: Click "Generate Analysis Report" to get AI analysis
         4. **Explore the scan**: Use the view controls and slice navigator to examine the scan in different planes
@@ -0,0 +1,202 @@
+import os
+import json
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from config import APP_STATE_PATH, APP_STATE_JOURNAL_PATH, APP_STATE_COMPACT_BYTES
+from utils.metrics import metrics, timed
+
+try:
+    import fcntl
+except ImportError:  # No cross-process locking, so run a single worker
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+def empty_state():
+    """The app state before anything was uploaded"""
+    return {"uploaded_scans": [], "reports": {}, "findings": {}, "key_images": {}, "current_scan": None}
+
+def _scan_key(scan):
+    return scan.get("scan_id") or scan.get("filename")
+
+def apply_change(state, change):
+    """
+    Apply one journal record to an app state dict, in place
+
+    Every record sets a value rather than modifying one, so replaying a
+    record that is already part of the snapshot leaves the state unchanged.
+
+    Parameters:
+    -----------
+    state : dict
+        The app state
+    change : dict
+        {"op": "scan", "scan": {...}}, {"op": "report", "scan_id": ...,
+        "report": ...}, {"op": "findings", "scan_id": ..., "findings":
+        {...}}, {"op": "key_images", "scan_id": ..., "key_images": [...]}
+        or {"op": "current", "scan_id": ...}
+    """
+    op = change.get("op")
+    if op == "scan":
+        scan = change["scan"]
+        scans = state["uploaded_scans"]
+        for i, known in enumerate(scans):
+            if _scan_key(known) == _scan_key(scan):
+                scans[i] = scan
+                break
+        else:
+            scans.append(scan)
+    elif op == "report":
+        state["reports"][change["scan_id"]] = change["report"]
+    elif op == "findings":
+        state["findings"][change["scan_id"]] = change["findings"]
+    elif op == "key_images":
+        state["key_images"][change["scan_id"]] = change["key_images"]
+    elif op == "current":
+        state["current_scan"] = change["scan_id"]
+    else:
+        logger.warning(f"Ignoring unknown app state change {op!r}")
+
+class AppStateStore:
+    """
+    App state persisted as a JSON snapshot plus an append-only journal
+
+    Each change is one JSON line appended to the journal with a single
+    O_APPEND write, so its cost does not depend on how many scans the state
+    holds and concurrent writers never interleave within a record. Once the
+    journal outgrows ``compact_bytes`` it is folded into a new snapshot,
+    written to a temporary file and renamed into place, and the journal is
+    emptied. Appends and reads hold a shared lock on ``<path>.lock`` and
+    compaction an exclusive one, so worker processes can append at the same
+    time but never while the journal is being folded away. Appends,
+    compactions and skipped records are counted in utils.metrics under
+    ``app_state.*``.
+    """
+
+    def __init__(self, path=APP_STATE_PATH, journal_path=None, compact_bytes=APP_STATE_COMPACT_BYTES):
+        self.path = path
+        self.journal_path = journal_path or f"{path}.journal"
+        self.lock_path = f"{path}.lock"
+        self.compact_bytes = compact_bytes
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self, exclusive=False):
+        # flock locks belong to the open file, so each holder opens its own
+        with open(self.lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def _read_snapshot(self):
+        try:
+            with open(self.path, "r") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return empty_state()
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable app state {self.path}: {str(e)}")
+            return empty_state()
+        return dict(empty_state(), **state)
+
+    def _replay_journal(self, state):
+        try:
+            with open(self.journal_path, "r") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return state
+        except OSError as e:
+            logger.warning(f"Ignoring unreadable app state journal {self.journal_path}: {str(e)}")
+            return state
+
+        for line in lines:
+            if not line.endswith("\n"):
+                # A record still being written, or cut short by a crash
+                continue
+            try:
+                apply_change(state, json.loads(line))
+            except (ValueError, KeyError, TypeError) as e:
+                metrics.count("app_state.skipped")
+                logger.warning(f"Skipping corrupt app state journal record: {str(e)}")
+        return state
+
+    def load(self):
+        """
+        Return the persisted app state
+
+        Returns:
+        --------
+        dict
+            The snapshot with every journalled change applied, or an empty
+            state if nothing was persisted yet
+        """
+        with self._locked():
+            return self._replay_journal(self._read_snapshot())
+
+    def record(self, op, **fields):
+        """
+        Append one change to the journal, compacting it if it has grown too large
+
+        Parameters:
+        -----------
+        op : str
+            'scan', 'report', 'findings', 'key_images' or 'current', see apply_change
+        **fields
+            The record's fields
+
+        Returns:
+        --------
+        bool
+            True if the change was persisted
+        """
+        line = (json.dumps(dict(fields, op=op), separators=(",", ":")) + "\n").encode()
+        try:
+            with self._locked():
+                fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, line)
+                    size = os.fstat(fd).st_size
+                finally:
+                    os.close(fd)
+        except OSError as e:
+            logger.warning(f"Could not persist app state change: {str(e)}")
+            return False
+        metrics.count("app_state.append")
+
+        if size > self.compact_bytes:
+            self.compact()
+        return True
+
+    @timed("app_state.compact")
+    def compact(self):
+        """Fold the journal into a new snapshot and empty it"""
+        with self._lock:
+            try:
+                with self._locked(exclusive=True):
+                    # Another worker may have compacted while we waited for the lock
+                    if not os.path.exists(self.journal_path) or not os.path.getsize(self.journal_path):
+                        return
+                    state = self._replay_journal(self._read_snapshot())
+                    directory = os.path.dirname(os.path.abspath(self.path))
+                    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+                    try:
+                        with os.fdopen(fd, "w") as f:
+                            json.dump(state, f)
+                            f.flush()
+                            os.fsync(f.fileno())
+                        os.replace(tmp_path, self.path)
+                    except BaseException:
+                        if os.path.exists(tmp_path):
+                            os.remove(tmp_path)
+                        raise
+                    # A crash before this point only leaves records to be replayed again
+                    os.truncate(self.journal_path, 0)
+            except OSError as e:
+                logger.warning(f"Could not compact app state: {str(e)}")
+                return
+        metrics.count("app_state.compact")
+
+# The app state of every session and worker on this host
+app_state = AppStateStore(APP_STATE_PATH, APP_STATE_JOURNAL_PATH)
@@ -1,12 +1,14 @@
 import os
+import hashlib
 import streamlit as st
 from datetime import datetime
 from config import DATA_DIR
-from CTPA_App_Frontend.utils.notification import add_notification
+from utils.notification import add_notification
+from utils.session import add_uploaded_scan
 
 def is_valid_file_type(filename):
     """
-    Check if the file is a valid NIfTI file
+    Check if the file is a valid NIfTI, NumPy (.npz) or DICOM (.dcm or zipped series) file
     
     Parameters:
     -----------
@@ -16,9 +18,31 @@ def is_valid_file_type(filename):
     Returns:
     --------
     bool
-        True if the file is a valid NIfTI file, False otherwise
+        True if the file is a supported scan file, False otherwise
     """
-    return filename.lower().endswith(('.nii', '.nii.gz'))
+    return filename.lower().endswith(('.nii', '.nii.gz', '.npz', '.dcm', '.zip'))
+
+def compute_file_hash(file_path, chunk_size=1024 * 1024):
+    """
+    Compute the SHA-256 content hash of a file
+    
+    Parameters:
+    -----------
+    file_path : str
+        The path to the file
+    chunk_size : int
+        Number of bytes read at a time
+        
+    Returns:
+    --------
+    str
+        The hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 def save_uploaded_scan(uploaded_file):
     """
@@ -53,7 +77,7 @@ def save_uploaded_scan(uploaded_file):
         }
         
         if original_filename not in [scan["filename"] for scan in st.session_state.uploaded_scans]:
-            st.session_state.uploaded_scans.append(scan_info)
+            add_uploaded_scan(scan_info)
             st.session_state.reports[original_filename] = ""
         
         return file_path
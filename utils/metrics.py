@@ -0,0 +1,157 @@
+import json
+import math
+import threading
+import time
+from collections import deque
+from contextlib import ContextDecorator
+from config import METRICS_BUFFER_SIZE, METRICS_BUCKETS_MS
+
+class MetricsStore:
+    """
+    Process-wide store of timing spans
+
+    Each span name keeps its most recent durations in a ring buffer for
+    percentiles, plus cumulative histogram counters that never drop samples.
+    Plain event counters (cache hits, misses, ...) are kept alongside.
+    """
+
+    def __init__(self, buffer_size=METRICS_BUFFER_SIZE, buckets_ms=METRICS_BUCKETS_MS):
+        self.buffer_size = buffer_size
+        self.buckets_ms = tuple(buckets_ms)
+        self._lock = threading.Lock()
+        self._spans = {}
+        self._counters = {}
+
+    def count(self, name, n=1):
+        """Increment an event counter"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def counters(self):
+        """Return a snapshot of all event counters"""
+        with self._lock:
+            return dict(sorted(self._counters.items()))
+
+    def record(self, name, seconds):
+        """Record one duration for a span"""
+        ms = seconds * 1000
+        with self._lock:
+            span = self._spans.get(name)
+            if span is None:
+                span = self._spans[name] = {
+                    "recent": deque(maxlen=self.buffer_size),
+                    "buckets": [0] * (len(self.buckets_ms) + 1),
+                    "count": 0,
+                    "sum_ms": 0.0,
+                }
+            span["recent"].append(ms)
+            span["count"] += 1
+            span["sum_ms"] += ms
+            for i, bound in enumerate(self.buckets_ms):
+                if ms <= bound:
+                    span["buckets"][i] += 1
+                    break
+            else:
+                span["buckets"][-1] += 1
+
+    def summary(self):
+        """
+        Summarize all spans
+
+        Returns:
+        --------
+        dict
+            Span name to count, mean and recent p50/p95/p99/max in milliseconds
+        """
+        with self._lock:
+            snapshot = {name: (sorted(span["recent"]), span["count"], span["sum_ms"])
+                        for name, span in self._spans.items()}
+
+        summary = {}
+        for name, (recent, count, sum_ms) in sorted(snapshot.items()):
+            summary[name] = {
+                "count": count,
+                "mean_ms": sum_ms / count if count else 0.0,
+                "p50_ms": _percentile(recent, 50),
+                "p95_ms": _percentile(recent, 95),
+                "p99_ms": _percentile(recent, 99),
+                "max_ms": recent[-1] if recent else 0.0,
+            }
+        return summary
+
+    def export_json(self):
+        """Export summaries and histograms as a JSON string"""
+        with self._lock:
+            histograms = {name: list(span["buckets"]) for name, span in self._spans.items()}
+        payload = {
+            "buckets_ms": list(self.buckets_ms),
+            "spans": {
+                name: dict(stats, histogram=histograms.get(name, []))
+                for name, stats in self.summary().items()
+            },
+            "counters": self.counters(),
+        }
+        return json.dumps(payload, indent=2)
+
+    def export_prometheus(self):
+        """Export histograms in the Prometheus text exposition format"""
+        with self._lock:
+            snapshot = {name: (list(span["buckets"]), span["count"], span["sum_ms"])
+                        for name, span in self._spans.items()}
+
+        lines = [
+            "# HELP ctpa_span_duration_seconds Duration of instrumented operations",
+            "# TYPE ctpa_span_duration_seconds histogram",
+        ]
+        for name, (buckets, count, sum_ms) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets_ms, buckets):
+                cumulative += n
+                lines.append(f'ctpa_span_duration_seconds_bucket{{span="{name}",le="{bound / 1000:g}"}} {cumulative}')
+            lines.append(f'ctpa_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {count}')
+            lines.append(f'ctpa_span_duration_seconds_sum{{span="{name}"}} {sum_ms / 1000:.6f}')
+            lines.append(f'ctpa_span_duration_seconds_count{{span="{name}"}} {count}')
+
+        lines += [
+            "# HELP ctpa_events_total Count of instrumented events",
+            "# TYPE ctpa_events_total counter",
+        ]
+        for name, value in self.counters().items():
+            lines.append(f'ctpa_events_total{{event="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+
+class timed(ContextDecorator):
+    """
+    Time a block or function as a named span
+
+    Usable as ``with timed("render.apply_window"):`` or as a decorator.
+    """
+
+    def __init__(self, name, store=None):
+        self.name = name
+        self.store = store
+
+    def _recreate_cm(self):
+        # A fresh instance per call keeps concurrent decorated calls independent
+        return timed(self.name, self.store)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        (self.store or metrics).record(self.name, time.perf_counter() - self._start)
+        return False
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(1, math.ceil(pct / 100 * len(sorted_values))) - 1]
+
+# Shared by every session in the process
+metrics = MetricsStore()
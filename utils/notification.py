@@ -1,17 +1,25 @@
 import streamlit as st
 import time
+from config import SESSION_MAX_NOTIFICATIONS
 
 def add_notification(message, type="info"):
-    """Add a notification to the queue"""
+    """Add a notification to the queue, keeping at most SESSION_MAX_NOTIFICATIONS"""
     if 'notifications' not in st.session_state:
         st.session_state.notifications = []
     
+    notifications = st.session_state.notifications
+    # The same message twice in a row is shown once
+    if notifications and notifications[-1]["message"] == message and notifications[-1]["type"] == type:
+        notifications[-1]["time"] = time.time()
+        return
+    
     # Add notification with timestamp
-    st.session_state.notifications.append({
+    notifications.append({
         "message": message,
         "type": type,
         "time": time.time()
     })
+    del notifications[:-SESSION_MAX_NOTIFICATIONS]
 
 def check_notifications():
     """Check and display any pending notifications"""
@@ -1,19 +1,42 @@
 import streamlit as st
+import hashlib
+import logging
+import os
+import sys
+import uuid
+from concurrent.futures import Future
+from datetime import datetime
+from config import (
+    DEFAULT_WINDOW_CENTER, DEFAULT_WINDOW_WIDTH, SESSION_MEMORY_BUDGET_BYTES, SESSION_MAX_CHAT_MESSAGES
+)
+from core.findings import Findings, findings_store
+from core.key_images import KeyImage, cache_thumbnail
+from core.slice_source import compress_idle_volumes, hold_volume, local_volume, resident_bytes
+from utils.app_state import app_state
+from utils.metrics import metrics
+from utils.shared_cache import chat_store, report_store
+
+logger = logging.getLogger(__name__)
 
 def initialize_session_state():
-    """Initialize session state variables"""
-    if 'uploaded_scans' not in st.session_state:
-        st.session_state.uploaded_scans = []
-    
-    if 'current_scan' not in st.session_state:
-        st.session_state.current_scan = None
-    
-    if 'reports' not in st.session_state:
-        st.session_state.reports = {}
+    """Initialize session state variables, restoring scans and reports persisted before a restart"""
+    if any(key not in st.session_state for key in ('uploaded_scans', 'current_scan', 'reports', 'key_images')):
+        persisted = app_state.load()
+        st.session_state.setdefault('uploaded_scans', persisted["uploaded_scans"])
+        st.session_state.setdefault('current_scan', persisted["current_scan"])
+        st.session_state.setdefault('reports', persisted["reports"])
+        restore_findings(persisted["reports"], persisted["findings"])
+        st.session_state.setdefault('key_images', {
+            scan_id: [KeyImage.from_dict(key_image) for key_image in key_images]
+            for scan_id, key_images in persisted["key_images"].items()
+        })
     
     if 'chat_history' not in st.session_state:
         st.session_state.chat_history = {}
     
+    if 'chat_handles' not in st.session_state:
+        st.session_state.chat_handles = {}
+    
     if 'scan_data' not in st.session_state:
         st.session_state.scan_data = {}
     
@@ -21,10 +44,10 @@ def initialize_session_state():
         st.session_state.current_view = 'axial'
     
     if 'window_width' not in st.session_state:
-        st.session_state.window_width = 1500  # Default pulmonary window
+        st.session_state.window_width = DEFAULT_WINDOW_WIDTH
     
     if 'window_center' not in st.session_state:
-        st.session_state.window_center = -600  # Default pulmonary window
+        st.session_state.window_center = DEFAULT_WINDOW_CENTER
 
     if 'axial_slice' not in st.session_state:
         st.session_state.axial_slice = 0
@@ -36,4 +59,336 @@ def initialize_session_state():
         st.session_state.coronal_slice = 0
     
     if 'notifications' not in st.session_state:
-        st.session_state.notifications = []
\ No newline at end of file
+        st.session_state.notifications = []
+
+def add_uploaded_scan(scan_info):
+    """
+    Add a scan to this session's uploaded scans and persist it in the app state
+    
+    Parameters:
+    -----------
+    scan_info : dict
+        The scan's metadata, with a scan_id or filename
+    """
+    scans = st.session_state.setdefault('uploaded_scans', [])
+    key = scan_info.get("scan_id") or scan_info.get("filename")
+    scans[:] = [scan for scan in scans if (scan.get("scan_id") or scan.get("filename")) != key]
+    scans.append(scan_info)
+    app_state.record("scan", scan=scan_info)
+
+def set_current_scan(scan_id):
+    """Make a scan the one shown, persisting the choice in the app state"""
+    if st.session_state.get('current_scan') != scan_id:
+        app_state.record("current", scan_id=scan_id)
+    st.session_state.current_scan = scan_id
+
+def set_report(scan_id, report_html):
+    """
+    Store a scan's report in the shared report store and keep only its digest in the session
+    
+    The digest is also persisted in the app state, and the report store
+    keeps every report on disk, so the report is shown again after a restart.
+    
+    Parameters:
+    -----------
+    scan_id : str
+        The scan identifier
+    report_html : str
+        The report HTML
+    """
+    key = hashlib.sha256(report_html.encode()).hexdigest()
+    report_store.put(key, report_html)
+    reports = st.session_state.setdefault('reports', {})
+    if reports.get(scan_id) != key:
+        app_state.record("report", scan_id=scan_id, report=key)
+    reports[scan_id] = key
+
+def set_findings(scan_id, findings):
+    """
+    Index a scan's findings in core.findings.findings_store and persist them in the app state
+    
+    Parameters:
+    -----------
+    scan_id : str
+        The scan identifier
+    findings : Findings
+        The findings of the scan's report
+    """
+    findings_store.put(scan_id, findings)
+    app_state.record("findings", scan_id=scan_id, findings=findings.to_dict())
+
+def restore_findings(reports, findings):
+    """
+    Rebuild findings_store after a restart or in another worker process
+    
+    Persisted findings are used as they are; reports persisted without
+    them, e.g. before findings were recorded, are parsed once instead.
+    
+    Parameters:
+    -----------
+    reports : dict
+        Scan ID to report digest, as persisted in the app state
+    findings : dict
+        Scan ID to findings dict, as persisted in the app state
+    """
+    for scan_id, data in findings.items():
+        findings_store.put(scan_id, Findings.from_dict(data))
+    for scan_id, key in reports.items():
+        if scan_id in findings or findings_store.get(scan_id) is not None or not key:
+            continue
+        report_html = key if "<" in key else report_store.get(key)
+        if report_html:
+            findings_store.put(scan_id, Findings.from_report_html(report_html))
+
+def get_report(scan_id):
+    """
+    Return the report HTML of a scan in this session
+    
+    Returns:
+    --------
+    str or None
+        The report, or None if none was generated or its file was removed
+        from the report store
+    """
+    key = st.session_state.get('reports', {}).get(scan_id)
+    if not key:
+        return None
+    if len(key) != 64 or "<" in key:
+        # HTML stored directly in the session moves to the report store
+        set_report(scan_id, key)
+        return key
+    report_html = report_store.get(key)
+    if report_html is None:
+        logger.warning(f"Report for {scan_id} is no longer in the report store")
+        st.session_state.reports[scan_id] = ""
+    return report_html
+
+def session_reports():
+    """Return {scan_id: report HTML} for every report in this session"""
+    reports = {}
+    for scan_id in list(st.session_state.get('reports', {})):
+        report_html = get_report(scan_id)
+        if report_html:
+            reports[scan_id] = report_html
+    return reports
+
+def key_images(scan_id):
+    """Return the key images attached to a scan's report in this session, in capture order"""
+    return list(st.session_state.setdefault('key_images', {}).get(scan_id, []))
+
+def _set_key_images(scan_id, images):
+    st.session_state.setdefault('key_images', {})[scan_id] = images
+    app_state.record("key_images", scan_id=scan_id, key_images=[key_image.to_dict() for key_image in images])
+
+def add_key_image(key_image, image=None):
+    """
+    Attach a key image to its scan's report and persist it in the app state
+    
+    Like reports, key images belong to this session, so removing one here
+    does not remove it from other sessions.
+    
+    Parameters:
+    -----------
+    key_image : KeyImage
+        The reference to attach
+    image : bytes, str or numpy.ndarray, optional
+        The slice as displayed; when given, its thumbnail is cached now
+    
+    Returns:
+    --------
+    bool
+        False if the same image was already attached
+    """
+    images = key_images(key_image.scan_id)
+    if key_image in images:
+        return False
+    _set_key_images(key_image.scan_id, images + [key_image])
+    if image is not None:
+        cache_thumbnail(key_image, image)
+    return True
+
+def remove_key_image(key_image):
+    """Detach a key image from its scan's report in this session"""
+    images = key_images(key_image.scan_id)
+    if key_image in images:
+        images.remove(key_image)
+        _set_key_images(key_image.scan_id, images)
+
+def chat_messages(scan_id):
+    """
+    Return the latest SESSION_MAX_CHAT_MESSAGES of a scan's chat, oldest first
+    
+    The session keeps only these; if they were dropped to fit the session's
+    memory budget, they are read back from the chat store.
+    """
+    chats = st.session_state.setdefault('chat_history', {})
+    if scan_id not in chats:
+        handle = st.session_state.setdefault('chat_handles', {}).get(scan_id)
+        chats[scan_id] = chat_store.read(handle, last=SESSION_MAX_CHAT_MESSAGES) if handle else []
+    return chats[scan_id]
+
+def chat_transcript(scan_id):
+    """Return the whole chat history of a scan in this session, oldest first"""
+    handle = st.session_state.get('chat_handles', {}).get(scan_id)
+    return chat_store.read(handle) if handle else list(chat_messages(scan_id))
+
+def add_chat_message(scan_id, role, content):
+    """
+    Append a chat message to the scan's history in the chat store, keeping
+    only the last SESSION_MAX_CHAT_MESSAGES in the session
+    """
+    messages = chat_messages(scan_id)
+    message = {"role": role, "content": content, "time": datetime.now().strftime("%H:%M")}
+    handles = st.session_state.setdefault('chat_handles', {})
+    if scan_id not in handles:
+        handles[scan_id] = uuid.uuid4().hex
+        # Messages from before the session had a handle start the stored history
+        for earlier in messages:
+            chat_store.append(handles[scan_id], earlier)
+    chat_store.append(handles[scan_id], message)
+    messages.append(message)
+    del messages[:-SESSION_MAX_CHAT_MESSAGES]
+
+def open_scan_volume(scan_id, volume, file_path=None):
+    """
+    Make a loaded volume the scan's local volume without storing it in the session
+    
+    The volume is held process-wide by core.slice_source; the session keeps
+    only the file it came from, so it can be reopened if it is released.
+    
+    Parameters:
+    -----------
+    scan_id : str
+        The scan identifier
+    volume : array-like
+        The scan in HU, shaped (x, y, z)
+    file_path : str, optional
+        The scan file the volume was loaded from
+    """
+    hold_volume(scan_id, volume, _file_content_key(file_path))
+    st.session_state.setdefault('scan_data', {})[scan_id] = {"path": file_path}
+
+def _file_content_key(file_path):
+    """The content hash slices of a volume read from file_path are shared under, or None"""
+    if not file_path or not os.path.isfile(file_path):
+        return None
+    from core.volume_cache import scan_cache_key
+    try:
+        return scan_cache_key(file_path)
+    except OSError as e:
+        logger.warning(f"Could not hash {file_path}: {str(e)}")
+        return None
+
+def session_volume(scan_id):
+    """
+    Return the local volume of a scan opened in this session
+    
+    Returns:
+    --------
+    array-like or None
+        The volume, reopened from its file if it had been released, or
+        None if the scan has no local volume
+    """
+    scan_data = st.session_state.get('scan_data', {})
+    handle = scan_data.get(scan_id)
+    if handle is None:
+        return None
+    if not isinstance(handle, dict):
+        # A volume stored directly in the session moves to the process-wide holder
+        open_scan_volume(scan_id, handle)
+        return handle
+    
+    volume = local_volume(scan_id)
+    content_key = None
+    if volume is None and handle.get("path"):
+        from core.scan_loader import load_scan, get_scan_data
+        scan = load_scan(handle["path"])
+        volume = get_scan_data(scan) if scan is not None else None
+        content_key = _file_content_key(handle["path"])
+    if volume is None:
+        del scan_data[scan_id]
+        return None
+    hold_volume(scan_id, volume, content_key)
+    return volume
+
+def _estimate_bytes(value, depth=0):
+    """Rough memory held by a session state value"""
+    import numpy as np
+    if isinstance(value, np.ndarray) or hasattr(value, "loaded_slices"):
+        return resident_bytes(value)
+    if isinstance(value, (str, bytes, bytearray)):
+        return sys.getsizeof(value)
+    if isinstance(value, Future):
+        return _estimate_bytes(value.result(), depth) if value.done() and not value.exception() else 0
+    size = sys.getsizeof(value)
+    if depth < 4:
+        if isinstance(value, dict):
+            size += sum(_estimate_bytes(k, depth + 1) + _estimate_bytes(v, depth + 1) for k, v in value.items())
+        elif isinstance(value, (list, tuple, set)):
+            size += sum(_estimate_bytes(item, depth + 1) for item in value)
+    return size
+
+def session_footprint(state=None):
+    """
+    Estimate the memory held by each session state entry
+    
+    Parameters:
+    -----------
+    state : mapping, optional
+        The state to measure, defaults to this session's
+    
+    Returns:
+    --------
+    dict
+        Entry name to estimated bytes, largest first
+    """
+    state = st.session_state if state is None else state
+    sizes = {str(key): _estimate_bytes(state[key]) for key in list(state.keys())}
+    return dict(sorted(sizes.items(), key=lambda item: -item[1]))
+
+def enforce_session_budget(budget=SESSION_MEMORY_BUDGET_BYTES):
+    """
+    Keep this session's state within its memory budget
+    
+    Finished PDF exports go first, since they can be exported again, then
+    the session's copies of the chats of scans other than the current one,
+    oldest first; the chat store keeps every message, and chat_messages
+    reads them back when the scan is opened again.
+    Evictions are counted in utils.metrics under session.*. Since it runs on
+    every page run, it also sweeps this process's idle held volumes into
+    compressed ones (core.slice_source.compress_idle_volumes).
+    
+    Parameters:
+    -----------
+    budget : int
+        The budget in bytes
+    
+    Returns:
+    --------
+    int
+        The estimated footprint after enforcement
+    """
+    compress_idle_volumes()
+    total = sum(session_footprint().values())
+    if total <= budget:
+        return total
+    
+    exports = st.session_state.get('pdf_exports', {})
+    for key in [key for key, job in exports.items() if job.done()]:
+        total -= _estimate_bytes(exports.pop(key))
+        metrics.count("session.evicted.pdf_export")
+        if total <= budget:
+            return total
+    
+    chats = st.session_state.get('chat_history', {})
+    handles = st.session_state.get('chat_handles', {})
+    for scan_id in [scan_id for scan_id in chats
+                    if scan_id in handles and scan_id != st.session_state.get('current_scan')]:
+        total -= _estimate_bytes(chats.pop(scan_id))
+        metrics.count("session.evicted.chat_history")
+        if total <= budget:
+            return total
+    
+    metrics.count("session.over_budget")
+    logger.warning(f"Session state is {total / 1024 ** 2:.1f} MB, over its {budget / 1024 ** 2:.1f} MB budget")
+    return total
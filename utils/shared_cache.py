@@ -0,0 +1,313 @@
+import os
+import hashlib
+import json
+import logging
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from config import (
+    SHARED_CACHE_DIR, SHARED_CACHE_MAX_BYTES, METADATA_CACHE_MAX_BYTES, REPORT_STORE_DIR, REPORT_STORE_MEMORY_BYTES,
+    CHAT_STORE_DIR
+)
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+def _cache_stats(name):
+    counters = metrics.counters()
+    hits = counters.get(f"shared_cache.{name}.hit", 0)
+    misses = counters.get(f"shared_cache.{name}.miss", 0)
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        "writes": counters.get(f"shared_cache.{name}.write", 0),
+        "evictions": counters.get(f"shared_cache.{name}.eviction", 0),
+    }
+
+class SharedCache:
+    """
+    Size-limited disk cache shared by every session and worker on one host
+
+    Each entry is one pickled file named after the hash of its key. Writes go
+    to a temporary file in the same directory and are renamed into place, so
+    concurrent processes never read a partial entry. Modification times act
+    as the LRU clock: hits bump them, and once the directory grows past its
+    limit the oldest entries are removed until it is back under 90% of it.
+    Hits, misses, writes and evictions are counted in utils.metrics under
+    ``shared_cache.<name>.*``.
+    """
+
+    def __init__(self, name, max_bytes=SHARED_CACHE_MAX_BYTES, directory=None):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.directory = directory or os.path.join(SHARED_CACHE_DIR, name)
+        self._lock = threading.Lock()
+        self._written_since_check = None  # None forces a size check on the first write
+
+    def _path(self, key):
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}.pkl")
+
+    def get(self, key):
+        """
+        Return the cached value for a key, or None
+
+        Parameters:
+        -----------
+        key : tuple
+            Any value with a stable repr, e.g. (scan_id, view, slice_idx)
+
+        Returns:
+        --------
+        object or None
+            The cached value
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            metrics.count(f"shared_cache.{self.name}.miss")
+            return None
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            logger.warning(f"Dropping unreadable {self.name} cache entry: {str(e)}")
+            self._remove(path)
+            metrics.count(f"shared_cache.{self.name}.miss")
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        metrics.count(f"shared_cache.{self.name}.hit")
+        return value
+
+    def put(self, key, value):
+        """Store a value under a key, replacing any previous entry"""
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                size = f.tell()
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write {self.name} cache entry: {str(e)}")
+            return
+        metrics.count(f"shared_cache.{self.name}.write")
+
+        with self._lock:
+            if self._written_since_check is not None:
+                self._written_since_check += size
+            # Scanning the directory is not free, so only re-check once
+            # roughly a tenth of the limit has been written by this process
+            check = self._written_since_check is None or self._written_since_check > self.max_bytes // 10
+            if check:
+                self._written_since_check = 0
+        if check:
+            self.enforce_limit()
+
+    def enforce_limit(self):
+        """Evict least recently used entries until the cache fits its limit"""
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            if self._remove(path):
+                total -= size
+                metrics.count(f"shared_cache.{self.name}.eviction")
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def stats(self):
+        """Hits, misses and hit rate seen by this process"""
+        return _cache_stats(self.name)
+
+# Decoded backend slices, keyed like the in-process slice cache in core.slice_source
+slice_cache = SharedCache("slices")
+
+# Scan metadata, one entry per (API URL, scan ID)
+metadata_cache = SharedCache("metadata", max_bytes=METADATA_CACHE_MAX_BYTES)
+
+class ReportStore:
+    """
+    Durable store of report HTML keyed by its SHA-256 digest
+
+    Sessions and the app state only keep the digest, so unlike the shared
+    caches nothing here may be evicted from disk: each report is written
+    once to ``<digest>.html`` (atomically, through a temporary file and a
+    rename) and kept. Only the in-memory copies of recently used reports
+    are bounded, least recently used first. Counters use the same
+    ``shared_cache.<name>.*`` names as SharedCache, where an eviction means
+    a report dropped from memory.
+    """
+
+    def __init__(self, name="reports", directory=REPORT_STORE_DIR, memory_bytes=REPORT_STORE_MEMORY_BYTES):
+        self.name = name
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest[:2], f"{digest}.html")
+
+    def get(self, digest):
+        """
+        Return the report HTML stored under a digest, or None
+
+        Parameters:
+        -----------
+        digest : str
+            SHA-256 hex digest of the report HTML
+
+        Returns:
+        --------
+        str or None
+            The report HTML
+        """
+        with self._lock:
+            report_html = self._memory.get(digest)
+            if report_html is not None:
+                self._memory.move_to_end(digest)
+        if report_html is None:
+            try:
+                with open(self._path(digest), encoding="utf-8") as f:
+                    report_html = f.read()
+            except FileNotFoundError:
+                metrics.count(f"shared_cache.{self.name}.miss")
+                return None
+            except OSError as e:
+                logger.warning(f"Could not read {self.name} entry {digest}: {str(e)}")
+                metrics.count(f"shared_cache.{self.name}.miss")
+                return None
+            self._remember(digest, report_html)
+        metrics.count(f"shared_cache.{self.name}.hit")
+        return report_html
+
+    def put(self, digest, report_html):
+        """Store report HTML under its digest; an existing report is left as is"""
+        path = self._path(digest)
+        if not os.path.exists(path):
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(report_html)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                # Still served from memory for as long as this process keeps it
+                logger.warning(f"Could not write {self.name} entry {digest}: {str(e)}")
+            else:
+                metrics.count(f"shared_cache.{self.name}.write")
+        self._remember(digest, report_html)
+
+    def _remember(self, digest, report_html):
+        size = len(report_html)
+        with self._lock:
+            if digest in self._memory:
+                self._memory.move_to_end(digest)
+                return
+            self._memory[digest] = report_html
+            self._memory_used += size
+            while self._memory_used > self.memory_bytes and len(self._memory) > 1:
+                _, dropped = self._memory.popitem(last=False)
+                self._memory_used -= len(dropped)
+                metrics.count(f"shared_cache.{self.name}.eviction")
+
+    def stats(self):
+        """Hits, misses and hit rate seen by this process"""
+        return _cache_stats(self.name)
+
+class ChatStore:
+    """
+    Durable, append-only chat histories
+
+    Each history is a file of JSON lines named after its handle, which the
+    session keeps in place of the messages. Appends are single writes to a
+    file opened for appending, so they are never interleaved, and nothing is
+    ever evicted: the session's copy of the latest messages can be dropped
+    at any time and read back from here.
+    """
+
+    def __init__(self, name="chats", directory=CHAT_STORE_DIR):
+        self.name = name
+        self.directory = directory
+
+    def _path(self, handle):
+        return os.path.join(self.directory, f"{handle}.jsonl")
+
+    def append(self, handle, message):
+        """Append a message (a JSON-serializable dict) to a history"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path(handle), "a", encoding="utf-8") as f:
+                f.write(json.dumps(message) + "\n")
+        except OSError as e:
+            logger.warning(f"Could not append to {self.name} entry {handle}: {str(e)}")
+            return
+        metrics.count(f"shared_cache.{self.name}.write")
+
+    def read(self, handle, last=None):
+        """
+        Return the messages of a history, oldest first
+
+        Parameters:
+        -----------
+        handle : str
+            The history's handle
+        last : int, optional
+            Return only this many of the latest messages
+
+        Returns:
+        --------
+        list
+            The messages; empty if the history does not exist
+        """
+        try:
+            with open(self._path(handle), encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            metrics.count(f"shared_cache.{self.name}.miss")
+            return []
+        except OSError as e:
+            logger.warning(f"Could not read {self.name} entry {handle}: {str(e)}")
+            metrics.count(f"shared_cache.{self.name}.miss")
+            return []
+        metrics.count(f"shared_cache.{self.name}.hit")
+        messages = []
+        for line in lines if last is None else lines[-last:]:
+            try:
+                messages.append(json.loads(line))
+            except ValueError:
+                continue  # A write cut short by a crash
+        return messages
+
+# Report HTML keyed by its SHA-256, so sessions only hold the digest
+report_store = ReportStore()
+
+# Chat histories by handle, so sessions only hold the latest messages
+chat_store = ChatStore()